@@ -0,0 +1,107 @@
+"""
+tracker announces per second, http against udp
+
+runs the stand-in trackers in a child process and announces a
+number of distinct torrents to them, a few at a time, over http
+with a fresh connection per announce, over http through one
+keep-alive HttpPool and over udp with the cached connection id
+
+usage: python3 -m Benchmarks.announce [torrents] [concurrency]
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import time
+from multiprocessing import Process
+from Controllers import HttpPool, Tracker, UdpTracker
+from Models import TorrentFile
+from Benchmarks.trackers import serve
+
+
+class Torrent:
+    """ just what an announce needs """
+
+    def __init__(self, number):
+        self.info_hash = number.to_bytes(20, 'big')
+
+    def get_info_hash(self):
+        return self.info_hash
+
+    @staticmethod
+    def peer_id():
+        return TorrentFile.peer_id()
+
+
+def free_port():
+    with socket.socket() as tcp, socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+        tcp.bind(('127.0.0.1', 0))
+        port = tcp.getsockname()[1]
+        udp.bind(('127.0.0.1', port))
+        return port
+
+
+async def announce_all(trackers, concurrency):
+    """ :returns: announces per second """
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def announce(number, tracker):
+        async with semaphore:
+            await tracker.announce(port=10000 + number % 50000, left=number)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(announce(number, tracker) for number, tracker in enumerate(trackers)))
+    return len(trackers) / (time.perf_counter() - started)
+
+
+async def run(port, count, concurrency):
+    torrents = [Torrent(number) for number in range(count)]
+    http = f'http://127.0.0.1:{port}/announce'
+    udp = f'udp://127.0.0.1:{port}/announce'
+
+    # a new pool per torrent, every announce opens a connection
+    trackers = [Tracker(http, torrent) for torrent in torrents]
+    rate = await announce_all(trackers, concurrency)
+    for tracker in trackers:
+        tracker.close()
+    print(f'http, new connections: {rate:>8.0f} announces/s')
+
+    pool = HttpPool()
+    trackers = [Tracker(http, torrent, pool) for torrent in torrents]
+    rate = await announce_all(trackers, concurrency)
+    pool.close()
+    print(f'http, keep-alive pool: {rate:>8.0f} announces/s')
+
+    trackers = [UdpTracker(udp, torrent) for torrent in torrents]
+    rate = await announce_all(trackers, concurrency)
+    for tracker in trackers:
+        tracker.close()
+    print(f'udp:                   {rate:>8.0f} announces/s')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    port = free_port()
+
+    tracker = Process(target=serve, args=(port,), daemon=True)
+    tracker.start()
+    try:
+        # wait for the stand-ins to listen
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+
+        print(f'{count} torrents, {concurrency} announces at a time, {os.cpu_count()} cores')
+        asyncio.new_event_loop().run_until_complete(run(port, count, concurrency))
+    finally:
+        tracker.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+download tail latency with and without endgame mode
+
+one fast and one slow seeder run on loopback, the slow one
+sleeps before every block. reports the total time and the time
+spent on the last 5% of the pieces
+
+usage: python3 -m Benchmarks.endgame [size MiB] [piece KiB] [slow delay ms]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from time import perf_counter
+from Models import TorrentFile, RequestQueue, RequestState
+from Controllers import (
+    ClientConnection, SeedConnection, FileReader, FileWriter,
+    HashVerifier, PeerProtocol, Recheck, Storage
+)
+from Benchmarks.synthetic import make_payload, make_torrent
+
+
+class SlowReader(FileReader):
+
+    delay = 0.0
+
+    async def send(self, protocol, piece, offset, length, header):
+        await asyncio.sleep(self.delay)
+        return await super().send(protocol, piece, offset, length, header)
+
+
+async def start_seeder(torrent, payload_path, delay):
+    info = torrent.get_info()
+    storage = Storage.from_torrent(torrent, payload_path)
+    file_reader = SlowReader(storage, info.piece_length(), cache_size=0)
+    file_reader.delay = delay
+    bitfield = Recheck(storage, torrent).run().to_bytes()
+
+    async def seed_client(protocol):
+        conn = SeedConnection(torrent, bitfield, file_reader)
+        try:
+            await conn.start(protocol)
+        except Exception:
+            await conn.gracefully_shutdown()
+
+    server = await PeerProtocol.start_server(seed_client, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def download_client(peer, torrent, request_queue):
+    conn = ClientConnection(peer[0], peer[1], torrent, request_queue)
+    try:
+        conn.am_interested = True
+        await conn.connect()
+    except Exception:
+        await conn.gracefully_shutdown()
+
+
+async def watch(request_queue, marks):
+    """ note when 95% of the pieces are done """
+    total = len(request_queue.pieces)
+    while True:
+        done = sum(1 for state in request_queue.pieces.values() if state == RequestState.available)
+        if done >= total * 0.95 and 'tail' not in marks:
+            marks['tail'] = perf_counter()
+        await asyncio.sleep(0.005)
+
+
+def run(torrent_path, payload_path, delays, endgame):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    RequestQueue.ENDGAME = endgame
+
+    torrent = TorrentFile(torrent_path)
+    servers = [
+        loop.run_until_complete(start_seeder(torrent, payload_path, delay))
+        for delay in delays
+    ]
+
+    file_writer = FileWriter(torrent, loop)
+    verifier = HashVerifier(loop)
+    verifier.start()
+    request_queue = RequestQueue(torrent, file_writer, verifier)
+
+    marks = {'start': perf_counter()}
+    loop.create_task(watch(request_queue, marks))
+    for _, port in servers:
+        loop.create_task(download_client(('127.0.0.1', port), torrent, request_queue))
+
+    # the writer stops the loop once the file is complete
+    loop.create_task(file_writer.worker())
+    loop.run_forever()
+    end = perf_counter()
+    for server, _ in servers:
+        server.close()
+
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+
+    with open(payload_path, 'rb') as expected, open(file_writer.path, 'rb') as actual:
+        assert expected.read() == actual.read(), 'payload mismatch'
+    os.remove(file_writer.path)
+
+    return end - marks['start'], end - marks.get('tail', end)
+
+
+def main(size_mib=16, piece_kib=256, delay_ms=50):
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        make_payload('payload.bin', size_mib * 1024 * 1024)
+        make_torrent('payload.bin', 'payload.torrent', piece_kib * 1024, name='download.bin')
+
+        results = {}
+        for endgame in (False, True):
+            results[endgame] = run(
+                'payload.torrent', 'payload.bin', (0.0, delay_ms / 1000), endgame
+            )
+
+    print()
+    for endgame, (total, tail) in results.items():
+        name = 'endgame' if endgame else 'no endgame'
+        print(f'{name:>10}: total {total:.3f}s | last 5% of pieces {tail:.3f}s')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
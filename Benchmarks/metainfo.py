@@ -0,0 +1,89 @@
+"""
+metainfo parsing and lookups on a large .torrent
+
+writes a multi-file .torrent with 200k made up piece hashes and
+times loading it, which hashes the info dictionary once, the info hash and get_info() with a piece hash
+lookup, the calls every handshake and verified piece make. the
+old way, decoding with the bencode.py package, re-encoding the info
+dict for its hash and splitting the hashes into a list on every
+get_info(), is timed next to it when the package is installed
+
+usage: python3 -m Benchmarks.metainfo [pieces] [files]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from hashlib import sha1
+from Models import TorrentFile
+from Utils import bencoding, chunks
+
+
+def make_large_torrent(path, pieces, files, piece_length=1 << 18):
+    length = pieces * piece_length
+    sizes = [length // files] * files
+    sizes[-1] += length - sum(sizes)
+    metainfo = {
+        'announce': 'http://127.0.0.1:6969/announce',
+        'info': {
+            'name': 'large',
+            'piece length': piece_length,
+            'pieces': os.urandom(20 * pieces),
+            'files': [{'length': size, 'path': ['dir', f'file{i}.bin']} for i, size in enumerate(sizes)],
+        }
+    }
+    with open(path, 'wb') as file:
+        file.write(bencoding.encode(metainfo))
+
+
+def timed(function, repeat):
+    """ :returns: seconds per call """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+
+def report(name, seconds):
+    if seconds >= 1e-3:
+        print(f'{name:<32} {seconds * 1e3:>10.2f} ms')
+    else:
+        print(f'{name:<32} {seconds * 1e6:>10.2f} us')
+
+
+def main():
+    pieces = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'large.torrent')
+        make_large_torrent(path, pieces, files)
+        print(f'{pieces} pieces, {files} files, {os.path.getsize(path) / 2 ** 20:.1f} MiB .torrent')
+
+        torrent = TorrentFile(path)
+        info = torrent.get_info()
+        middle = pieces // 2
+        report('load', timed(lambda: TorrentFile(path), 5))
+        report('get_info_hash', timed(torrent.get_info_hash, 100000))
+        report('get_info + piece hash', timed(lambda: torrent.get_info().piece_hash(middle), 100000))
+        report('piece_count', timed(info.piece_count, 100000))
+
+        try:
+            import bencode
+        except ImportError:
+            return print('bencode.py is not installed, skipping the old way')
+
+        with open(path, 'rb') as file:
+            data = file.read()
+        decoded = bencode.decode(data)
+        assert sha1(bencode.encode(decoded['info'])).digest() == torrent.get_info_hash()
+
+        print('old way:')
+        report('load', timed(lambda: bencode.decode(data), 5))
+        report('get_info_hash', timed(lambda: sha1(bencode.encode(decoded['info'])).digest(), 5))
+        report('get_info + piece hash', timed(lambda: list(chunks(decoded['info']['pieces'], 20))[middle], 5))
+
+
+if __name__ == '__main__':
+    main()
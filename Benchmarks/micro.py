@@ -0,0 +1,345 @@
+"""
+microbenchmarks of the hot functions
+
+the wire codec in Utils, BitField, PieceHandler and RequestQueue,
+each at a few realistic piece counts. every case builds its state
+untimed, then times batches of calls for at least MIN_TIME, REPEAT
+times over, and keeps the median and the fastest time per call.
+
+results can be saved as json and compared against a saved baseline
+on the fastest times, the ones least disturbed by whatever else the
+machine is doing. a case slower than the baseline by more than the
+threshold is a regression and makes the exit status 1. baselines only mean something
+on the machine and python they were saved on
+
+usage: python3 -m Benchmarks.micro [--pieces 1000,10000,100000] [--repeat 7]
+                                   [--filter text] [--save path] [--baseline path] [--threshold 1.25]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+from time import perf_counter
+from Utils import (
+    pack_length, pack_id, pack_protocol_int, unpack_protocol_int, unpack_length,
+    blist_to_bits, create_bitfield
+)
+from Models import BitField, RequestQueue, RequestState, TorrentFile
+from Models.RequestQueue import PieceHandler
+from Benchmarks.metainfo import make_large_torrent
+
+
+PIECE_COUNTS = (1000, 10000, 100000)
+PIECE_LENGTH = 1 << 18
+BLOCK_SIZE = 1 << 14
+REPEAT = 7
+# timed work per repeat, short ones are mostly scheduler noise
+MIN_TIME = 0.05
+
+
+class Case:
+    """
+    a benchmark, setup() builds the state untimed and run(state) makes
+    `calls` calls. run gets a fresh state every time if it changes it
+    """
+
+    def __init__(self, name, setup, run, calls, fresh=False):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.calls = calls
+        self.fresh = fresh
+        self.state = None
+
+    def _timed(self, loops):
+        """ :returns: seconds loops runs took, setups excluded """
+        if not self.fresh:
+            started = perf_counter()
+            for _ in range(loops):
+                self.run(self.state)
+            return perf_counter() - started
+
+        elapsed = 0.0
+        for _ in range(loops):
+            state = self.setup()
+            started = perf_counter()
+            self.run(state)
+            elapsed += perf_counter() - started
+        return elapsed
+
+    def measure(self, repeat):
+        """ :returns: list of seconds per call, one per repeat """
+        if not self.fresh:
+            self.state = self.setup()
+        loops = 1
+        while True:
+            elapsed = self._timed(loops)
+            if elapsed >= MIN_TIME:
+                break
+            loops = max(loops * 2, int(loops * MIN_TIME / elapsed) if elapsed else loops * 10)
+
+        times = []
+        for _ in range(repeat):
+            times.append(self._timed(loops) / (loops * self.calls))
+        self.state = None
+        return times
+
+
+def random_bits(piece_count, density, seed=1):
+    """ :returns: wire format bitfield bytes with a fixed random share of the pieces set """
+    rng = random.Random(seed)
+    bits = bytearray((piece_count + 7) // 8)
+    for piece in rng.sample(range(piece_count), int(piece_count * density)):
+        bits[piece >> 3] |= 0x80 >> (piece & 7)
+    return bytes(bits)
+
+
+def wire_cases():
+    request = pack_id(6) + pack_protocol_int(7) + pack_protocol_int(BLOCK_SIZE) + pack_protocol_int(BLOCK_SIZE)
+    framed = pack_length(len(request)) + request
+
+    def pack(_):
+        for index in range(1000):
+            data = pack_id(6) + pack_protocol_int(index) + pack_protocol_int(0) + pack_protocol_int(BLOCK_SIZE)
+            pack_length(len(data)) + data
+
+    def unpack(_):
+        for _ in range(1000):
+            unpack_length(framed[0:4])
+            unpack_protocol_int(framed[5:9])
+            unpack_protocol_int(framed[9:13])
+            unpack_protocol_int(framed[13:17])
+
+    return [
+        Case('pack request message', lambda: None, pack, 1000),
+        Case('unpack request message', lambda: None, unpack, 1000),
+    ]
+
+
+def bitfield_cases(piece_count):
+    bits = random_bits(piece_count, 0.5)
+    states = {piece: piece % 2 == 0 for piece in range(piece_count)}
+    batch = max(1, 100000 // piece_count)
+
+    def construct(_):
+        for _ in range(batch * 10):
+            BitField(bits)
+
+    def available(field):
+        for _ in range(batch):
+            field.get_available_pieces()
+
+    def to_bits(_):
+        for _ in range(batch):
+            blist_to_bits(bits)
+
+    def create(_):
+        for _ in range(batch):
+            create_bitfield(states, piece_count)
+
+    return [
+        Case('BitField()', lambda: None, construct, batch * 10),
+        Case('BitField.get_available_pieces', lambda: BitField(bits), available, batch),
+        Case('blist_to_bits', lambda: None, to_bits, batch),
+        Case('create_bitfield', lambda: None, create, batch),
+    ]
+
+
+def piece_handler_cases():
+    """ one piece of PIECE_LENGTH, every call handles a whole piece """
+    block = os.urandom(BLOCK_SIZE)
+    blocks = PIECE_LENGTH // BLOCK_SIZE
+    pieces = 50
+
+    def fresh():
+        return [PieceHandler(piece, PIECE_LENGTH) for piece in range(pieces)]
+
+    def requested():
+        handlers = fresh()
+        for handler in handlers:
+            while handler.next_piece() is not None:
+                pass
+        return handlers
+
+    def next_piece(handlers):
+        for handler in handlers:
+            while handler.next_piece() is not None:
+                pass
+
+    def received(handlers):
+        for handler in handlers:
+            piece = handler.piece
+            for offset in range(0, PIECE_LENGTH, BLOCK_SIZE):
+                handler.received(piece, offset, block)
+
+    def get_data(handlers):
+        for handler in handlers:
+            for _ in range(blocks):
+                handler.get_data()
+
+    return [
+        Case(f'PieceHandler.next_piece {PIECE_LENGTH >> 10} KiB', fresh, next_piece, pieces, fresh=True),
+        Case(f'PieceHandler.received {PIECE_LENGTH >> 10} KiB', requested, received, pieces, fresh=True),
+        Case('PieceHandler.get_data', requested, get_data, pieces * blocks),
+    ]
+
+
+def request_queue_cases(piece_count, torrent):
+    bits = random_bits(piece_count, 0.5)
+    batch = max(1, 100000 // piece_count)
+
+    def fresh():
+        return RequestQueue(torrent, None, None)
+
+    def almost_finished():
+        # the last piece is missing, is_finished has to look at every one
+        queue = fresh()
+        for piece in range(piece_count - 1):
+            queue.pieces[piece] = RequestState.available
+        return queue
+
+    def with_peer():
+        queue = fresh()
+        bitfield = BitField(bits)
+        queue.add_bitfield(bitfield)
+        return queue, bitfield
+
+    def get_block(state):
+        queue, bitfield = state
+        current = None
+        for _ in range(1000):
+            block = queue.get_block(bitfield, current)
+            if block is None:
+                raise RuntimeError('ran out of blocks, the queue is too small')
+            current = block[0]
+
+    def is_finished(queue):
+        for _ in range(batch):
+            queue.is_finished()
+
+    def single_progress(queue):
+        async def progress():
+            for _ in range(batch):
+                await queue.single_progress()
+
+        loop = asyncio.new_event_loop()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            loop.run_until_complete(progress())
+        loop.close()
+
+    return [
+        Case('RequestQueue.get_block', with_peer, get_block, 1000, fresh=True),
+        Case('RequestQueue.is_finished', almost_finished, is_finished, batch),
+        Case('RequestQueue.single_progress', almost_finished, single_progress, batch),
+    ]
+
+
+def cases(piece_counts, directory):
+    """ :returns: list of (key, Case) """
+    found = [(case.name, case) for case in wire_cases() + piece_handler_cases()]
+    for piece_count in piece_counts:
+        path = os.path.join(directory, f'{piece_count}.torrent')
+        make_large_torrent(path, piece_count, 1, PIECE_LENGTH)
+        torrent = TorrentFile(path)
+        for case in bitfield_cases(piece_count) + request_queue_cases(piece_count, torrent):
+            found.append((f'{case.name} [{piece_count} pieces]', case))
+    return found
+
+
+def format_time(seconds):
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:.2f} ms'
+    if seconds >= 1e-6:
+        return f'{seconds * 1e6:.2f} us'
+    return f'{seconds * 1e9:.0f} ns'
+
+
+def run(piece_counts, repeat, pattern=None):
+    """ :returns: dict of case key to its timings """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for key, case in cases(piece_counts, directory):
+            if pattern and pattern.lower() not in key.lower():
+                continue
+            times = case.measure(repeat)
+            results[key] = {'median': statistics.median(times), 'min': min(times), 'calls': case.calls}
+            print(f'{key:<56} {format_time(results[key]["median"]):>10} per call', flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ print every case next to the baseline, :returns: list of keys slower than threshold allows """
+    regressions = []
+    print()
+    print(f'{"case":<56} {"baseline":>10} {"now":>10} {"change":>8}')
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None:
+            print(f'{key:<56} {"-":>10} {format_time(result["min"]):>10} {"new":>8}')
+            continue
+
+        ratio = result['min'] / before['min']
+        flag = ''
+        if ratio > threshold:
+            regressions.append(key)
+            flag = '  regression'
+        print(f'{key:<56} {format_time(before["min"]):>10} {format_time(result["min"]):>10} '
+              f'{(ratio - 1) * 100:>+7.1f}%{flag}')
+
+    missing = [key for key in baseline if key not in results]
+    if missing:
+        print(f'{len(missing)} cases of the baseline were not run')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='microbenchmarks of the hot functions')
+    parser.add_argument('--pieces', default=','.join(map(str, PIECE_COUNTS)),
+                        help='comma separated piece counts')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--filter', help='only run cases whose name contains this')
+    parser.add_argument('--save', help='write the results to this json file')
+    parser.add_argument('--baseline', help='json file of an earlier --save to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown of the fastest time over the baseline that counts as a regression')
+    args = parser.parse_args()
+
+    piece_counts = [int(count) for count in args.pieces.split(',') if count]
+    results = run(piece_counts, args.repeat, args.filter)
+
+    if args.save:
+        report = {
+            'config': {
+                'pieces': piece_counts,
+                'piece_length': PIECE_LENGTH,
+                'repeat': args.repeat,
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'machine': platform.machine(),
+            },
+            'results': results,
+        }
+        with open(args.save, 'w') as file:
+            json.dump(report, file, indent=2)
+            file.write('\n')
+
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            return print(f'no baseline at {args.baseline}, save one with --save')
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions over {args.threshold:.2f}x the baseline')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
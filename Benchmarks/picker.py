@@ -0,0 +1,89 @@
+"""
+piece selection at swarm scale
+
+compares the old get_request selection (rebuild the required set,
+intersect with the peer's pieces, random.choice) against PiecePicker
+
+usage: python3 -m Benchmarks.picker [pieces] [peers] [picks]
+"""
+
+import random
+import sys
+from time import perf_counter
+from Models import BitField, PiecePicker, RequestState
+
+
+def random_bitfield(piece_count, density):
+    bits = bytearray((piece_count + 7) // 8)
+    for piece in random.sample(range(piece_count), int(piece_count * density)):
+        bits[piece >> 3] |= 0x80 >> (piece & 7)
+    return BitField(bytes(bits))
+
+
+def legacy_pick(pieces, bitfield):
+    """ the selection RequestQueue.get_request used before """
+    required = set()
+    for key, value in pieces.items():
+        if value == RequestState.required or value == RequestState.race:
+            required.add(key)
+
+    intersect = required.intersection(bitfield.get_available_pieces())
+    if len(intersect) == 0:
+        return None
+    return random.choice(list(intersect))
+
+
+def timed(fn):
+    start = perf_counter()
+    result = fn()
+    return result, perf_counter() - start
+
+
+def main(piece_count=100000, peer_count=500, picks=200):
+    random.seed(1)
+    bitfields, elapsed = timed(lambda: [
+        random_bitfield(piece_count, random.uniform(0.05, 1.0))
+        for _ in range(peer_count)
+    ])
+    print(f'{peer_count} bitfields of {piece_count} pieces built in {elapsed:.2f}s')
+
+    pieces = {i: RequestState.required for i in range(piece_count)}
+
+    def run_legacy():
+        for i in range(picks):
+            piece = legacy_pick(pieces, bitfields[i % peer_count])
+            pieces[piece] = RequestState.downloading
+
+    _, legacy = timed(run_legacy)
+    print(f'before: {picks} picks in {legacy:.3f}s | {legacy / picks * 1000:.3f} ms/pick')
+
+    picker = PiecePicker(piece_count)
+    _, elapsed = timed(lambda: [picker.add_peer(bitfield) for bitfield in bitfields])
+    print(f' after: availability of {peer_count} peers counted in {elapsed:.3f}s')
+
+    def run_picker():
+        for i in range(picks):
+            piece = picker.pick(bitfields[i % peer_count])
+            picker.remove(piece)
+
+    _, elapsed = timed(run_picker)
+    print(f' after: {picks} picks in {elapsed:.3f}s | {elapsed / picks * 1000:.3f} ms/pick')
+
+    def churn():
+        for bitfield in bitfields[:50]:
+            picker.remove_peer(bitfield)
+            picker.add_peer(bitfield)
+
+    _, elapsed = timed(churn)
+    print(f' after: 50 peers disconnected and reconnected in {elapsed:.3f}s')
+
+    def haves():
+        for piece in range(0, piece_count, 10):
+            picker.increment(piece)
+
+    _, elapsed = timed(haves)
+    print(f' after: {piece_count // 10} have messages in {elapsed * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,55 @@
+"""
+recheck throughput per worker count
+
+hashes a synthetic payload with Recheck using 1, 2, 4, ... worker
+processes up to the number of cores, the payload is read once up
+front so every run hashes out of the page cache
+
+usage: python3 -m Benchmarks.recheck [size MiB] [piece KiB]
+"""
+
+import os
+import sys
+import tempfile
+from Models import TorrentFile
+from Controllers import Recheck, Storage
+from Benchmarks.synthetic import make_payload, make_torrent
+
+
+def worker_counts(cores):
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    piece_length = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 1 << 20
+    cores = os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        payload = os.path.join(directory, 'payload.bin')
+        make_payload(payload, size * 1024 * 1024)
+        torrent = TorrentFile(make_torrent(payload, os.path.join(directory, 'payload.torrent'), piece_length))
+        pieces = torrent.get_info().piece_count()
+        storage = Storage.from_torrent(torrent, payload)
+
+        print(f'{size} MiB, {pieces} pieces of {piece_length // 1024} KiB, {cores} cores')
+        Recheck(storage, torrent, workers=1).run()
+
+        for workers in worker_counts(cores):
+            recheck = Recheck(storage, torrent, workers=workers)
+            # no inline shortcut, the pool is what's being measured
+            recheck.INLINE_LIMIT = 0
+            bitfield = recheck.run()
+            assert bitfield.count() == pieces
+
+            rate = recheck.rate() / 1e9
+            print(f'{workers:>3} workers: {rate:.2f} GB/s | {rate / workers:.2f} GB/s per core | {recheck.elapsed:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
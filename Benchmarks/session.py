@@ -0,0 +1,158 @@
+"""
+per torrent overhead of a session
+
+seeds a number of small synthetic torrents from one Session and
+measures how much memory and how many file descriptors each one
+adds once they're announced. every torrent then gets a connection
+that handshakes through the shared listener and reads the
+bitfield, to time the info hash dispatch. for comparison a
+process seeding a single torrent is started and measured the same way
+
+linux only, memory and descriptors come from /proc
+
+usage: python3 -m Benchmarks.session [torrents] [payload KiB]
+"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import Process
+from Controllers import Session
+from Models import TorrentFile
+from Benchmarks.synthetic import make_payload, make_torrent
+from Benchmarks.trackers import serve
+
+
+def rss(pid='self'):
+    """ :returns: resident memory in bytes """
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def fds(pid='self'):
+    return len(os.listdir(f'/proc/{pid}/fd'))
+
+
+def free_port():
+    with socket.socket() as tcp:
+        tcp.bind(('127.0.0.1', 0))
+        return tcp.getsockname()[1]
+
+
+def wait_listening(port):
+    for _ in range(200):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+
+
+async def handshake(port, info_hash):
+    """ :returns: True if the seed answered with our info hash and a bitfield """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(bytes([19]) + b'BitTorrent protocol' + bytes(8) + info_hash + TorrentFile.peer_id().encode())
+        reply = await reader.readexactly(68)
+        length = int.from_bytes(await reader.readexactly(4), 'big')
+        message = await reader.readexactly(length)
+        return reply[28:48] == info_hash and message[0] == 5
+    finally:
+        writer.close()
+
+
+async def run(torrents):
+    port = free_port()
+    session = Session('127.0.0.1', port)
+    await session.start()
+
+    base_rss, base_fds = rss(), fds()
+    started = time.perf_counter()
+    for torrent_path, payload_path in torrents:
+        await session.add_seed(torrent_path, payload_path)
+    added = time.perf_counter() - started
+
+    # let every torrent's first announce go out
+    await asyncio.sleep(2)
+    count = len(torrents)
+    memory = (rss() - base_rss) / count
+    descriptors = (fds() - base_fds) / count
+    print(f'added {count} torrents in {added:.2f}s (recheck included)')
+    print(f'session: {memory / 1024:.1f} KiB and {descriptors:.3f} fds per torrent, '
+          f'{rss() / 2 ** 20:.1f} MiB and {fds()} fds in total')
+
+    info_hashes = list(session.torrents)
+    semaphore = asyncio.Semaphore(64)
+
+    async def limited(info_hash):
+        async with semaphore:
+            return await handshake(port, info_hash)
+
+    started = time.perf_counter()
+    answered = await asyncio.gather(*(limited(info_hash) for info_hash in info_hashes))
+    elapsed = time.perf_counter() - started
+    print(f'dispatch: {sum(answered)}/{count} handshakes answered, {count / elapsed:.0f}/s, '
+          f'{session.rejected} rejected')
+
+    await session.close()
+
+
+def single_process(torrent_path, payload_path):
+    """ :returns: (rss, fds) of a process seeding one torrent """
+
+    port = free_port()
+    code = (
+        'import asyncio, main\n'
+        f'asyncio.get_event_loop().run_until_complete(main.start_seeding('
+        f'"127.0.0.1", {port}, {torrent_path!r}, {payload_path!r}))'
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_listening(port)
+        time.sleep(1)
+        return rss(process.pid), fds(process.pid)
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    size = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 64 * 1024
+    tracker_port = free_port()
+
+    tracker = Process(target=serve, args=(tracker_port,), daemon=True)
+    tracker.start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            torrents = []
+            for i in range(count):
+                payload = os.path.join(directory, f'payload{i}.bin')
+                make_payload(payload, size)
+                torrent = make_torrent(
+                    payload, os.path.join(directory, f'payload{i}.torrent'), 16 * 1024,
+                    announce=f'http://127.0.0.1:{tracker_port}/announce'
+                )
+                torrents.append((torrent, payload))
+
+            wait_listening(tracker_port)
+            print(f'{count} torrents of {size // 1024} KiB')
+            memory, descriptors = single_process(*torrents[0])
+            print(f'process per torrent: {memory / 2 ** 20:.1f} MiB and {descriptors} fds each')
+            asyncio.new_event_loop().run_until_complete(run(torrents))
+    finally:
+        tracker.terminate()
+
+
+if __name__ == '__main__':
+    main()
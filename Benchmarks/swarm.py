@@ -0,0 +1,377 @@
+"""
+loopback swarm, the whole transfer path end to end
+
+generates a random payload and its .torrent, starts the stand-in
+tracker, N seeds and then M leechers at once, every one in its own
+process on 127.0.0.1. seeds are a Seed behind a listener, leechers a
+Download, both find each other through the tracker like they would
+on the internet.
+
+reports the swarm's wall time and throughput, and for every process
+the cpu time it spent per MB moved and its peak rss, as json on
+stdout. cpu is counted from the moment the leechers start, the
+seeds' initial recheck isn't part of it.
+
+with --latency or --bandwidth every seed sits behind a shaping proxy:
+each direction of its link is delayed by the latency and paced to the
+bandwidth, shared by all of the seed's connections. the seed announces
+the proxy's port, so every leecher goes through it
+
+linux only, peak rss comes from getrusage
+
+usage: python3 -m Benchmarks.swarm [--size MiB] [--piece KiB] [--seeds N] [--leechers M]
+                                   [--latency ms] [--bandwidth KiB/s] [--timeout s] [--json path]
+"""
+
+import argparse
+import asyncio
+import filecmp
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import multiprocessing
+from queue import Empty
+from Models import TorrentFile, metrics
+from Controllers import Seed, SeedConnection, PeerProtocol, Download
+from Benchmarks.synthetic import make_payload, make_torrent
+from Benchmarks.trackers import serve
+from Benchmarks.session import free_port, wait_listening
+
+
+MB = 1000 * 1000
+
+# spawned, forked children would share the peer id, the executors and the metrics
+_context = multiprocessing.get_context('spawn')
+
+
+class Link:
+    """ one direction of a shaped link, a fifo that delays and paces what goes through it """
+
+    def __init__(self, latency, bandwidth):
+        """
+        :param latency: one way delay in seconds
+        :param bandwidth: bytes per second, 0 for unlimited
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.free_at = 0.0
+
+    def schedule(self, now, size):
+        """ :returns: when size bytes sent now arrive at the other end """
+        if not self.bandwidth:
+            return now + self.latency
+        start = max(now, self.free_at)
+        self.free_at = start + size / self.bandwidth
+        return self.free_at + self.latency
+
+
+class ShapingProxy:
+    """ forwards connections to a port through a pair of Links """
+
+    CHUNK = 1 << 16
+    QUEUED = 256
+
+    def __init__(self, target, latency, bandwidth):
+        self.target = target
+        self.up = Link(latency, bandwidth)
+        self.down = Link(latency, bandwidth)
+        self.server = None
+
+    async def start(self, port):
+        self.server = await asyncio.start_server(self._forward, '127.0.0.1', port)
+
+    async def _forward(self, client_reader, client_writer):
+        try:
+            seed_reader, seed_writer = await asyncio.open_connection('127.0.0.1', self.target)
+        except OSError:
+            client_writer.close()
+            return
+
+        pumps = [
+            asyncio.ensure_future(self._pump(client_reader, seed_writer, self.down)),
+            asyncio.ensure_future(self._pump(seed_reader, client_writer, self.up)),
+        ]
+        await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+        for pump in pumps:
+            pump.cancel()
+        client_writer.close()
+        seed_writer.close()
+
+    async def _pump(self, reader, writer, link):
+        loop = asyncio.get_event_loop()
+        # bounded, reading stops once this much is in flight and tcp pushes back
+        queue = asyncio.Queue(self.QUEUED)
+
+        async def deliver():
+            while True:
+                due, data = await queue.get()
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if not data:
+                    return
+                writer.write(data)
+                await writer.drain()
+
+        delivery = asyncio.ensure_future(deliver())
+        try:
+            while True:
+                data = await reader.read(self.CHUNK)
+                await queue.put((link.schedule(loop.time(), len(data)), data))
+                if not data:
+                    break
+            await delivery
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            delivery.cancel()
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss():
+    """ :returns: peak resident memory of this process in bytes """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def quiet():
+    sys.stdout = open(os.devnull, 'w')
+
+
+def run_tracker(port, interval):
+    quiet()
+    serve(port, interval)
+
+
+def run_seed(index, torrent_path, payload_path, port, latency, bandwidth, results, ready, go, done):
+    quiet()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def main():
+        torrent = TorrentFile(torrent_path)
+        seed = Seed(torrent, payload_path, port)
+
+        async def incoming(protocol):
+            handshake = await SeedConnection.read_handshake(protocol)
+            if handshake is None or handshake[0] != torrent.get_info_hash():
+                return protocol.close()
+            await seed.accept(protocol, handshake)
+
+        proxy = None
+        if latency or bandwidth:
+            server = await PeerProtocol.start_server(incoming, '127.0.0.1', 0)
+            proxy = ShapingProxy(server.sockets[0].getsockname()[1], latency, bandwidth)
+            await proxy.start(port)
+        else:
+            server = await PeerProtocol.start_server(incoming, '127.0.0.1', port)
+
+        seed.start()
+        while not seed.announcer.announces:
+            await asyncio.sleep(0.01)
+        ready.put(index)
+
+        await loop.run_in_executor(None, go.wait)
+        cpu = cpu_seconds()
+        await loop.run_in_executor(None, done.wait)
+        cpu = cpu_seconds() - cpu
+
+        uploaded = seed.file_reader.uploaded
+        server.close()
+        if proxy is not None:
+            proxy.server.close()
+        await seed.stop()
+        results.put({
+            'role': 'seed',
+            'index': index,
+            'uploaded_bytes': uploaded,
+            'cpu_seconds': cpu,
+            'cpu_seconds_per_mb': cpu / (uploaded / MB) if uploaded else None,
+            'peak_rss_bytes': peak_rss(),
+        })
+
+    loop.run_until_complete(main())
+
+
+def run_leecher(index, torrent_path, payload_path, directory, port, results, go):
+    quiet()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    torrent = TorrentFile(torrent_path)
+    name = torrent.get_info().file_name()
+    os.makedirs(directory)
+    go.wait()
+
+    cpu = cpu_seconds()
+    started = time.perf_counter()
+    download = Download(
+        torrent, os.path.join(directory, name), port,
+        resume_path=os.path.join(directory, name + '.resume')
+    )
+    loop.run_until_complete(download.run())
+    elapsed = time.perf_counter() - started
+    cpu = cpu_seconds() - cpu
+
+    downloaded = download.request_queue.downloaded
+    rtt = metrics.histograms['bt_request_rtt_seconds']
+    hashing = metrics.histograms['bt_hash_seconds']
+    writes = metrics.histograms['bt_write_seconds']
+    results.put({
+        'role': 'leecher',
+        'index': index,
+        'seconds': elapsed,
+        'downloaded_bytes': downloaded,
+        'mb_per_second': downloaded / MB / elapsed,
+        'cpu_seconds': cpu,
+        'cpu_seconds_per_mb': cpu / (downloaded / MB) if downloaded else None,
+        'peak_rss_bytes': peak_rss(),
+        'intact': filecmp.cmp(os.path.join(directory, name), payload_path, shallow=False),
+        'request_rtt_mean_seconds': rtt.mean(),
+        'hash_seconds': hashing.sum,
+        'write_mean_seconds': writes.mean(),
+    })
+
+
+def summarize(processes):
+    """ :returns: dict of totals over a list of per process results """
+    cpu = [result['cpu_seconds_per_mb'] for result in processes if result['cpu_seconds_per_mb'] is not None]
+    return {
+        'count': len(processes),
+        'cpu_seconds': sum(result['cpu_seconds'] for result in processes),
+        'cpu_seconds_per_mb': sum(cpu) / len(cpu) if cpu else None,
+        'peak_rss_bytes': max((result['peak_rss_bytes'] for result in processes), default=0),
+    }
+
+
+def run(args):
+    """ :returns: the report """
+
+    size = int(args.size * 1024 * 1024)
+    tracker_port = free_port()
+    processes = []
+    results, ready = _context.Queue(), _context.Queue()
+    go, done = _context.Event(), _context.Event()
+
+    with tempfile.TemporaryDirectory() as directory:
+        payload = os.path.join(directory, 'payload.bin')
+        make_payload(payload, size)
+        torrent = make_torrent(
+            payload, os.path.join(directory, 'payload.torrent'), int(args.piece * 1024),
+            announce=f'http://127.0.0.1:{tracker_port}/announce'
+        )
+
+        tracker = _context.Process(target=run_tracker, args=(tracker_port, 1800), daemon=True)
+        tracker.start()
+        processes.append(tracker)
+        try:
+            wait_listening(tracker_port)
+
+            for index in range(args.seeds):
+                seed = _context.Process(target=run_seed, daemon=True, args=(
+                    index, torrent, payload, free_port(),
+                    args.latency / 1000, args.bandwidth * 1024, results, ready, go, done
+                ))
+                seed.start()
+                processes.append(seed)
+            for _ in range(args.seeds):
+                ready.get(timeout=args.timeout)
+
+            leechers = []
+            for index in range(args.leechers):
+                leecher = _context.Process(target=run_leecher, daemon=True, args=(
+                    index, torrent, payload, os.path.join(directory, f'leecher{index}'),
+                    free_port(), results, go
+                ))
+                leecher.start()
+                processes.append(leecher)
+                leechers.append(leecher)
+
+            # the leechers are up and waiting, start them all at once
+            time.sleep(0.5)
+            started = time.perf_counter()
+            go.set()
+
+            finished = []
+            deadline = started + args.timeout
+            while len(finished) < args.leechers:
+                try:
+                    finished.append(results.get(timeout=max(deadline - time.perf_counter(), 0.001)))
+                except Empty:
+                    break
+            elapsed = time.perf_counter() - started
+
+            done.set()
+            seeds = []
+            for _ in range(args.seeds):
+                try:
+                    seeds.append(results.get(timeout=10))
+                except Empty:
+                    break
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+    downloaded = sum(result['downloaded_bytes'] for result in finished)
+    return {
+        'config': {
+            'size_bytes': size,
+            'piece_bytes': int(args.piece * 1024),
+            'seeds': args.seeds,
+            'leechers': args.leechers,
+            'latency_ms': args.latency,
+            'bandwidth_bytes_per_second': args.bandwidth * 1024,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+        },
+        'completed': len(finished),
+        'intact': all(result['intact'] for result in finished) and len(finished) == args.leechers,
+        'wall_seconds': elapsed,
+        'downloaded_bytes': downloaded,
+        'mb_per_second': downloaded / MB / elapsed,
+        'leechers': dict(summarize(finished), processes=sorted(finished, key=lambda result: result['index'])),
+        'seeds': dict(summarize(seeds), processes=sorted(seeds, key=lambda result: result['index'])),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='loopback swarm benchmark')
+    parser.add_argument('--size', type=float, default=64, help='payload size in MiB')
+    parser.add_argument('--piece', type=float, default=256, help='piece size in KiB')
+    parser.add_argument('--seeds', type=int, default=1)
+    parser.add_argument('--leechers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0, help='one way delay of every seed link in ms')
+    parser.add_argument('--bandwidth', type=float, default=0,
+                        help='bandwidth of every seed link in KiB/s, each direction, 0 for unlimited')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds the leechers get to finish')
+    parser.add_argument('--json', help='write the report to this file instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.json:
+        with open(args.json, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+    if not report['intact']:
+        print(f"only {report['completed']}/{args.leechers} leechers finished intact", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
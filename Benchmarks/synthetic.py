@@ -0,0 +1,43 @@
+"""
+synthetic payloads and matching single file .torrent files
+"""
+
+import os
+from hashlib import sha1
+from Utils import bencoding
+
+
+def make_payload(path, size, chunk=1 << 20):
+    """ write size random bytes to path """
+    with open(path, 'wb') as file:
+        while size > 0:
+            data = os.urandom(min(chunk, size))
+            file.write(data)
+            size -= len(data)
+
+
+def make_torrent(payload_path, torrent_path, piece_length,
+                 announce='http://127.0.0.1:6969/announce', name=None):
+    """ hash a payload into a .torrent file, :returns: torrent_path """
+
+    hashes = []
+    with open(payload_path, 'rb') as file:
+        while True:
+            piece = file.read(piece_length)
+            if not piece:
+                break
+            hashes.append(sha1(piece).digest())
+
+    metainfo = {
+        'announce': announce,
+        'info': {
+            'name': name or os.path.basename(payload_path),
+            'piece length': piece_length,
+            'length': os.path.getsize(payload_path),
+            'pieces': b''.join(hashes)
+        }
+    }
+    with open(torrent_path, 'wb') as file:
+        file.write(bencoding.encode(metainfo))
+
+    return torrent_path
@@ -0,0 +1,169 @@
+"""
+local tracker stand-ins for tests and benchmarks
+
+a tiny http tracker on asyncio streams and a tiny udp tracker
+(bep 15), both keep the peers that announced per info hash and
+answer with compact peer lists. http connections are kept alive
+like a real tracker behind a proxy
+
+usage: python3 -m Benchmarks.trackers [port] [interval]
+serves http and udp on the same port number
+"""
+
+import asyncio
+import random
+import socket
+import struct
+import sys
+from urllib.parse import urlsplit, parse_qs
+from Utils import bencoding
+from Controllers.UdpTracker import PROTOCOL_ID, CONNECT, ANNOUNCE, ERROR, EVENTS
+
+
+def compact(peers):
+    return b''.join(
+        socket.inet_aton(host) + struct.pack('!H', port)
+        for host, port in peers
+    )
+
+
+class TrackerStandIn:
+
+    def __init__(self, interval=1800, max_peers=50):
+        self.interval = interval
+        self.max_peers = max_peers
+        self.swarms = {}
+        self.announces = 0
+
+    def announce(self, info_hash, host, port, event, left):
+        """ record a peer and :returns: the other peers in the swarm """
+
+        self.announces += 1
+        swarm = self.swarms.setdefault(info_hash, {})
+        if event == 'stopped':
+            swarm.pop((host, port), None)
+        else:
+            swarm[(host, port)] = left
+
+        return [peer for peer in swarm if peer != (host, port)][:self.max_peers]
+
+
+class HttpTrackerStandIn(TrackerStandIn):
+
+    def __init__(self, interval=1800, max_peers=50):
+        super().__init__(interval, max_peers)
+        self.connections = 0
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """ :returns: announce url """
+        self.server = await asyncio.start_server(self._serve, host, port)
+        port = self.server.sockets[0].getsockname()[1]
+        return f'http://{host}:{port}/announce'
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    def _response(self, query, host):
+        params = parse_qs(query, keep_blank_values=True, encoding='latin-1')
+        try:
+            info_hash = params['info_hash'][0].encode('latin-1')
+            port = int(params['port'][0])
+            left = int(params.get('left', ['0'])[0])
+        except (KeyError, ValueError):
+            return {'failure reason': 'invalid announce'}
+
+        event = params.get('event', [''])[0]
+        peers = self.announce(info_hash, host, port, event, left)
+        return {'interval': self.interval, 'peers': compact(peers)}
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        host = writer.get_extra_info('peername')[0]
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+
+                target = line.split()[1].decode('latin-1')
+                body = bencoding.encode(self._response(urlsplit(target).query, host))
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n'
+                    + f'Content-Length: {len(body)}\r\n\r\n'.encode() + body
+                )
+                await writer.drain()
+        except (ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+
+class UdpTrackerStandIn(TrackerStandIn, asyncio.DatagramProtocol):
+
+    def __init__(self, interval=1800, max_peers=50):
+        super().__init__(interval, max_peers)
+        self.connection_ids = set()
+        self.connects = 0
+        self.transport = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """ :returns: announce url """
+        await asyncio.get_event_loop().create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        port = self.transport.get_extra_info('sockname')[1]
+        return f'udp://{host}:{port}/announce'
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 16:
+            return
+
+        connection_id, action, transaction = struct.unpack_from('!QII', data)
+        if action == CONNECT and connection_id == PROTOCOL_ID:
+            self.connects += 1
+            connection_id = random.getrandbits(64)
+            self.connection_ids.add(connection_id)
+            response = struct.pack('!IIQ', CONNECT, transaction, connection_id)
+        elif action == ANNOUNCE and connection_id not in self.connection_ids:
+            response = struct.pack('!II', ERROR, transaction) + b'unknown connection id'
+        elif action == ANNOUNCE and len(data) >= 98:
+            info_hash, event, port = struct.unpack_from('!20s20x8x8x8xI4x4x4xH', data, 16)
+            left = struct.unpack_from('!Q', data, 64)[0]
+            event = {value: name for name, value in EVENTS.items()}.get(event, '')
+            peers = self.announce(info_hash, addr[0], port, event, left)
+            response = struct.pack('!IIIII', ANNOUNCE, transaction, self.interval, 0, len(peers)) + compact(peers)
+        else:
+            response = struct.pack('!II', ERROR, transaction) + b'invalid request'
+
+        self.transport.sendto(response, addr)
+
+
+def serve(port=6969, interval=1800):
+    """ run both stand-ins on the port until killed """
+
+    async def run():
+        http = HttpTrackerStandIn(interval)
+        udp = UdpTrackerStandIn(interval)
+        udp.swarms = http.swarms
+        print('Tracker at', await http.start('127.0.0.1', port))
+        print('Tracker at', await udp.start('127.0.0.1', port))
+        await http.server.serve_forever()
+
+    asyncio.new_event_loop().run_until_complete(run())
+
+
+if __name__ == '__main__':
+    serve(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 6969,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1800
+    )
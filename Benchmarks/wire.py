@@ -0,0 +1,106 @@
+"""
+loopback throughput of the peer wire framing layer
+
+compares the old StreamReader loop (4 byte read under
+wait_for, then buff += read) against PeerProtocol
+
+usage: python3 -m Benchmarks.wire [messages] [block size]
+"""
+
+import asyncio
+import sys
+from time import perf_counter
+from Utils import pack_length, pack_id, pack_protocol_int, unpack_length
+from Controllers.PeerProtocol import PeerProtocol
+
+
+HOST = '127.0.0.1'
+
+
+def piece_message(block_size):
+    block = bytes(block_size)
+    message = pack_id(7) + pack_protocol_int(0) + pack_protocol_int(0) + block
+    return pack_length(len(message)) + message
+
+
+async def serve(payload, count):
+    """ start a server that floods every connection with piece messages """
+
+    async def flood(reader, writer):
+        for _ in range(count):
+            writer.write(payload)
+            if writer.transport.get_write_buffer_size() > 1 << 20:
+                await writer.drain()
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(flood, HOST, 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def legacy_receiver(port, count):
+    """ the receive loop ClientConnection and SeedConnection used before """
+
+    reader, writer = await asyncio.open_connection(HOST, port)
+    received = 0
+    while received < count:
+        try:
+            length_data = await asyncio.wait_for(reader.read(4), timeout=0.5)
+            if length_data == b'':
+                break
+            length = unpack_length(length_data)
+            if length == 0:
+                continue
+
+            buff = b''
+            while len(buff) < length:
+                buff += await reader.read(length - len(buff))
+
+            id, data = buff[0:1], buff[1:]
+            received += 1
+        except asyncio.TimeoutError:
+            pass
+
+    writer.close()
+    return received
+
+
+async def protocol_receiver(port, count):
+    """ the PeerProtocol receive path """
+
+    protocol = await PeerProtocol.open_connection(HOST, port)
+    received = 0
+    while received < count:
+        message = await protocol.read_message()
+        if message is None:
+            break
+        received += 1
+
+    protocol.close()
+    return received
+
+
+async def run(receiver, count, block_size):
+    payload = piece_message(block_size)
+    server, port = await serve(payload, count)
+    start = perf_counter()
+    received = await receiver(port, count)
+    elapsed = perf_counter() - start
+    server.close()
+    await server.wait_closed()
+    return received, received * len(payload), elapsed
+
+
+def main(count=20000, block_size=16384):
+    loop = asyncio.get_event_loop()
+    for name, receiver in (('before', legacy_receiver), ('after', protocol_receiver)):
+        received, size, elapsed = loop.run_until_complete(
+            run(receiver, count, block_size)
+        )
+        print(f'{name:>6}: {received} msgs in {elapsed:.3f}s | '
+              f'{received / elapsed:,.0f} msgs/s | '
+              f'{size / elapsed / (1000 * 1000):,.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
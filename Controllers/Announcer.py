@@ -0,0 +1,147 @@
+import asyncio
+import random
+from Controllers.HttpPool import HttpPool
+from Controllers.Tracker import Tracker
+from Controllers.UdpTracker import UdpTracker
+
+
+class Announcer:
+    """
+    keeps a torrent announced to its trackers for as long as it runs.
+
+    every tier of the announce-list is announced to at the same time
+    and on its own schedule. within a tier the trackers are tried in
+    order, the list is shuffled once and a tracker that answers moves
+    to the front (bep 12). re-announces follow the interval the
+    tracker asked for and carry the real transfer counts, failures
+    back off from RETRY_MIN up to RETRY_MAX seconds
+    """
+
+    DEFAULT_INTERVAL = 1800
+    RETRY_MIN = 15
+    RETRY_MAX = 1800
+    STOP_TIMEOUT = 5.0
+
+    def __init__(self, torrent, port, stats, on_peers=None, pool=None):
+        """
+        :param stats: callable returning (uploaded, downloaded, left) in bytes
+        :param on_peers: called with the [(host, port)] list of every response
+        :param pool: HttpPool shared between trackers and torrents
+        """
+        self.torrent = torrent
+        self.port = port
+        self.stats = stats
+        self.on_peers = on_peers
+        self.owns_pool = pool is None
+        self.pool = pool or HttpPool()
+
+        tiers = torrent.get_announce_list() or [[torrent.get_announce()]]
+        self.tiers = [random.sample(tier, len(tier)) for tier in tiers if tier]
+        self.trackers = {}
+        self.events = [asyncio.Event() for _ in self.tiers]
+        self.pending = ['started'] * len(self.tiers)
+        self.tasks = []
+
+        self.announces = 0
+        self.failures = 0
+        self.last_peers = 0
+
+    def _tracker(self, url):
+        tracker = self.trackers.get(url)
+        if tracker is None:
+            kind = UdpTracker if url.startswith('udp://') else Tracker
+            tracker = self.trackers[url] = kind(url, self.torrent, self.pool)
+        return tracker
+
+    def start(self):
+        self.tasks = [
+            asyncio.ensure_future(self._run_tier(index))
+            for index in range(len(self.tiers))
+        ]
+
+    def completed(self):
+        """ the download finished, tell every tier right away """
+        for index in range(len(self.tiers)):
+            self.pending[index] = 'completed'
+            self.events[index].set()
+
+    async def stop(self, completed=False):
+        """ stop re-announcing and say goodbye to every tier """
+
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+        async def goodbye(index):
+            if completed:
+                await self._announce_tier(index, 'completed')
+            await self._announce_tier(index, 'stopped')
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(goodbye(index) for index in range(len(self.tiers)))),
+                self.STOP_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            pass
+        for tracker in self.trackers.values():
+            tracker.close()
+        if self.owns_pool:
+            self.pool.close()
+
+    async def _run_tier(self, index):
+        failures = 0
+        while True:
+            event = self.pending[index]
+            self.events[index].clear()
+            peers = await self._announce_tier(index, event)
+
+            if peers is None:
+                failures += 1
+                delay = min(self.RETRY_MAX, self.RETRY_MIN * 2 ** (failures - 1))
+            else:
+                failures = 0
+                if self.pending[index] == event:
+                    self.pending[index] = ''
+                delay = peers.get_interval() or self.DEFAULT_INTERVAL
+                delay = max(delay, peers.get_min_interval() or 0)
+
+                self.last_peers = len(peers.get_peers())
+                if self.on_peers is not None:
+                    self.on_peers(peers.get_peers())
+
+            try:
+                await asyncio.wait_for(self.events[index].wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _announce_tier(self, index, event):
+        """ :returns: Peers from the first tracker of the tier that answers, or None """
+
+        tier = self.tiers[index]
+        uploaded, downloaded, left = self.stats()
+        for url in list(tier):
+            try:
+                peers = await self._tracker(url).announce(
+                    port=self.port, uploaded=uploaded, downloaded=downloaded,
+                    left=left, event=event
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                print('tracker', url, 'failed:', e)
+                continue
+
+            self.announces += 1
+            tier.remove(url)
+            tier.insert(0, url)
+            return peers
+
+        return None
+
+    def __str__(self):
+        return f"<Announcer(tiers={len(self.tiers)}, announces={self.announces})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,169 @@
+import asyncio
+import random
+from time import monotonic
+
+
+class Choker:
+    """
+    decides which peers we upload to. every INTERVAL seconds the
+    interested peers are ranked by their rate over the last round
+    and the best SLOTS of them are unchoked, everyone else is choked.
+    one more slot rotates every OPTIMISTIC_ROUNDS rounds to a random
+    choked peer so newcomers get a chance to show what they can do.
+
+    while seeding peers are ranked by how fast we upload to them,
+    while downloading by how fast they upload to us.
+
+    peers need am_choking, peer_interested, downloaded and uploads
+    (an UploadQueue) attributes and choke() / unchoke() methods,
+    they are added once their UploadQueue exists. a peer whose choke()
+    or unchoke() raises is dropped, the others keep their slots
+    """
+
+    SLOTS = 4
+    INTERVAL = 10.0
+    OPTIMISTIC_ROUNDS = 3
+
+    # peers that connected within this many rounds are this many
+    # times as likely to get the optimistic unchoke
+    NEW_PEER_ROUNDS = 3
+    NEW_PEER_WEIGHT = 3
+
+    def __init__(self, slots=SLOTS, seeding=False):
+        self.slots = slots
+        self.seeding = seeding
+        self.peers = {}
+        self.rates = {}
+        self.optimistic = None
+        self.round = 0
+        self.last_round = monotonic()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.INTERVAL)
+            try:
+                self.rechoke()
+            except Exception as e:
+                print('rechoke failed', e)
+
+    def add_peer(self, peer):
+        self.peers[peer] = (self.round, self._transferred(peer))
+        self.rates[peer] = 0.0
+
+    def remove_peer(self, peer):
+        if self._drop(peer):
+            self._fill_slots()
+
+    def _drop(self, peer):
+        """ :returns: True if the peer was there """
+        if self.peers.pop(peer, None) is None:
+            return False
+
+        self.rates.pop(peer, None)
+        if self.optimistic is peer:
+            self.optimistic = None
+        return True
+
+    def _set_choking(self, peer, choking):
+        """ choke or unchoke a peer, dropping it if that fails """
+        try:
+            if choking:
+                peer.choke()
+            else:
+                peer.unchoke()
+        except Exception as e:
+            print('dropping peer from the choker', peer, e)
+            self._drop(peer)
+
+    def interested(self, peer):
+        """ a peer became interested, unchoke it right away if a slot is free """
+        if peer in self.peers:
+            self._fill_slots()
+
+    def _transferred(self, peer):
+        return peer.uploads.uploaded if self.seeding else peer.downloaded
+
+    def _unchoked(self):
+        return [peer for peer in self.peers if not peer.am_choking]
+
+    def _fill_slots(self):
+        """ hand free slots to the best interested peers between rounds """
+        free = self.slots + 1 - len(self._unchoked())
+        if free <= 0:
+            return
+
+        candidates = [
+            peer for peer in self.peers
+            if peer.am_choking and peer.peer_interested
+        ]
+        candidates.sort(key=self.rates.get, reverse=True)
+        for peer in candidates[:free]:
+            self._set_choking(peer, False)
+
+    def rechoke(self):
+        """ rank the peers by last round's rate and reassign the slots """
+
+        now = monotonic()
+        elapsed = max(now - self.last_round, 1e-3)
+        self.last_round = now
+
+        for peer, (joined, last) in list(self.peers.items()):
+            transferred = self._transferred(peer)
+            self.rates[peer] = (transferred - last) / elapsed
+            self.peers[peer] = (joined, transferred)
+
+        interested = [peer for peer in self.peers if peer.peer_interested]
+        interested.sort(key=self.rates.get, reverse=True)
+        regular = set(interested[:self.slots])
+
+        if (self.optimistic not in self.peers or self.optimistic in regular
+                or self.round % self.OPTIMISTIC_ROUNDS == 0):
+            self.optimistic = self._pick_optimistic(interested[self.slots:])
+
+        unchoke = set(regular)
+        if self.optimistic is not None:
+            unchoke.add(self.optimistic)
+
+        for peer in list(self.peers):
+            if peer in unchoke and peer.am_choking:
+                self._set_choking(peer, False)
+            elif peer not in unchoke and not peer.am_choking:
+                self._set_choking(peer, True)
+
+        self.round += 1
+
+    def _pick_optimistic(self, candidates):
+        if not candidates:
+            return None
+
+        weighted = []
+        for peer in candidates:
+            joined, _ = self.peers[peer]
+            weight = self.NEW_PEER_WEIGHT if self.round - joined < self.NEW_PEER_ROUNDS else 1
+            weighted.extend([peer] * weight)
+
+        return random.choice(weighted)
+
+    def stats(self):
+        """ :returns: list of (peer, rate, choked, interested, optimistic) ranked by rate """
+        ranked = sorted(self.peers, key=self.rates.get, reverse=True)
+        return [
+            (peer, self.rates[peer], peer.am_choking,
+             peer.peer_interested, peer is self.optimistic)
+            for peer in ranked
+        ]
+
+    def __str__(self):
+        return f"<Choker(slots={self.slots}, peers={len(self.peers)}, unchoked={len(self._unchoked())})>"
+
+    def __repr__(self):
+        return self.__str__()
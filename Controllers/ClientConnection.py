@@ -1,80 +1,150 @@
 import asyncio
+from time import monotonic
 from Utils import *
-from Models import BitField
+from Models import BitField, Pipeline
 from asyncio import Queue
-from Controllers.FileReader import FileReader
+from Controllers.PeerProtocol import PeerProtocol
+from Controllers.UploadQueue import UploadQueue
 
 
 class ClientConnection:
 
-    def __init__(self, host, port, torrent, request_queue):
+    IDLE_TIMEOUT = 1.0
+
+    def __init__(self, host, port, torrent, request_queue, choker=None, limiter=None):
         self.host = host
         self.port = port
         self.torrent = torrent
         self.request_queue = request_queue
-        self.writer = None
-        self.reader = None
+        self.choker = choker
+        self.limiter = limiter
+        self.protocol = None
+        self.uploads = None
         self.bitfield = None
         self.send_queue = Queue()
+        self.pipeline = Pipeline()
+        self.wake = asyncio.Event()
 
         self.am_choking = True
         self.am_interested = False
         self.peer_choking = True
         self.peer_interested = False
+        self.downloaded = 0
 
+        # piece handler the last block request came from
         self.required_index = None
+        self.last_expire = monotonic()
         self.request_queue.register_peer(self)
 
     async def connect(self):
         """ start a connection with peer """
 
-        self.reader, self.writer = await asyncio.open_connection(
-            host=self.host,
-            port=self.port
+        await self.open()
+        await self.run()
+
+    async def open(self, connect_timeout=None, handshake_timeout=None):
+        """
+        connect and exchange handshakes
+        :raises ValueError: if the peer answers for another torrent, or is us
+        """
+
+        self.protocol = await asyncio.wait_for(
+            PeerProtocol.open_connection(host=self.host, port=self.port),
+            connect_timeout
         )
 
         await self.send_handshake()
-        await self.reader.read(68)
-        await self.send_unchoke()
-
-        while True:
+        handshake = await asyncio.wait_for(self.protocol.read_exactly(68), handshake_timeout)
+        if handshake is None or len(handshake) < 68:
+            raise ConnectionError('connection closed during the handshake')
+        if handshake[0] != 19 or bytes(handshake[1:20]) != b'BitTorrent protocol':
+            raise ValueError('not a bittorrent peer')
+        if bytes(handshake[28:48]) != self.torrent.get_info_hash():
+            raise ValueError('peer is serving another torrent')
+        if bytes(handshake[48:68]) == self.torrent.peer_id().encode():
+            raise ValueError('connected to ourselves')
+
+    async def run(self):
+        """ exchange messages until either side closes """
+
+        self.uploads = UploadQueue(self.protocol, self.request_queue.file_writer, self.limiter)
+        self.uploads.start()
+        if self.choker is None:
+            await self.send_unchoke()
+        else:
+            self.choker.add_peer(self)
+
+        tasks = {
+            asyncio.ensure_future(self._receive_loop()),
+            asyncio.ensure_future(self._send_loop())
+        }
+        done, pending = await asyncio.wait(
+            tasks, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+
+    async def _receive_loop(self):
+        # the queue is gone once the connection shut down, what's left in the buffer doesn't matter
+        while not self.protocol.eof and self.request_queue is not None:
             await self._receive_socket()
+
+    async def _send_loop(self):
+        """ flush queued messages and keep the request pipeline full """
+
+        while self.request_queue is not None:
+            if not self.wake.is_set():
+                try:
+                    await asyncio.wait_for(self.wake.wait(), self.IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+            self.wake.clear()
+
             await self._send_socket()
+            if self.request_queue is None:
+                return
+
+            now = monotonic()
+            if now - self.last_expire >= self.IDLE_TIMEOUT:
+                self.last_expire = now
+                self.request_queue.return_blocks(self.pipeline.expire(), self)
+
             if not self.peer_choking and self.bitfield and self.am_interested:
                 await self.send_request()
 
     async def _receive_socket(self):
 
-        try:
-            length_data = await asyncio.wait_for(
-                self.reader.read(4), timeout=0.5
-            )
-            if length_data == b'':
-                return await self.gracefully_shutdown()
-            length = unpack_length(length_data)
-            if length == 0:
-                return
-
-            buff = b''
-            while len(buff) < length:
-                buff += await self.reader.read(length - len(buff))
+        message = await self.protocol.read_message()
+        if message is None:
+            return await self.gracefully_shutdown()
 
-            await self._process(length, buff[0:1], buff[1:])
+        if self.limiter is not None and message[1] == 7:
+            # holding on to the block keeps it in the protocol's buffer,
+            # once that fills up reading pauses and tcp slows the peer down
+            await self.limiter.download.acquire(self, message[0])
 
-        except asyncio.TimeoutError:
-            pass
+        await self._process(*message)
 
     async def send_unchoke(self):
         await self._send(pack_protocol_int(1) + pack_id(1))
         self.am_choking = False
 
+    def choke(self):
+        """ stop serving the peer, whatever it asked for so far is dropped """
+        self.protocol.write(pack_protocol_int(1) + pack_id(0))
+        self.am_choking = True
+        self.uploads.clear()
+
+    def unchoke(self):
+        self.protocol.write(pack_protocol_int(1) + pack_id(1))
+        self.am_choking = False
+
     async def _send_socket(self):
 
-        try:
-            message = self.send_queue.get_nowait()
-            await self._send(message)
-        except asyncio.QueueEmpty:
-            pass
+        while not self.send_queue.empty():
+            await self._send(self.send_queue.get_nowait())
 
     async def queue_available(self, piece_handler):
 
@@ -84,6 +154,7 @@ class ClientConnection:
         data = id + piece
         length = pack_protocol_int(len(data))
         self.send_queue.put_nowait(length + data)
+        self.wake.set()
 
     async def send_handshake(self):
         """ send handshake to peer """
@@ -100,21 +171,16 @@ class ClientConnection:
 
     async def send_request(self):
 
-        if self.required_index is None:
-            self.required_index = self.request_queue.get_request(self.bitfield)
-            if self.required_index is None:
-                return
-
-        if self.required_index.is_complete():
-            await self.request_queue.confirm_download(self.required_index)
-            # write piece to file
-            self.required_index = None
-            return await self.send_request()
+        while self.request_queue is not None and self.pipeline.has_room():
 
-        piece_data = self.required_index.next_piece()
-        while piece_data is not None:
+            block = self.request_queue.get_block(
+                self.bitfield, self.required_index, self.pipeline.outstanding
+            )
+            if block is None:
+                return
 
-            piece, offset, length = piece_data
+            self.required_index, (piece, offset, length) = block
+            self.pipeline.sent(piece, offset, length)
 
             id = pack_id(6)
             index = pack_protocol_int(piece)
@@ -125,7 +191,6 @@ class ClientConnection:
             data = pack_length(len(data)) + data
 
             await self._send(data)
-            piece_data = self.required_index.next_piece()
 
     async def send_interested(self):
 
@@ -148,7 +213,6 @@ class ClientConnection:
             9: self._handle_port
         }
 
-        id = ord(id)
         if id not in handlers:
             return
 
@@ -156,42 +220,68 @@ class ClientConnection:
         await handlers.get(id)(length, data)
 
     async def _handle_choke(self, length, data):
+        """ the peer drops our requests, hand them to other peers until it unchokes again """
         self.peer_choking = True
-        print('peer choking')
-        await self.gracefully_shutdown()
+        if self.request_queue is not None:
+            self.request_queue.return_blocks(self.pipeline.outstanding, self)
+        self.required_index = None
+        self.pipeline.clear()
 
     async def _handle_un_choke(self, length, data):
         self.peer_choking = False
+        self.wake.set()
 
     async def _handle_interested(self, length, data):
         self.peer_interested = True
+        if self.choker is not None:
+            self.choker.interested(self)
 
     async def _handle_not_interested(self, length, data):
         self.peer_interested = False
 
     async def _handle_have(self, length, data):
-        pass
+        """ peer finished a piece """
+
+        index = unpack_protocol_int(data[0:4])
+        piece_count = self.torrent.get_info().piece_count()
+        if index >= piece_count or self.request_queue is None:
+            # a piece the torrent doesn't have, or we shut down already
+            return
+
+        first = self.bitfield is None
+        if first:
+            self.bitfield = BitField.empty(piece_count)
+            self.request_queue.add_bitfield(self.bitfield)
+
+        if not self.bitfield.has_piece(index):
+            self.bitfield.set_piece(index)
+            self.request_queue.add_have(index)
+            self.wake.set()
+
+        if first:
+            await self.send_interested()
 
     async def _handle_bitfield(self, length, data):
         """ process bitfield """
+        if self.request_queue is None:
+            return
+        if self.bitfield is not None:
+            self.request_queue.remove_bitfield(self.bitfield)
         self.bitfield = BitField(data)
+        self.request_queue.add_bitfield(self.bitfield)
         await self.send_interested()
+        self.wake.set()
 
     async def _handle_request(self, length, data):
 
-        index_data = data[0:4]
-        begin_data = data[4:8]
-        length_data = data[8:12]
+        index = unpack_protocol_int(data[0:4])
+        begin = unpack_protocol_int(data[4:8])
+        length = unpack_protocol_int(data[8:12])
 
-        index = unpack_protocol_int(index_data)
-        begin = unpack_protocol_int(begin_data)
-        length = unpack_protocol_int(length_data)
+        if self.am_choking:
+            return
 
-        block = await FileReader.read(index, begin, length)
-        if block is None:
-            return print('block is none')
-        data = pack_id(7) + index_data + begin_data + block
-        await self._send(pack_length(len(data)) + data)
+        self.uploads.add(index, begin, length)
 
     async def _handle_piece(self, length, data):
         """ process download response """
@@ -203,27 +293,71 @@ class ClientConnection:
         index = unpack_protocol_int(index_data)
         begin = unpack_protocol_int(begin_data)
 
-        self.required_index.received(index, begin, block)
+        self.downloaded += len(block)
+        self.pipeline.received(index, begin, len(block))
+        if self.request_queue is not None:
+            await self.request_queue.block_received(self, index, begin, block)
+        self.wake.set()
+
+    async def queue_cancel(self, index, begin, length):
+        """ withdraw a block request, another peer delivered it """
+
+        self.pipeline.cancel(index, begin)
+        data = pack_id(8) + pack_protocol_int(index) + pack_protocol_int(begin) + pack_protocol_int(length)
+        self.send_queue.put_nowait(pack_length(len(data)) + data)
+        self.wake.set()
 
     async def _handle_cancel(self, length, data):
-        pass
+        """ peer no longer needs a block it requested """
+
+        index = unpack_protocol_int(data[0:4])
+        begin = unpack_protocol_int(data[4:8])
+        length = unpack_protocol_int(data[8:12])
+
+        self.uploads.cancel(index, begin, length)
 
     async def _handle_port(self, length, data):
         pass
 
     async def _send(self, data):
         """ send message to peer """
-        self.writer.write(data)
-        await self.writer.drain()
+        self.protocol.write(data)
+        await self.protocol.drain()
+
+    def collect(self, labels=()):
+        """ :returns: metric samples of the connection, see Metrics """
+        labels += (('peer', f'{self.host}:{self.port}'),)
+        samples = [
+            ('bt_peer_downloaded_bytes', labels, self.downloaded),
+            ('bt_peer_uploaded_bytes', labels, self.uploads.uploaded if self.uploads else 0),
+            ('bt_peer_download_rate', labels, self.pipeline.rate),
+            ('bt_peer_outstanding_requests', labels, self.pipeline.in_flight()),
+            ('bt_peer_pipeline_depth', labels, self.pipeline.depth),
+        ]
+        if self.pipeline.min_rtt is not None:
+            samples.append(('bt_peer_min_rtt_seconds', labels, self.pipeline.min_rtt))
+        return samples
 
     async def gracefully_shutdown(self):
         # print('shutting down peer')
-        if self.required_index is not None:
-            self.request_queue.cancel_piece(self.request_queue)
+        if self.request_queue is not None:
+            self.request_queue.return_blocks(self.pipeline.outstanding, self)
+        self.required_index = None
+        self.pipeline.clear()
+
+        if self.choker is not None:
+            self.choker.remove_peer(self)
+
+        if self.limiter is not None:
+            self.limiter.download.remove_peer(self)
+
+        if self.uploads is not None:
+            self.uploads.stop()
 
-        if self.writer is not None:
+        if self.protocol is not None:
             try:
-                await self.writer.wait_closed()
+                self.protocol.close()
+                await self.protocol.wait_closed()
             except:
                 pass
 
@@ -0,0 +1,163 @@
+import asyncio
+import heapq
+from time import monotonic
+from Controllers.ClientConnection import ClientConnection
+
+
+class ConnectionManager:
+    """
+    keeps a bounded set of outgoing peer connections for a download.
+
+    peers from the trackers go into a candidate pool, at most
+    MAX_HALF_OPEN of them are being connected to at a time and at
+    most MAX_PEERS are connected at all. a candidate that can't be
+    reached, or drops us before sending anything, is tried again
+    after RETRY_MIN seconds, doubling with every failure in a row up
+    to RETRY_MAX, and is forgotten after MAX_FAILURES. peers answering
+    for another torrent are never tried again
+    """
+
+    MAX_PEERS = 50
+    MAX_HALF_OPEN = 8
+    CONNECT_TIMEOUT = 10
+    HANDSHAKE_TIMEOUT = 10
+    RETRY_MIN = 15
+    RETRY_MAX = 1800
+    MAX_FAILURES = 6
+
+    def __init__(self, torrent, request_queue, choker=None, limiter=None,
+                 max_peers=MAX_PEERS, max_half_open=MAX_HALF_OPEN):
+        self.torrent = torrent
+        self.request_queue = request_queue
+        self.choker = choker
+        self.limiter = limiter
+        self.max_peers = max_peers
+        self.max_half_open = max_half_open
+
+        # peer -> failures in a row, for every peer that's known and not banned
+        self.failures = {}
+        # (due, peer) of the candidates waiting for their turn
+        self.candidates = []
+        self.half_open = {}
+        self.established = {}
+        self.banned = set()
+        self.wake = asyncio.Event()
+        self.task = None
+        self.connecting = set()
+
+        self.connects = 0
+        self.failed = 0
+
+    def add_peers(self, peers):
+        """ queue peers the trackers returned, the known ones keep their place """
+
+        now = monotonic()
+        for peer in peers:
+            if peer in self.failures or peer in self.banned:
+                continue
+            self.failures[peer] = 0
+            heapq.heappush(self.candidates, (now, peer))
+        self.wake.set()
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        """ stop making connections, the ones that are up are the request queue's to close """
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for task in self.connecting:
+            task.cancel()
+
+    async def run(self):
+        while not self.request_queue.is_finished():
+            self._fill()
+
+            delay = None
+            if self.candidates:
+                delay = max(0.0, self.candidates[0][0] - monotonic())
+            try:
+                await asyncio.wait_for(self.wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+    def _fill(self):
+        """ start connecting to the candidates that are due, as far as the limits allow """
+
+        now = monotonic()
+        while (
+            self.candidates and self.candidates[0][0] <= now
+            and len(self.half_open) < self.max_half_open
+            and len(self.half_open) + len(self.established) < self.max_peers
+        ):
+            _, peer = heapq.heappop(self.candidates)
+            if peer in self.half_open or peer in self.established or peer not in self.failures:
+                continue
+            task = asyncio.ensure_future(self._connect(peer))
+            self.connecting.add(task)
+            task.add_done_callback(self.connecting.discard)
+
+    async def _connect(self, peer):
+        conn = ClientConnection(peer[0], peer[1], self.torrent, self.request_queue, self.choker, self.limiter)
+        conn.am_interested = True
+        self.half_open[peer] = conn
+        try:
+            await conn.open(self.CONNECT_TIMEOUT, self.HANDSHAKE_TIMEOUT)
+        except ValueError as e:
+            print(f'Peer {peer[0]}:{peer[1]}: {e}')
+            self.banned.add(peer)
+            self.failures.pop(peer, None)
+            return await self._closed(peer, conn, self.half_open)
+        except (OSError, asyncio.TimeoutError):
+            self.failed += 1
+            self.failures[peer] += 1
+            return await self._closed(peer, conn, self.half_open)
+
+        del self.half_open[peer]
+        self.established[peer] = conn
+        self.connects += 1
+        self.wake.set()
+
+        try:
+            await conn.run()
+        except Exception:
+            pass
+
+        # only a connection that delivered something clears the slate
+        if peer in self.failures:
+            self.failures[peer] = 0 if conn.downloaded else self.failures[peer] + 1
+        await self._closed(peer, conn, self.established)
+
+    async def _closed(self, peer, conn, table):
+        """ clean up after a connection and put the peer back in line """
+
+        await conn.gracefully_shutdown()
+        table.pop(peer, None)
+
+        failures = self.failures.get(peer)
+        if failures is not None:
+            if failures >= self.MAX_FAILURES:
+                del self.failures[peer]
+            else:
+                delay = min(self.RETRY_MAX, self.RETRY_MIN * 2 ** max(0, failures - 1))
+                heapq.heappush(self.candidates, (monotonic() + delay, peer))
+        self.wake.set()
+
+    def stats(self):
+        """ :returns: dict of the connection counts """
+        return {
+            'candidates': len(self.failures) - len(self.half_open) - len(self.established),
+            'half_open': len(self.half_open),
+            'established': len(self.established),
+            'banned': len(self.banned),
+            'connects': self.connects,
+            'failed': self.failed,
+        }
+
+    def __str__(self):
+        return f"<ConnectionManager(established={len(self.established)}, half_open={len(self.half_open)})>"
+
+    def __repr__(self):
+        return self.__str__()
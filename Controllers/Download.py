@@ -0,0 +1,121 @@
+import asyncio
+from Models import RequestQueue
+from Controllers.Storage import Storage
+from Controllers.ResumeData import ResumeData
+from Controllers.Recheck import Recheck
+from Controllers.FileWriter import FileWriter
+from Controllers.HashVerifier import HashVerifier
+from Controllers.Choker import Choker
+from Controllers.ConnectionManager import ConnectionManager
+from Controllers.Announcer import Announcer
+
+
+class Download:
+    """
+    everything one torrent needs while it's being downloaded: the
+    storage and its resume data, the piece queue, a choker, the
+    outgoing connections and the announces. a Session runs many of
+    these side by side, sharing the hash verifier, rate limits and
+    tracker connections
+    """
+
+    def __init__(self, torrent, base=None, port=6881, upload_slots=Choker.SLOTS, limiter=None,
+                 max_peers=ConnectionManager.MAX_PEERS, verifier=None, pool=None, resume_path=None,
+                 resume=None):
+        """
+        :param base: where the payload goes, the torrent's name by default
+        :param verifier: HashVerifier shared with other downloads, one is started otherwise
+        :param pool: HttpPool shared with other torrents' announcers
+        :param resume: ResumeData from an earlier check(), which is done here otherwise
+        """
+
+        loop = asyncio.get_event_loop()
+        info = torrent.get_info()
+        self.torrent = torrent
+        self.base = base or info.file_name()
+
+        # before the writer preallocates the files, that touches their mtimes
+        self.resume = resume or self.check(torrent, self.base, resume_path)
+        self.storage = self.resume.storage
+
+        self.file_writer = FileWriter(torrent, loop, self.storage, resume=self.resume)
+        self.owns_verifier = verifier is None
+        self.verifier = verifier or HashVerifier(loop)
+        self.request_queue = RequestQueue(torrent, self.file_writer, self.verifier)
+        self.resume.apply(self.request_queue)
+
+        self.choker = Choker(upload_slots)
+        self.connections = ConnectionManager(torrent, self.request_queue, self.choker, limiter, max_peers)
+        self.announcer = Announcer(torrent, port, self.stats, self.connections.add_peers, pool)
+        self.finished = self.request_queue.is_finished()
+
+    @staticmethod
+    def check(torrent, base, resume_path=None, progress=Recheck.print_progress):
+        """
+        find the pieces already in the payload, from the resume data if
+        it still matches, by hashing what's on disk otherwise. blocks for
+        as long as that takes
+        :returns: ResumeData holding the pieces, dirty unless it was loaded
+        """
+
+        storage = Storage.from_torrent(torrent, base, writable=True)
+        resume = ResumeData(torrent, storage, resume_path)
+        resume.dirty = not resume.load()
+        if resume.dirty and storage.exists():
+            print('Checking existing data')
+            resume.pieces = Recheck(storage, torrent).run(progress)
+        return resume
+
+    def stats(self):
+        """ :returns: (uploaded, downloaded, left) for the trackers """
+        return self.file_writer.reader.uploaded, self.request_queue.downloaded, self.request_queue.left()
+
+    def collect(self):
+        """ :returns: metric samples labelled with the torrent's name, see Metrics """
+        labels = (('torrent', self.torrent.get_info().file_name()),)
+        samples = self.request_queue.collect(labels) + self.file_writer.collect(labels)
+        if self.owns_verifier:
+            samples += self.verifier.collect()
+        return samples
+
+    async def run(self):
+        """ download until every piece is verified and written """
+
+        if self.owns_verifier:
+            self.verifier.start()
+        self.resume.start(self.request_queue, self.file_writer)
+        self.choker.start()
+
+        if self.finished:
+            print('Already downloaded')
+            asyncio.ensure_future(self.request_queue.finalize_download())
+        else:
+            self.connections.start()
+        self.announcer.start()
+
+        completed = False
+        try:
+            await self.file_writer.worker()
+            completed = not self.finished
+        finally:
+            self.connections.stop()
+            self.choker.stop()
+            if self.owns_verifier:
+                self.verifier.stop()
+            await self.announcer.stop(completed=completed)
+
+    async def stop(self):
+        """ abandon the download, whatever is verified stays in the resume data """
+
+        self.connections.stop()
+        for peer in list(self.request_queue.peers):
+            await peer.gracefully_shutdown()
+        self.resume.stop()
+        self.resume.save(self.resume.snapshot())
+        self.storage.close()
+
+    def __str__(self):
+        return f"<Download(torrent={self.torrent}, base={self.base})>"
+
+    def __repr__(self):
+        return self.__str__()
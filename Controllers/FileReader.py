@@ -1,53 +1,195 @@
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-import os, glob
+import os
+from Models.LRUCache import LRUCache
 
 _executor = ThreadPoolExecutor(10)
 
 
 class FileReader:
+    """
+    serves blocks straight out of the payload's files
+    through a Storage, with cached descriptors and positional reads.
 
-    @classmethod
-    async def read(cls, piece, offset, length):
+    aligned block requests go through an lru block cache, a miss
+    reads ahead to the end of the piece since leechers request
+    the blocks of a piece in order.
+
+    uploads that aren't cached are sent with os.sendfile where the
+    platform and transport allow it, so the payload never enters
+    userspace.
+
+    readers of a session share one cache, blocks are keyed by the
+    reader they belong to
+    """
+
+    BLOCK_SIZE = 1 << 14
+    CACHE_SIZE = 64 * 1024 * 1024
+    SENDFILE = hasattr(os, 'sendfile')
+
+    def __init__(self, storage, piece_length, cache_size=CACHE_SIZE, cache=None):
+        """ :param cache: LRUCache shared with other readers, cache_size is ignored then """
+        self.storage = storage
+        self.piece_length = piece_length
+        self.length = storage.length
+        # a shared cache is reported by whoever shares it
+        self.owns_cache = cache is None
+        if cache is None and cache_size:
+            cache = LRUCache(cache_size)
+        self.cache = cache
+        self.pending = {}
+
+        self.sendfile_blocks = 0
+        self.buffered_blocks = 0
+        self.uploaded = 0
+
+    def _in_range(self, piece, offset, length):
+        position = piece * self.piece_length + offset
+        return offset + length <= self.piece_length and position + length <= self.length
+
+    async def send(self, protocol, piece, offset, length, header):
+        """
+        write a piece message, header followed by the block, to a PeerProtocol
+        :returns: False if the block is out of range
+        """
+
+        if not self._in_range(piece, offset, length):
+            return False
+
+        cached = self.cache is not None and (self, piece, offset) in self.cache.data
+        if self.SENDFILE and protocol.can_sendfile and not cached:
+            with protocol.exclusive() as write:
+                return await self._sendfile(protocol, write, piece, offset, length, header)
+
+        block = await self.read(piece, offset, length)
+        if block is None:
+            return False
+
+        self.buffered_blocks += 1
+        self.uploaded += length
+        protocol.write(header + block)
+        return True
+
+    async def _sendfile(self, protocol, write, piece, offset, length, header):
+        """ send a block with os.sendfile, while other writes to the protocol are held back """
+
+        position = piece * self.piece_length + offset
+        write(header)
+        sent = 0
+        try:
+            for index, file_offset, span in self.storage.spans(position, length):
+                with self.storage.file(index) as file:
+                    if not await protocol.sendfile(file, file_offset, span):
+                        break
+                sent += span
+        except (OSError, RuntimeError, ValueError) as e:
+            # part of the span may be out already, the peer can't tell where the block ends
+            print('sendfile failed, closing the connection', e)
+            protocol.close()
+            return True
+
+        if sent == length:
+            self.sendfile_blocks += 1
+            self.uploaded += length
+            return True
+
+        # sendfile isn't available, the spans before it are out in full
+        # with the header, only the rest of the block is missing
+        block = await self._read_async(position + sent, length - sent)
+        if block is None:
+            protocol.close()
+            return True
+
+        self.buffered_blocks += 1
+        self.uploaded += length
+        write(block)
+        return True
+
+    async def read(self, piece, offset, length):
+        """ :returns: block bytes, or None if it's out of range """
+
+        if not self._in_range(piece, offset, length):
+            return None
+
+        position = piece * self.piece_length + offset
+
+        if self.cache is None or offset % self.BLOCK_SIZE or length > self.BLOCK_SIZE:
+            return await self._read_async(position, length)
+
+        block = self.cache.get((self, piece, offset))
+        if block is None:
+            blocks = await self._read_ahead(piece, offset)
+            block = blocks.get(offset)
+            if block is None:
+                return await self._read_async(position, length)
+
+        return block[:length] if len(block) > length else block
+
+    async def _read_ahead(self, piece, offset):
+        """
+        read from offset to the end of the piece and cache it block by block,
+        concurrent misses on the same range share one read
+        :returns: dict of offset to block
+        """
+
+        future = self.pending.get((piece, offset))
+        if future is not None:
+            return await asyncio.shield(future)
+
+        piece_start = piece * self.piece_length
+        piece_end = min(piece_start + self.piece_length, self.length)
+        end = min(piece_end, piece_start + offset + max(self.cache.capacity // 4, self.BLOCK_SIZE))
+        offsets = range(offset, end - piece_start, self.BLOCK_SIZE)
+
+        future = asyncio.get_event_loop().create_future()
+        for block_offset in offsets:
+            self.pending.setdefault((piece, block_offset), future)
+
+        blocks = {}
+        try:
+            data = await self._read_async(piece_start + offset, end - piece_start - offset)
+            if data is not None:
+                for block_offset in offsets:
+                    start = block_offset - offset
+                    block = data[start:start + self.BLOCK_SIZE]
+                    self.cache.put((self, piece, block_offset), block)
+                    blocks[block_offset] = block
+        finally:
+            for block_offset in offsets:
+                if self.pending.get((piece, block_offset)) is future:
+                    del self.pending[(piece, block_offset)]
+            future.set_result(blocks)
+
+        return blocks
+
+    async def _read_async(self, position, length):
         return await asyncio.get_event_loop().run_in_executor(
-            _executor, cls._read,
-            piece, offset, length
+            _executor, self._read,
+            position, length
         )
 
-    @staticmethod
-    def _read(piece, offset, length):
+    def _read(self, position, length):
+        return self.storage.read(position, length)
 
-        try:
-            with open(f'pieces/{piece}', 'rb') as file:
-                return file.read()[offset:offset + length]
-
-        except Exception as e:
-            print('error', e)
-
-
-class FileDivider:
-
-    @classmethod
-    def divide_file(cls, path, chunks, total):
-        
-        files = glob.glob('pieces/*')
-        for f in files:
-            os.remove(f)
-        
-        field = {}
-        i = 0
-        with open(path, 'rb') as file:
-            while i < total:
-                data = file.read(chunks)
-                if data == '':
-                    break
-
-                dst = open(f'pieces/{i}', 'wb')
-                dst.write(data)
-                dst.close()
-
-                field[i] = True
-                i += 1
-
-        print('Done Dividing')
-        return field
+    def stats(self):
+        """ :returns: dict of upload and cache counters """
+        stats = {
+            'sendfile blocks': self.sendfile_blocks,
+            'buffered blocks': self.buffered_blocks
+        }
+        if self.cache is not None:
+            stats.update(self.cache.stats())
+        return stats
+
+    def collect(self, labels=()):
+        """ :returns: metric samples, see Metrics """
+        samples = [('bt_uploaded_bytes', labels, self.uploaded)]
+        if self.owns_cache and self.cache is not None:
+            samples += self.cache.collect(labels)
+        return samples
+
+    def close(self):
+        if self.cache is not None:
+            for key in [key for key in self.cache.data if key[0] is self]:
+                self.cache.discard(key)
+        self.storage.close()
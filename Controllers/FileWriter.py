@@ -1,65 +1,117 @@
 from asyncio import Queue
-import os, glob
 from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from Models import metrics
+from Controllers.FileReader import FileReader
+from Controllers.Storage import Storage
 
 
 _executor = ThreadPoolExecutor(10)
+_write = metrics.histogram('bt_write_seconds', 'time from queueing a piece write until it is on disk')
 
 
 class FileWriter:
-
-    def __init__(self, torrent, loop):
+    """
+    writes verified pieces straight into the preallocated
+    destination files at piece * piece_length through a Storage,
+    uploads are read back from them through a FileReader. whatever
+    is already in the files is kept, resume data or a recheck says
+    what's valid
+    """
+
+    def __init__(self, torrent, loop, storage=None, sparse=True,
+                 cache_size=FileReader.CACHE_SIZE, resume=None):
         self.queue = Queue()
         self.torrent = torrent
         self.loop = loop
         self.path = torrent.get_info().file_name()
+        self.piece_length = torrent.get_info().piece_length()
+        self.length = torrent.get_info().total_length()
         self.is_done = False
         self.memory = {}
+        self.resume = resume
 
-        files = glob.glob('pieces/*')
-        for f in files:
-            os.remove(f)
+        self.storage = storage or Storage.from_torrent(torrent, self.path, writable=True)
+        self.storage.preallocate(sparse)
+        self.reader = FileReader(self.storage, self.piece_length, cache_size)
 
     def add_piece(self, piece):
-        self.queue.put_nowait(piece)
+        self.queue.put_nowait((piece, monotonic()))
 
     async def worker(self):
-        while not self.is_done or not self.queue.empty():
-            piece = await self.queue.get()
+        """
+        write pieces until finish_writing() is called and the queue is
+        empty. a piece that can't be written fails the download, the
+        error is raised once what made it to disk is synced and in the
+        resume data
+        """
+        try:
+            while not self.is_done or not self.queue.empty():
+                item = await self.queue.get()
+                try:
+                    # None only wakes the worker up to see it's done
+                    if item is not None:
+                        await self._write_piece(*item)
+                except OSError as e:
+                    print('writing piece failed', item[0].piece, e)
+                    raise
+                finally:
+                    self.queue.task_done()
+        finally:
+            try:
+                await self.loop.run_in_executor(_executor, self.storage.sync)
+            except OSError as e:
+                print('sync failed', e)
+            if self.resume is not None:
+                self.resume.stop()
+                self.resume.save(self.resume.snapshot())
+            self.reader.close()
+
+    async def _write_piece(self, piece, queued):
 
-            await self._write_piece(piece)
-            self.queue.task_done()
+        await self.loop.run_in_executor(
+            _executor, self.storage.write,
+            piece.piece * self.piece_length, piece.get_data()
+        )
 
-        await self._combine_pieces()
-        self.loop.stop()
+        _write.observe(monotonic() - queued)
+        self.memory[piece.piece] = True
+        if self.resume is not None:
+            self.resume.piece_written(piece.piece)
 
-    async def _write_piece(self, piece):
+    async def write_block(self, piece, offset, data):
+        """ write a block of a piece that isn't verified yet, for resume data """
 
         await self.loop.run_in_executor(
-            _executor, self._writer,
-            piece.piece, piece.get_data()
+            _executor, self.storage.write,
+            piece * self.piece_length + offset, data
         )
 
-        self.memory[piece.piece] = True
+    def load_block(self, piece, offset, length):
+        """ :returns: block bytes read back from the file, or None """
+        return self.storage.read(piece * self.piece_length + offset, length)
+
+    async def read(self, piece, offset, length):
+        """ read a block back from a piece that has been written """
+
+        if piece not in self.memory or self.storage.closed:
+            return None
 
-    async def _combine_pieces(self):
+        return await self.reader.read(piece, offset, length)
 
-        with open(self.path, 'wb') as dest:
-            keys = list(sorted(self.memory.keys()))
-            for key in keys:
-                src = open(f'pieces/{key}', 'rb').read()
-                dest.write(src)
+    async def send(self, protocol, piece, offset, length, header):
+        """ send a block from a piece that has been written, see FileReader.send """
 
-        files = glob.glob('pieces/*')
-        for f in files:
-            os.remove(f)
+        if piece not in self.memory or self.storage.closed:
+            return False
 
-    def _writer(self, piece, data):
+        return await self.reader.send(protocol, piece, offset, length, header)
 
-        file = open(f'pieces/{piece}', 'wb')
-        file.write(data)
-        file.close()
+    def collect(self, labels=()):
+        """ :returns: metric samples, see Metrics """
+        return [('bt_write_queue_depth', labels, self.queue.qsize())] + self.reader.collect(labels)
 
     async def finish_writing(self):
         self.is_done = True
+        self.queue.put_nowait(None)
         print('\nWriting to file')
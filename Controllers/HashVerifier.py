@@ -0,0 +1,110 @@
+import asyncio
+import os
+from asyncio import Queue
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, monotonic
+from Models import metrics
+
+
+_executor = ThreadPoolExecutor(os.cpu_count())
+_wait = metrics.histogram('bt_hash_wait_seconds', 'time a piece waits for a hashing worker')
+_hash = metrics.histogram('bt_hash_seconds', 'time spent hashing a piece')
+
+
+class HashVerifier:
+    """
+    verifies completed pieces off the event loop. sha1 releases
+    the gil on large buffers, so the thread pool spreads hashing
+    over every core. the queue is bounded, callers wait in
+    verify() whenever hashing falls behind the network
+    """
+
+    def __init__(self, loop, workers=None):
+        self.loop = loop
+        self.workers = workers or os.cpu_count()
+        self.queue = Queue(maxsize=2 * self.workers)
+        self.tasks = []
+
+        self.pieces = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.started = None
+
+    def start(self):
+        """ spawn the hashing workers """
+        self.started = monotonic()
+        for _ in range(self.workers):
+            self.tasks.append(self.loop.create_task(self.worker()))
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    async def verify(self, piece_handler, expected_hash, callback):
+        """
+        queue a piece for verification,
+        callback(piece_handler, valid) is awaited once it's hashed,
+        with valid False if hashing it failed
+        """
+        await self.queue.put((piece_handler, expected_hash, callback, monotonic()))
+
+    async def worker(self):
+        while True:
+            piece_handler, expected_hash, callback, queued = await self.queue.get()
+            _wait.observe(monotonic() - queued)
+            try:
+                piece_hash, elapsed = await self.loop.run_in_executor(
+                    _executor, self._hash, piece_handler
+                )
+                self.pieces += 1
+                self.bytes += piece_handler.length
+                self.busy += elapsed
+                _hash.observe(elapsed)
+                await callback(piece_handler, piece_hash == expected_hash)
+            except Exception as e:
+                print('verifying piece failed', piece_handler, e)
+                await self._fail(piece_handler, callback)
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    async def _fail(piece_handler, callback):
+        """ report a piece that couldn't be verified as invalid, so it's downloaded again """
+        try:
+            await callback(piece_handler, False)
+        except Exception as e:
+            print('giving up on piece', piece_handler, e)
+
+    @staticmethod
+    def _hash(piece_handler):
+        start = perf_counter()
+        piece_hash = piece_handler.create_hash()
+        return piece_hash, perf_counter() - start
+
+    def stats(self):
+        """ :returns: dict of hashing counters and throughput in MB/s """
+        wall = monotonic() - self.started if self.started else 0.0
+        return {
+            'workers': self.workers,
+            'queued': self.queue.qsize(),
+            'pieces': self.pieces,
+            'bytes': self.bytes,
+            'per worker MB/s': self.bytes / self.busy / (1000 * 1000) if self.busy else 0.0,
+            'total MB/s': self.bytes / wall / (1000 * 1000) if wall else 0.0,
+            'utilization': self.busy / (wall * self.workers) if wall else 0.0
+        }
+
+    def collect(self, labels=()):
+        """ :returns: metric samples, see Metrics """
+        return [
+            ('bt_hash_queue_depth', labels, self.queue.qsize()),
+            ('bt_hashed_pieces', labels, self.pieces),
+            ('bt_hashed_bytes', labels, self.bytes),
+        ]
+
+    def __str__(self):
+        return f"<HashVerifier(workers={self.workers}, queued={self.queue.qsize()})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,139 @@
+import asyncio
+from urllib.parse import urlsplit
+
+
+class HttpPool:
+    """
+    minimal http/1.1 GET client on asyncio streams that keeps
+    connections alive and hands them out again for the next
+    request to the same host, so re-announces to a tracker skip
+    the tcp (and tls) handshake. at most MAX_CONNECTIONS requests
+    run against a host at a time, the rest wait their turn, so a
+    session starting many torrents doesn't flood its trackers
+    """
+
+    TIMEOUT = 15.0
+    MAX_IDLE = 16
+    MAX_CONNECTIONS = 16
+
+    def __init__(self):
+        self.idle = {}
+        self.slots = {}
+
+    async def _connect(self, key):
+        """ :returns: (reader, writer, reused) """
+        connections = self.idle.get(key)
+        while connections:
+            reader, writer = connections.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+
+        scheme, host, port = key
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=scheme == 'https'), self.TIMEOUT
+        )
+        return reader, writer, False
+
+    def _release(self, key, reader, writer):
+        connections = self.idle.setdefault(key, [])
+        if len(connections) < self.MAX_IDLE:
+            connections.append((reader, writer))
+        else:
+            writer.close()
+
+    async def get(self, url):
+        """
+        :returns: (status code, body bytes)
+        :raises ConnectionError: or asyncio.TimeoutError when the request fails
+        """
+
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        host = parts.hostname if port in (80, 443) else f'{parts.hostname}:{port}'
+        request = (
+            f'GET {target} HTTP/1.1\r\n'
+            f'Host: {host}\r\n'
+            'Connection: keep-alive\r\n'
+            'Accept-Encoding: identity\r\n\r\n'
+        ).encode()
+
+        slots = self.slots.get(key)
+        if slots is None:
+            slots = self.slots[key] = asyncio.Semaphore(self.MAX_CONNECTIONS)
+        async with slots:
+            return await self._get(key, request)
+
+    async def _get(self, key, request):
+        while True:
+            reader, writer, reused = await self._connect(key)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, keep_alive, body = await asyncio.wait_for(self._response(reader), self.TIMEOUT)
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                writer.close()
+                if reused:
+                    # the server closed an idle connection, try a fresh one
+                    continue
+                if isinstance(e, asyncio.IncompleteReadError):
+                    raise ConnectionError('connection closed mid response')
+                raise
+
+            if keep_alive:
+                self._release(key, reader, writer)
+            else:
+                writer.close()
+            return status, body
+
+    async def _response(self, reader):
+        """ :returns: (status code, whether the connection stays open, body) """
+
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError('connection closed')
+
+        version, status = line.split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # trailers end with an empty line
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                body += await reader.readexactly(size)
+                await reader.readexactly(2)
+            body = bytes(body)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+
+        return int(status), keep_alive, body
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+    def __str__(self):
+        return f"<HttpPool(idle={sum(len(c) for c in self.idle.values())})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,77 @@
+import asyncio
+from Models import metrics as default_metrics
+
+
+class MetricsServer:
+    """
+    serves the metrics in the prometheus text format over http,
+    GET /metrics is the only thing it answers. it binds to loopback
+    unless told otherwise, there's no authentication
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+    TIMEOUT = 10
+
+    def __init__(self, port, host='127.0.0.1', metrics=None):
+        self.host = host
+        self.port = port
+        self.metrics = metrics or default_metrics
+        self.server = None
+        self.scrapes = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(self._read_request(reader), self.TIMEOUT)
+            if request is None:
+                return
+
+            method, path = request
+            if method not in ('GET', 'HEAD'):
+                status, body = '405 Method Not Allowed', b''
+            elif path.split('?')[0] != '/metrics':
+                status, body = '404 Not Found', b''
+            else:
+                self.scrapes += 1
+                status, body = '200 OK', self.metrics.render().encode()
+
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: {self.CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: close\r\n\r\n'.encode()
+            )
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        """ :returns: (method, path), or None if it isn't an http request """
+
+        line = await reader.readline()
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            return None
+
+        # skip the headers, nothing in them changes the answer
+        while (await reader.readline()).strip():
+            pass
+        return parts[0], parts[1]
+
+    def __str__(self):
+        return f"<MetricsServer(host={self.host}, port={self.port})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,262 @@
+import asyncio
+from contextlib import contextmanager
+from Utils import unpack_length
+
+
+class PeerProtocol(asyncio.BufferedProtocol):
+    """
+    incremental framing layer for the peer wire protocol,
+    the transport reads straight into a reusable buffer and
+    length-prefixed messages are handed out as memoryview
+    slices of it. a slice stays valid until the next read call,
+    so handlers have to copy whatever they want to keep.
+
+    asyncio refuses every other write to a transport while a sendfile
+    is in progress, and a block sent that way mustn't be split by other
+    messages anyway. while one is being sent, see exclusive(), writes
+    are held back in order and go out right after it
+    """
+
+    BUFFER_SIZE = 1 << 18
+    MIN_READ = 1 << 14
+    HIGH_WATER = 1 << 22
+
+    def __init__(self, connected_cb=None):
+        self.buffer = bytearray(self.BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.held = False
+
+        self.transport = None
+        self.connected_cb = connected_cb
+        self.task = None
+        self.eof = False
+        self.reading_paused = False
+        self.writing_paused = False
+        self.waiter = None
+        self.drain_waiter = None
+        self.can_sendfile = True
+        self.exclusive_writes = False
+        self.deferred = []
+        self.closed = asyncio.get_event_loop().create_future()
+
+    @classmethod
+    async def open_connection(cls, host, port):
+        """ connect to a peer, :returns: PeerProtocol instance """
+        loop = asyncio.get_event_loop()
+        _, protocol = await loop.create_connection(cls, host, port)
+        return protocol
+
+    @classmethod
+    async def start_server(cls, client_connected_cb, host, port):
+        """ listen for peers, client_connected_cb(protocol) runs per connection """
+        loop = asyncio.get_event_loop()
+        return await loop.create_server(
+            lambda: cls(client_connected_cb), host, port
+        )
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.connected_cb is not None:
+            self.task = asyncio.ensure_future(self.connected_cb(self))
+
+    def connection_lost(self, exc):
+        self.eof = True
+        self._wake_reader()
+        self._wake_writer()
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def eof_received(self):
+        self.eof = True
+        self._wake_reader()
+
+    def get_buffer(self, sizehint):
+        if not self.held and self.start == self.end:
+            self.start = self.end = 0
+
+        if len(self.buffer) - self.end < self.MIN_READ:
+            self._make_room()
+
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+        if self.end - self.start >= self.HIGH_WATER and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+        self._wake_reader()
+
+    def _make_room(self):
+        """
+        move the unconsumed tail to the front of the buffer, or into a
+        new one when a handed out slice still points into the current one
+        """
+        pending = self.end - self.start
+        needed = pending + self.MIN_READ
+        if pending >= 4:
+            needed = max(needed, 4 + unpack_length(self.view[self.start:self.start + 4]))
+
+        if not self.held and needed <= len(self.buffer):
+            self.buffer[0:pending] = bytes(self.view[self.start:self.end])
+        else:
+            buffer = bytearray(max(self.BUFFER_SIZE, needed))
+            buffer[0:pending] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+            self.held = False
+
+        self.start = 0
+        self.end = pending
+
+    def _wake_reader(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def _wake_writer(self):
+        if self.drain_waiter is not None and not self.drain_waiter.done():
+            self.drain_waiter.set_result(None)
+        self.drain_waiter = None
+
+    async def _wait(self, timeout):
+        """ wait for the transport to deliver more data """
+        if self.reading_paused:
+            self.reading_paused = False
+            self.transport.resume_reading()
+
+        self.waiter = asyncio.get_event_loop().create_future()
+        try:
+            if timeout is None:
+                await self.waiter
+            else:
+                await asyncio.wait_for(self.waiter, timeout)
+        finally:
+            self.waiter = None
+
+    def _release(self):
+        self.held = False
+        if self.reading_paused and self.end - self.start < self.HIGH_WATER // 2:
+            self.reading_paused = False
+            self.transport.resume_reading()
+
+    async def read_exactly(self, n, timeout=None):
+        """ :returns: memoryview of the next n bytes, or None on eof """
+        self._release()
+        while self.end - self.start < n:
+            if self.eof:
+                return None
+            await self._wait(timeout)
+
+        begin = self.start
+        self.start += n
+        self.held = True
+        return self.view[begin:self.start]
+
+    def _next_message(self):
+        while self.end - self.start >= 4:
+            length = unpack_length(self.view[self.start:self.start + 4])
+            if self.end - self.start < 4 + length:
+                return None
+
+            begin = self.start + 4
+            self.start = begin + length
+            if length == 0:
+                # keep alive
+                continue
+
+            self.held = True
+            return length, self.buffer[begin], self.view[begin + 1:self.start]
+
+        return None
+
+    async def read_message(self, timeout=None):
+        """
+        wait for the next complete message, skipping keep alives
+        :returns: (length, id, payload memoryview), or None on eof
+        :raises asyncio.TimeoutError: if nothing arrives within timeout
+        """
+        self._release()
+        while True:
+            message = self._next_message()
+            if message is not None:
+                return message
+            if self.eof:
+                return None
+            await self._wait(timeout)
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self._wake_writer()
+
+    def write(self, data):
+        if self.exclusive_writes:
+            self.deferred.append(data)
+        else:
+            self.transport.write(data)
+
+    @contextmanager
+    def exclusive(self):
+        """
+        hold back every other write until the with block ends, for a
+        message that goes out in pieces, header and sendfile calls
+        :returns: write function that skips the queue, for the message itself
+        """
+        self.exclusive_writes = True
+        try:
+            yield self.transport.write
+        finally:
+            self.exclusive_writes = False
+            deferred, self.deferred = self.deferred, []
+            if deferred and not self.transport.is_closing():
+                self.transport.write(b''.join(deferred))
+
+    async def drain(self):
+        if self.closed.done():
+            raise ConnectionResetError('Connection lost')
+
+        if self.writing_paused:
+            # the sender and receiver tasks may both be waiting here
+            if self.drain_waiter is None:
+                self.drain_waiter = asyncio.get_event_loop().create_future()
+            await asyncio.shield(self.drain_waiter)
+
+    async def sendfile(self, file, offset, count):
+        """
+        send count bytes of file straight from the page cache. any
+        other error is raised, some of the bytes may be out by then
+        :returns: False if the transport doesn't support os.sendfile, nothing was sent then
+        """
+        if not self.can_sendfile:
+            return False
+
+        try:
+            await asyncio.get_event_loop().sendfile(
+                self.transport, file, offset, count, fallback=False
+            )
+            return True
+        except asyncio.SendfileNotAvailableError:
+            # asyncio's own fallback seeks the shared file object,
+            # the caller falls back to positional reads instead
+            self.can_sendfile = False
+            return False
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    async def wait_closed(self):
+        await asyncio.shield(self.closed)
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def __str__(self):
+        return f"<PeerProtocol(pending={self.end - self.start})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,164 @@
+import asyncio
+from collections import OrderedDict, deque
+from time import monotonic
+
+
+class TokenBucket:
+    """
+    bytes per second budget, a rate of 0 means unlimited. the
+    balance may go negative so a block larger than the bucket
+    still gets through, the debt is paid off before the next one
+    """
+
+    BURST = 0.5
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = rate * self.BURST
+        self.stamp = monotonic()
+
+    def set_rate(self, rate):
+        self.refill(monotonic())
+        self.rate = rate
+        self.tokens = min(self.tokens, rate * self.BURST)
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.rate * self.BURST, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def ready(self):
+        return not self.rate or self.tokens > 0
+
+    def consume(self, amount):
+        if self.rate:
+            self.tokens -= amount
+
+    def delay(self):
+        """ :returns: seconds until the bucket is ready again """
+        if self.ready():
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Bandwidth:
+    """
+    rate limit for one direction, a global bucket shared by every
+    peer in front of one bucket per peer. peers that have to wait
+    are served round robin, one block each, so a fast peer can't
+    take the whole global budget
+    """
+
+    def __init__(self, rate=0, peer_rate=0):
+        self.bucket = TokenBucket(rate)
+        self.peer_rate = peer_rate
+        self.peers = {}
+        self.waiting = OrderedDict()
+        self.task = None
+        self.transferred = 0
+
+    def set_rate(self, rate):
+        self.bucket.set_rate(rate)
+
+    def set_peer_rate(self, rate):
+        self.peer_rate = rate
+        for bucket in self.peers.values():
+            bucket.set_rate(rate)
+
+    def remove_peer(self, peer):
+        """ forget a peer, whatever it's still waiting for returns right away """
+        self.peers.pop(peer, None)
+        for _, future in self.waiting.pop(peer, ()):
+            # not cancelled, a CancelledError would tear through the connection's cleanup
+            if not future.done():
+                future.set_result(None)
+
+    def _peer_bucket(self, peer):
+        bucket = self.peers.get(peer)
+        if bucket is None:
+            bucket = self.peers[peer] = TokenBucket(self.peer_rate)
+        return bucket
+
+    def _grant(self, bucket, amount):
+        self.bucket.consume(amount)
+        bucket.consume(amount)
+        self.transferred += amount
+
+    async def acquire(self, peer, amount):
+        """
+        wait until amount bytes may be transferred for the peer, or
+        until the peer is removed
+        """
+
+        bucket = self._peer_bucket(peer)
+        if not self.waiting:
+            now = monotonic()
+            self.bucket.refill(now)
+            bucket.refill(now)
+            if self.bucket.ready() and bucket.ready():
+                return self._grant(bucket, amount)
+
+        future = asyncio.get_event_loop().create_future()
+        self.waiting.setdefault(peer, deque()).append((amount, future))
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self.waiting:
+            now = monotonic()
+            self.bucket.refill(now)
+            if not self.bucket.ready():
+                await asyncio.sleep(self.bucket.delay())
+                continue
+
+            delay = None
+            for peer in list(self.waiting):
+                bucket = self.peers[peer]
+                bucket.refill(now)
+                if not bucket.ready():
+                    delay = bucket.delay() if delay is None else min(delay, bucket.delay())
+                    continue
+
+                queue = self.waiting[peer]
+                amount, future = queue.popleft()
+                if queue:
+                    # back of the line until everyone else had a turn
+                    self.waiting.move_to_end(peer)
+                else:
+                    del self.waiting[peer]
+
+                if not future.done():
+                    self._grant(bucket, amount)
+                    future.set_result(None)
+                delay = None
+                break
+
+            if delay is not None:
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            'rate': self.bucket.rate,
+            'peer rate': self.peer_rate,
+            'peers': len(self.peers),
+            'waiting': sum(len(queue) for queue in self.waiting.values()),
+            'transferred': self.transferred
+        }
+
+
+class RateLimiter:
+    """
+    upload and download limits shared by every connection,
+    rates are bytes per second and 0 means unlimited
+    """
+
+    def __init__(self, upload=0, download=0, peer_upload=0, peer_download=0):
+        self.upload = Bandwidth(upload, peer_upload)
+        self.download = Bandwidth(download, peer_download)
+
+    def __str__(self):
+        return f"<RateLimiter(upload={self.upload.bucket.rate}, download={self.download.bucket.rate})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,178 @@
+import mmap
+import os
+import sys
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from hashlib import sha1
+from time import perf_counter
+from Models.BitField import BitField
+
+
+def _map(path, offset, length):
+    """
+    mmap a range of a file
+    :returns: (mmap, memoryview over the part of the range that exists)
+    """
+    try:
+        with open(path, 'rb') as file:
+            available = min(length, os.fstat(file.fileno()).st_size - offset)
+            if available <= 0:
+                return None, None
+
+            # mmap offsets have to be multiples of the allocation granularity
+            base = offset - offset % mmap.ALLOCATIONGRANULARITY
+            region = mmap.mmap(file.fileno(), offset - base + available, access=mmap.ACCESS_READ, offset=base)
+    except OSError:
+        return None, None
+
+    if hasattr(region, 'madvise'):
+        region.madvise(mmap.MADV_SEQUENTIAL)
+    return region, memoryview(region)[offset - base:]
+
+
+def _check_pieces(segments, piece_length, hashes):
+    """
+    hash a run of pieces straight out of mmaps of the files it spans,
+    runs in a worker process
+    :param segments: list of (path, offset, length) making up the run in order
+    :returns: bytes with a 1 for every piece that matches its hash
+    """
+
+    regions = []
+    views = []
+    starts = []
+    position = 0
+    for path, offset, length in segments:
+        region, view = _map(path, offset, length)
+        if region is not None:
+            regions.append(region)
+            starts.append(position)
+            views.append(view)
+        if view is None or len(view) < length:
+            # missing or cut short, nothing to hash here
+            starts.append(position + (0 if view is None else len(view)))
+            views.append(None)
+        position += length
+
+    count = len(hashes) // 20
+    valid = bytearray(count)
+    for i in range(count):
+        start = i * piece_length
+        end = min(start + piece_length, position)
+        digest = sha1()
+        k = bisect_right(starts, start) - 1
+        while start < end:
+            view = views[k]
+            if view is None:
+                break
+            chunk = view[start - starts[k]:end - starts[k]]
+            digest.update(chunk)
+            start += len(chunk)
+            k += 1
+
+        valid[i] = start == end and digest.digest() == hashes[i * 20:i * 20 + 20]
+
+    # the mmaps can't be closed while slices of them are around
+    view = chunk = None
+    for view in views:
+        if view is not None:
+            view.release()
+    for region in regions:
+        region.close()
+
+    return bytes(valid)
+
+
+class Recheck:
+    """
+    hashes the data already on disk against the torrent's piece
+    hashes, to build the bitfield for seeding or for resuming a
+    download that has no resume data to trust.
+
+    the pieces are split into runs of about CHUNK_SIZE bytes that
+    worker processes hash out of their own mmaps of the files the
+    run spans, payloads below INLINE_LIMIT are hashed in this process
+    """
+
+    CHUNK_SIZE = 64 * 1024 * 1024
+    INLINE_LIMIT = 32 * 1024 * 1024
+
+    def __init__(self, storage, torrent, workers=None):
+        info = torrent.get_info()
+        self.storage = storage
+        self.piece_length = info.piece_length()
+        self.length = info.total_length()
+        self.hashes = bytes(info.hashes)
+        self.piece_count = len(self.hashes) // 20
+        self.workers = workers or os.cpu_count() or 1
+
+        self.checked = 0
+        self.elapsed = 0.0
+
+    def _chunks(self):
+        pieces = max(1, self.CHUNK_SIZE // self.piece_length)
+        paths = self.storage.index.paths
+        for first in range(0, self.piece_count, pieces):
+            last = min(first + pieces, self.piece_count)
+            position = first * self.piece_length
+            segments = [
+                (paths[index], offset, length)
+                for index, offset, length in self.storage.spans(position, (last - first) * self.piece_length)
+            ]
+            yield first, segments, self.hashes[first * 20:last * 20]
+
+    def run(self, progress=None):
+        """
+        :param progress: called with (pieces checked, piece count) after every run of pieces
+        :returns: BitField of the pieces whose data matches
+        """
+
+        bitfield = BitField.empty(self.piece_count)
+        if not self.storage.exists() or not self.piece_count:
+            return bitfield
+
+        started = perf_counter()
+        self.checked = 0
+        if self.workers == 1 or self.length < self.INLINE_LIMIT:
+            for first, segments, hashes in self._chunks():
+                valid = _check_pieces(segments, self.piece_length, hashes)
+                self._collect(bitfield, first, valid, progress)
+        else:
+            with ProcessPoolExecutor(self.workers) as pool:
+                futures = {
+                    pool.submit(_check_pieces, segments, self.piece_length, hashes): first
+                    for first, segments, hashes in self._chunks()
+                }
+                for future in as_completed(futures):
+                    self._collect(bitfield, futures[future], future.result(), progress)
+
+        self.elapsed = perf_counter() - started
+        return bitfield
+
+    def _collect(self, bitfield, first, valid, progress):
+        for i in range(len(valid)):
+            if valid[i]:
+                bitfield.set_piece(first + i)
+
+        self.checked += len(valid)
+        if progress is not None:
+            progress(self.checked, self.piece_count)
+
+    def rate(self):
+        """ :returns: bytes hashed per second by the last run """
+        if not self.elapsed:
+            return 0.0
+        return min(self.length, self.checked * self.piece_length) / self.elapsed
+
+    @staticmethod
+    def print_progress(checked, total):
+        print(f'\rChecking: {100 * checked / total:.1f}% ({checked}/{total} pieces)', end='')
+        if checked == total:
+            print()
+        sys.stdout.flush()
+
+    def __str__(self):
+        return f"<Recheck(storage={self.storage}, workers={self.workers})>"
+
+    def __repr__(self):
+        return self.__str__()
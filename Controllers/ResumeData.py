@@ -0,0 +1,211 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from Utils import bencoding
+from Models.BitField import BitField
+
+_executor = ThreadPoolExecutor(1)
+
+
+class ResumeData:
+    """
+    remembers which pieces of a download are verified and on disk,
+    next to the payload as <name>.resume. it's rewritten whenever
+    pieces were written, at most every SAVE_INTERVAL seconds, along
+    with the blocks of partial pieces, which get flushed into the
+    payload first so they survive a restart as well.
+
+    the size and mtime of every file are recorded too, taken when
+    the data is saved, and resume data is stale once they don't match
+    exactly. a write after the last save, ours or anyone's, means the
+    payload gets rechecked, nothing that wasn't hashed is trusted
+    """
+
+    SAVE_INTERVAL = 1.0
+
+    def __init__(self, torrent, storage, path=None):
+        info = torrent.get_info()
+        self.info_hash = torrent.get_info_hash()
+        self.storage = storage
+        self.path = path or info.file_name() + '.resume'
+        self.piece_length = info.piece_length()
+        self.pieces = BitField.empty(info.piece_count())
+
+        # piece -> BitField of its blocks that are in the payload
+        self.partial = {}
+        self.flushed = {}
+        self.dirty = False
+        self.task = None
+
+    def load(self):
+        """ :returns: True if there's resume data and it matches the payload """
+
+        try:
+            with open(self.path, 'rb') as file:
+                # every value is text or a number, the bitfields are stored as hex
+                data = bencoding.decode(file.read(), binary=())
+        except (OSError, bencoding.BencodeError):
+            return False
+
+        try:
+            if bytes.fromhex(data['info hash']) != self.info_hash:
+                return False
+
+            files = data['files']
+            stats = self.storage.stat()
+            if len(files) != len(stats):
+                print('resume data is stale')
+                return False
+
+            for (size, mtime), (current_size, current_mtime) in zip(files, stats):
+                if current_size != size or current_mtime != mtime:
+                    print('resume data is stale')
+                    return False
+
+            self.pieces = BitField(bytes.fromhex(data['pieces']))
+            self.partial = {
+                piece: BitField(bytes.fromhex(blocks))
+                for piece, blocks in data['partial']
+            }
+        except (KeyError, TypeError, ValueError):
+            print('resume data is corrupt')
+            return False
+
+        return True
+
+    def apply(self, request_queue):
+        """ hand the loaded pieces and partial pieces to a fresh RequestQueue """
+        for piece_handler in request_queue.restore(self.pieces, self.partial):
+            self.flushed[piece_handler] = self.partial[piece_handler.piece]
+
+    def start(self, request_queue, file_writer):
+        self.task = asyncio.ensure_future(self.run(request_queue, file_writer))
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self, request_queue, file_writer):
+        while not self.storage.closed:
+            await asyncio.sleep(self.SAVE_INTERVAL)
+            if self.storage.closed:
+                return
+
+            await self.flush_partial(request_queue.handlers, file_writer)
+            if self.dirty and not self.storage.closed:
+                await asyncio.get_event_loop().run_in_executor(
+                    _executor, self.save, self.snapshot()
+                )
+
+    def piece_written(self, piece):
+        """ a verified piece made it into the payload """
+        self.pieces.set_piece(piece)
+        self.partial.pop(piece, None)
+        self.dirty = True
+
+    async def flush_partial(self, handlers, file_writer):
+        """ write the received blocks of partial pieces into the payload """
+
+        partial = {}
+        current = list(handlers.values())
+        for piece_handler in current:
+            if self.pieces.has_piece(piece_handler.piece):
+                continue
+
+            flushed = self.flushed.get(piece_handler)
+            if flushed is None:
+                flushed = self.flushed[piece_handler] = BitField.empty(piece_handler.block_count)
+
+            for block in range(piece_handler.block_count):
+                if handlers.get(piece_handler.piece) is not piece_handler:
+                    # verified or thrown away while we were writing
+                    break
+                if piece_handler.status[block] != piece_handler.BLOCK_AVAILABLE or flushed.has_piece(block):
+                    continue
+
+                offset = block * piece_handler.BLOCK_SIZE
+                length = piece_handler.next_length(offset)
+                data = bytes(piece_handler.view[offset:offset + length])
+                await file_writer.write_block(piece_handler.piece, offset, data)
+                flushed.set_piece(block)
+                self.dirty = True
+
+            partial[piece_handler.piece] = flushed
+
+        # handlers that are gone were completed or failed verification
+        self.flushed = {
+            piece_handler: self.flushed[piece_handler] for piece_handler in current
+            if piece_handler in self.flushed
+        }
+        if set(partial) != set(self.partial):
+            self.dirty = True
+        self.partial = partial
+
+    def snapshot(self):
+        """ :returns: dict of the current state, for save """
+        self.dirty = False
+        return {
+            'info hash': self.info_hash.hex(),
+            'pieces': self.pieces.to_bytes().hex(),
+            'partial': [
+                [piece, blocks.to_bytes().hex()]
+                for piece, blocks in self.partial.items()
+                if blocks.count()
+            ]
+        }
+
+    def save(self, data):
+        """ write the resume file, the files' mtimes are taken after their last write """
+
+        data['files'] = self.storage.stat()
+
+        temp = self.path + '.tmp'
+        try:
+            with open(temp, 'wb') as file:
+                file.write(bencoding.encode(data))
+            os.replace(temp, self.path)
+        except OSError as e:
+            print('failed to save resume data', e)
+
+    def __str__(self):
+        return f"<ResumeData(path={self.path}, pieces={self.pieces.count()})>"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+if __name__ == '__main__':
+
+    import tempfile
+    from Models import TorrentFile
+    from Controllers.Storage import Storage
+    from Benchmarks.synthetic import make_payload, make_torrent
+
+    with tempfile.TemporaryDirectory() as directory:
+        payload = os.path.join(directory, 'payload.bin')
+        make_payload(payload, 5 * (1 << 14) + 100)
+        torrent = TorrentFile(make_torrent(payload, os.path.join(directory, 'payload.torrent'), 1 << 14))
+        storage = Storage.from_torrent(torrent, payload)
+
+        resume = ResumeData(torrent, storage, os.path.join(directory, 'payload.resume'))
+        resume.pieces.set_piece(0)
+        resume.pieces.set_piece(5)
+        resume.partial = {2: BitField(b'\x80')}
+        resume.save(resume.snapshot())
+
+        loaded = ResumeData(torrent, storage, resume.path)
+        assert loaded.load()
+        assert list(loaded.pieces.iter_pieces()) == [0, 5]
+        assert {piece: blocks.to_bytes() for piece, blocks in loaded.partial.items()} == {2: b'\x80'}
+
+        # written to a moment after the save, same size
+        stat = os.stat(payload)
+        os.utime(payload, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        assert not ResumeData(torrent, storage, resume.path).load()
+
+        # the payload changed since, the resume data no longer says anything about it
+        with open(payload, 'r+b') as file:
+            file.truncate(1 << 14)
+        assert not ResumeData(torrent, Storage.from_torrent(torrent, payload), resume.path).load()
+        storage.close()
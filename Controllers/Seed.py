@@ -0,0 +1,106 @@
+from Models import BitField
+from Controllers.Storage import Storage
+from Controllers.FileReader import FileReader
+from Controllers.ResumeData import ResumeData
+from Controllers.Recheck import Recheck
+from Controllers.SeedConnection import SeedConnection
+from Controllers.Announcer import Announcer
+
+
+class Seed:
+    """
+    one torrent being seeded: the payload's storage and reader, the
+    bitfield we announce to peers and the announces. connections
+    reach it through the listener of the Session it belongs to
+    """
+
+    def __init__(self, torrent, payload_path, port, choker=None, limiter=None,
+                 cache_size=FileReader.CACHE_SIZE, cache=None, pool=None, complete=False, progress=None,
+                 pieces=None):
+        """
+        :param cache: LRUCache shared with the other seeds of a session
+        :param complete: the payload was just downloaded and verified, skip the recheck
+        :param progress: passed on to Recheck.run
+        :param pieces: BitField from an earlier check(), which is done here otherwise
+        """
+
+        info = torrent.get_info()
+        self.torrent = torrent
+        self.choker = choker
+        self.limiter = limiter
+        self.storage = Storage.from_torrent(torrent, payload_path)
+        self.file_reader = FileReader(self.storage, info.piece_length(), cache_size, cache)
+
+        if complete:
+            self.bitfield = BitField.full(info.piece_count()).to_bytes()
+        else:
+            self.bitfield = (pieces or self.check(torrent, payload_path, progress)).to_bytes()
+
+        self.connections = set()
+        self.announcer = Announcer(torrent, port, self.stats, pool=pool)
+
+    @staticmethod
+    def check(torrent, payload_path, progress=None, resume_path=None, recheck=False):
+        """
+        find the pieces of the payload we have, from the resume data next
+        to it if that still matches, by hashing it otherwise. what the
+        hashing found is saved as resume data, so only the first start
+        pays for it. blocks for as long as that takes
+        :param resume_path: payload_path + '.resume' by default
+        :param recheck: hash the payload even if the resume data matches
+        :returns: BitField of the pieces
+        """
+
+        storage = Storage.from_torrent(torrent, payload_path)
+        try:
+            resume = ResumeData(torrent, storage, resume_path or payload_path + '.resume')
+            if not recheck and resume.load():
+                return resume.pieces
+
+            resume.pieces = Recheck(storage, torrent).run(progress)
+            resume.save(resume.snapshot())
+            return resume.pieces
+        finally:
+            storage.close()
+
+    def stats(self):
+        """ :returns: (uploaded, downloaded, left) for the trackers """
+        return self.file_reader.uploaded, 0, 0
+
+    def start(self):
+        self.announcer.start()
+
+    def collect(self):
+        """ :returns: metric samples labelled with the torrent's name, see Metrics """
+        labels = (('torrent', self.torrent.get_info().file_name()),)
+        samples = [('bt_left_bytes', labels, 0), ('bt_peers', labels, len(self.connections))]
+        samples += self.file_reader.collect(labels)
+        for conn in self.connections:
+            samples += conn.collect(labels)
+        return samples
+
+    async def accept(self, protocol, handshake):
+        """ serve a peer whose handshake asked for this torrent """
+
+        conn = SeedConnection(self.torrent, self.bitfield, self.file_reader, self.choker, self.limiter)
+        self.connections.add(conn)
+        try:
+            await conn.start(protocol, handshake)
+        except Exception:
+            await conn.gracefully_shutdown()
+        finally:
+            self.connections.discard(conn)
+
+    async def stop(self):
+        """ drop the peers, say goodbye to the trackers and close the files """
+
+        for conn in list(self.connections):
+            await conn.gracefully_shutdown()
+        await self.announcer.stop()
+        self.file_reader.close()
+
+    def __str__(self):
+        return f"<Seed(torrent={self.torrent}, connections={len(self.connections)})>"
+
+    def __repr__(self):
+        return self.__str__()
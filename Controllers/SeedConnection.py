@@ -1,14 +1,19 @@
 import asyncio
 from Utils import *
-from Controllers.FileReader import FileReader
+from Controllers.UploadQueue import UploadQueue
 
 
 class SeedConnection:
 
-    def __init__(self, torrent, bitfield):
+    def __init__(self, torrent, bitfield, file_reader, choker=None, limiter=None):
         self.torrent = torrent
-        self.reader = None
-        self.writer = None
+        self.file_reader = file_reader
+        self.choker = choker
+        self.limiter = limiter
+        self.protocol = None
+        self.host = None
+        self.port = None
+        self.uploads = None
         self.peer_id = None
         self.bitfield = bitfield
 
@@ -16,40 +21,38 @@ class SeedConnection:
         self.am_interested = False
         self.peer_choking = True
         self.peer_interested = False
+        self.downloaded = 0
 
-    async def start(self, reader, writer):
+    async def start(self, protocol, handshake=None):
+        """
+        serve a peer that connected to us
+        :param handshake: (info hash, peer id) if the listener read the handshake already
+        """
 
-        self.reader = reader
-        self.writer = writer
-        if not await self.receive_handshake():
+        self.protocol = protocol
+        self.host, self.port = protocol.get_extra_info('peername')[:2]
+        if not await self.receive_handshake(handshake):
             return await self.gracefully_shutdown()
 
+        self.uploads = UploadQueue(self.protocol, self.file_reader, self.limiter)
+        self.uploads.start()
+
         await self.send_bitfield()
-        await self.send_unchoke()
+        if self.choker is None:
+            await self.send_unchoke()
+        else:
+            self.choker.add_peer(self)
 
-        while True:
+        while not self.protocol.eof:
             await self._receive_socket()
 
     async def _receive_socket(self):
 
-        try:
-            length_data = await asyncio.wait_for(
-                self.reader.read(4), timeout=0.5
-            )
-            if length_data == b'':
-                return await self.gracefully_shutdown()
-            length = unpack_length(length_data)
-            if length == 0:
-                return
-
-            buff = b''
-            while len(buff) < length:
-                buff += await self.reader.read(length - len(buff))
-
-            await self._process(length, buff[0:1], buff[1:])
+        message = await self.protocol.read_message()
+        if message is None:
+            return await self.gracefully_shutdown()
 
-        except asyncio.TimeoutError:
-            pass
+        await self._process(*message)
 
     async def send_bitfield(self):
         id = pack_id(5)
@@ -60,15 +63,41 @@ class SeedConnection:
         await self._send(pack_protocol_int(1) + pack_id(1))
         self.am_choking = False
 
-    async def receive_handshake(self):
+    def choke(self):
+        """ stop serving the peer, whatever it asked for so far is dropped """
+        self.protocol.write(pack_protocol_int(1) + pack_id(0))
+        self.am_choking = True
+        self.uploads.clear()
+
+    def unchoke(self):
+        self.protocol.write(pack_protocol_int(1) + pack_id(1))
+        self.am_choking = False
+
+    @staticmethod
+    async def read_handshake(protocol):
+        """ :returns: (info hash, peer id) of the peer's handshake, or None """
+
+        data = await protocol.read_exactly(1)
+        if data is None:
+            return None
+
+        length = data[0]
+        data = await protocol.read_exactly(length + 8 + 20 + 20)
+        if data is None:
+            return None
 
-        length = ord(await self.reader.read(1))
-        data = await self.reader.read(length + 8 + 20 + 20)
-        pstr = data[0:length]
-        reserved = data[length:length+8]
-        info_hash = data[length+8:length+8+20]
-        peer_id = data[length+8+20:length+8+40]
+        info_hash = bytes(data[length+8:length+8+20])
+        peer_id = bytes(data[length+8+20:length+8+40])
+        return info_hash, peer_id
 
+    async def receive_handshake(self, handshake=None):
+
+        if handshake is None:
+            handshake = await self.read_handshake(self.protocol)
+            if handshake is None:
+                return False
+
+        info_hash, peer_id = handshake
         if info_hash != self.torrent.get_info_hash():
             print('invalid info hash')
             return False
@@ -88,8 +117,8 @@ class SeedConnection:
 
     async def _send(self, data):
         """ send message to peer """
-        self.writer.write(data)
-        await self.writer.drain()
+        self.protocol.write(data)
+        await self.protocol.drain()
 
     async def _process(self, length, id, data):
 
@@ -106,7 +135,6 @@ class SeedConnection:
             9: self._handle_port
         }
 
-        id = ord(id)
         if id not in handlers:
             return
 
@@ -120,6 +148,8 @@ class SeedConnection:
 
     async def _handle_interested(self, length, data):
         self.peer_interested = True
+        if self.choker is not None:
+            self.choker.interested(self)
 
     async def _handle_not_interested(self, length, data):
         self.peer_interested = False
@@ -133,34 +163,47 @@ class SeedConnection:
 
     async def _handle_request(self, length, data):
 
-        index_data = data[0:4]
-        begin_data = data[4:8]
-        length_data = data[8:12]
+        index = unpack_protocol_int(data[0:4])
+        begin = unpack_protocol_int(data[4:8])
+        length = unpack_protocol_int(data[8:12])
 
-        index = unpack_protocol_int(index_data)
-        begin = unpack_protocol_int(begin_data)
-        length = unpack_protocol_int(length_data)
+        if self.am_choking:
+            return
 
-        block = await FileReader.read(index, begin, length)
-        if block is None:
-            return print('block is none')
-        data = pack_id(7) + index_data + begin_data + block
-        await self._send(pack_length(len(data)) + data)
+        self.uploads.add(index, begin, length)
 
     async def _handle_piece(self, length, data):
         """ process download response """
         pass
 
     async def _handle_cancel(self, length, data):
-        pass
+        """ peer no longer needs a block it requested """
+
+        index = unpack_protocol_int(data[0:4])
+        begin = unpack_protocol_int(data[4:8])
+        length = unpack_protocol_int(data[8:12])
+
+        self.uploads.cancel(index, begin, length)
 
     async def _handle_port(self, length, data):
         pass
 
+    def collect(self, labels=()):
+        """ :returns: metric samples of the connection, see Metrics """
+        labels += (('peer', f'{self.host}:{self.port}'),)
+        return [('bt_peer_uploaded_bytes', labels, self.uploads.uploaded if self.uploads else 0)]
+
     async def gracefully_shutdown(self):
         print('Closing Connection')
-        if self.writer is not None:
+        if self.choker is not None:
+            self.choker.remove_peer(self)
+
+        if self.uploads is not None:
+            self.uploads.stop()
+
+        if self.protocol is not None:
             try:
-                await self.writer.wait_closed()
+                self.protocol.close()
+                await self.protocol.wait_closed()
             except:
                 pass
@@ -0,0 +1,195 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from Models import TorrentFile, LRUCache, metrics
+from Controllers.PeerProtocol import PeerProtocol
+from Controllers.SeedConnection import SeedConnection
+from Controllers.HashVerifier import HashVerifier
+from Controllers.HttpPool import HttpPool
+from Controllers.FileReader import FileReader
+from Controllers.Choker import Choker
+from Controllers.ConnectionManager import ConnectionManager
+from Controllers.Download import Download
+from Controllers.Seed import Seed
+
+
+# rechecks of torrents being added, one at a time, they're disk bound
+_executor = ThreadPoolExecutor(1)
+
+
+class Session:
+    """
+    many torrents in one event loop behind one listening socket.
+
+    incoming connections are routed by the info hash of their
+    handshake to the seed serving it, unknown ones are dropped.
+    the torrents share the read cache, the upload slots, the rate
+    limits, the hash verifier and the tracker connections, and the
+    module level executors and open file budget come with the process.
+    a download turns into a seed once it's complete, one that fails
+    is dropped. torrents are checked against the disk off the event
+    loop before they're added
+    """
+
+    HANDSHAKE_TIMEOUT = 10
+
+    def __init__(self, host, port, cache_size=FileReader.CACHE_SIZE, upload_slots=Choker.SLOTS,
+                 limiter=None, max_peers=ConnectionManager.MAX_PEERS):
+        self.host = host
+        self.port = port
+        self.limiter = limiter
+        self.upload_slots = upload_slots
+        self.max_peers = max_peers
+
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.choker = Choker(upload_slots, seeding=True)
+        self.verifier = HashVerifier(asyncio.get_event_loop())
+        self.pool = HttpPool()
+        self.server = None
+
+        # info hash -> Seed or Download
+        self.torrents = {}
+        self.tasks = {}
+        self.rejected = 0
+
+    async def start(self):
+        self.choker.start()
+        self.verifier.start()
+        self.server = await PeerProtocol.start_server(self._incoming, self.host, self.port)
+        metrics.add_collector(self.collect)
+
+    async def serve_forever(self):
+        await self.server.serve_forever()
+
+    async def add_seed(self, torrent_path, payload_path, progress=None, recheck=False):
+        """
+        :param recheck: hash the payload even if its resume data matches, see Seed.check
+        :returns: the Seed serving the payload
+        """
+
+        torrent = TorrentFile(torrent_path)
+        info_hash = torrent.get_info_hash()
+        if info_hash in self.torrents:
+            return self.torrents[info_hash]
+
+        pieces = await asyncio.get_event_loop().run_in_executor(
+            _executor, Seed.check, torrent, payload_path, progress, None, recheck
+        )
+        if info_hash in self.torrents:
+            # added again while it was being checked
+            return self.torrents[info_hash]
+
+        seed = Seed(
+            torrent, payload_path, self.port, self.choker, self.limiter,
+            cache=self.cache, pool=self.pool, pieces=pieces
+        )
+        self.torrents[info_hash] = seed
+        seed.start()
+        return seed
+
+    async def add_download(self, torrent_path, directory='.'):
+        """ :returns: the Download, it's seeded from directory once it completes """
+
+        torrent = TorrentFile(torrent_path)
+        info_hash = torrent.get_info_hash()
+        if info_hash in self.torrents:
+            return self.torrents[info_hash]
+
+        name = torrent.get_info().file_name()
+        base = os.path.join(directory, name)
+        resume = await asyncio.get_event_loop().run_in_executor(
+            _executor, Download.check, torrent, base, base + '.resume'
+        )
+        if info_hash in self.torrents:
+            return self.torrents[info_hash]
+
+        download = Download(
+            torrent, base, self.port, self.upload_slots, self.limiter,
+            self.max_peers, self.verifier, self.pool, resume=resume
+        )
+        self.torrents[info_hash] = download
+        self.tasks[info_hash] = asyncio.ensure_future(self._download(download))
+        return download
+
+    async def _download(self, download):
+        info_hash = download.torrent.get_info_hash()
+        try:
+            await download.run()
+        except Exception as e:
+            print('download failed', download, e)
+            # popped first, remove() would cancel this very task otherwise
+            self.tasks.pop(info_hash, None)
+            await self.remove(info_hash)
+            return
+
+        del self.tasks[info_hash]
+        seed = Seed(
+            download.torrent, download.base, self.port, self.choker, self.limiter,
+            cache=self.cache, pool=self.pool, complete=True
+        )
+        self.torrents[info_hash] = seed
+        seed.start()
+
+    async def remove(self, info_hash):
+        torrent = self.torrents.pop(info_hash, None)
+        task = self.tasks.pop(info_hash, None)
+        if task is not None:
+            task.cancel()
+        if torrent is not None:
+            await torrent.stop()
+
+    async def _incoming(self, protocol):
+        """ read the handshake and hand the connection to the torrent it's for """
+
+        try:
+            handshake = await asyncio.wait_for(SeedConnection.read_handshake(protocol), self.HANDSHAKE_TIMEOUT)
+        except asyncio.TimeoutError:
+            handshake = None
+
+        seed = self.torrents.get(handshake[0]) if handshake is not None else None
+        if not isinstance(seed, Seed):
+            # unknown torrent, or one we don't have pieces of yet
+            self.rejected += 1
+            protocol.close()
+            return
+
+        await seed.accept(protocol, handshake)
+
+    async def close(self):
+        metrics.remove_collector(self.collect)
+        if self.server is not None:
+            self.server.close()
+        for info_hash in list(self.torrents):
+            await self.remove(info_hash)
+        self.choker.stop()
+        self.verifier.stop()
+        self.pool.close()
+
+    def stats(self):
+        """ :returns: dict of session wide counters """
+        seeds = [torrent for torrent in self.torrents.values() if isinstance(torrent, Seed)]
+        stats = {
+            'torrents': len(self.torrents),
+            'seeding': len(seeds),
+            'downloading': len(self.torrents) - len(seeds),
+            'connections': sum(len(seed.connections) for seed in seeds),
+            'rejected': self.rejected,
+        }
+        if self.cache is not None:
+            stats.update(self.cache.stats())
+        return stats
+
+    def collect(self):
+        """ :returns: metric samples of the shared parts and every torrent, see Metrics """
+        samples = self.verifier.collect()
+        if self.cache is not None:
+            samples += self.cache.collect()
+        for torrent in self.torrents.values():
+            samples += torrent.collect()
+        return samples
+
+    def __str__(self):
+        return f"<Session(port={self.port}, torrents={len(self.torrents)})>"
+
+    def __repr__(self):
+        return self.__str__()
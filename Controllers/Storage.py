@@ -0,0 +1,167 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from Models.FileIndex import FileIndex
+
+_lock = threading.Lock()
+# (storage, file index) -> open file, shared by every storage in the process
+_handles = OrderedDict()
+
+
+class Storage:
+    """
+    positional reads and writes over the payload, split across the
+    torrent's files through a FileIndex. open files are cached, the
+    least recently used ones get closed past MAX_OPEN unless a read
+    or write is still using them. the budget is shared by every
+    Storage in the process, so a session with many torrents stays
+    under the descriptor limit. reads and writes run on executor
+    threads so the cache is guarded by a lock
+    """
+
+    MAX_OPEN = 128
+
+    def __init__(self, index, writable=False):
+        self.index = index
+        self.writable = writable
+        self.length = index.length
+        self.users = {}
+        self.open = 0
+        self.closed = False
+
+    @classmethod
+    def from_torrent(cls, torrent, base, writable=False):
+        return cls(FileIndex.from_torrent(torrent.get_info(), base), writable)
+
+    def spans(self, position, length):
+        return self.index.spans(position, length)
+
+    def _open(self, index):
+        with _lock:
+            if self.closed:
+                raise ValueError('storage is closed')
+
+            file = _handles.get((self, index))
+            if file is None:
+                mode = 'r+b' if self.writable else 'rb'
+                file = _handles[(self, index)] = open(self.index.paths[index], mode, buffering=0)
+                self.open += 1
+                self._evict()
+            else:
+                _handles.move_to_end((self, index))
+
+            self.users[index] = self.users.get(index, 0) + 1
+            return file
+
+    def _release(self, index):
+        with _lock:
+            self.users[index] -= 1
+            if not self.users[index]:
+                del self.users[index]
+            self._evict()
+
+    def _evict(self):
+        for storage, index in list(_handles):
+            if len(_handles) <= self.MAX_OPEN:
+                return
+            if index not in storage.users:
+                _handles.pop((storage, index)).close()
+                storage.open -= 1
+
+    @contextmanager
+    def file(self, index):
+        """ the cached file object of one of the torrent's files """
+        file = self._open(index)
+        try:
+            yield file
+        finally:
+            self._release(index)
+
+    def read(self, position, length):
+        """ :returns: bytes at position, or None if any file is missing or short """
+
+        chunks = []
+        try:
+            for index, offset, span in self.spans(position, length):
+                with self.file(index) as file:
+                    data = os.pread(file.fileno(), span, offset)
+                if len(data) != span:
+                    return None
+                chunks.append(data)
+        except (OSError, ValueError) as e:
+            print('error', e)
+            return None
+
+        if len(chunks) == 1:
+            return chunks[0]
+        return b''.join(chunks)
+
+    def write(self, position, data):
+        """ write data at position, across files where it spans them """
+
+        view = memoryview(data)
+        start = 0
+        for index, offset, span in self.spans(position, len(view)):
+            with self.file(index) as file:
+                written = 0
+                while written < span:
+                    written += os.pwrite(file.fileno(), view[start + written:start + span], offset + written)
+            start += span
+
+    def preallocate(self, sparse=True):
+        """ create every file at its full size, reserving the blocks unless sparse """
+
+        for path, length in zip(self.index.paths, self.index.lengths):
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size != length:
+                    # even a no-op truncate would touch the mtime resume data relies on
+                    os.ftruncate(fd, length)
+                if not sparse and length and hasattr(os, 'posix_fallocate'):
+                    try:
+                        os.posix_fallocate(fd, 0, length)
+                    except OSError as e:
+                        print('fallocate failed, file stays sparse', e)
+            finally:
+                os.close(fd)
+
+    def exists(self):
+        """ check whether any of the files is there """
+        return any(os.path.exists(path) for path in self.index.paths)
+
+    def stat(self):
+        """ :returns: list of [size, mtime in ns] per file, [-1, 0] for missing ones """
+        stats = []
+        for path in self.index.paths:
+            try:
+                stat = os.stat(path)
+                stats.append([stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                stats.append([-1, 0])
+        return stats
+
+    def sync(self):
+        """ fsync every file, including the ones whose handle was evicted """
+        for index in range(len(self.index)):
+            if self.index.lengths[index]:
+                with self.file(index) as file:
+                    os.fsync(file.fileno())
+
+    def close(self):
+        with _lock:
+            self.closed = True
+            for storage, index in list(_handles):
+                if storage is self:
+                    _handles.pop((storage, index)).close()
+            self.open = 0
+
+    def __str__(self):
+        return f"<Storage(files={len(self.index)}, open={self.open})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -1,5 +1,6 @@
-import requests
+from urllib.parse import urlencode
 from Models.Peers import Peers
+from Controllers.HttpPool import HttpPool
 
 
 """
@@ -10,27 +11,53 @@ https://wiki.theory.org/index.php/BitTorrentSpecification#Tracker_HTTP.2FHTTPS_P
 
 class Tracker:
 
-    def __init__(self, torrent):
+    def __init__(self, url, torrent, pool=None):
         """
         initialize a new Tracker
+        :param url: http(s) announce url
         :param torrent: torrent file instance
+        :param pool: HttpPool shared with other trackers, connections get reused
         """
+        self.url = url
         self.torrent = torrent
+        self.owns_pool = pool is None
+        self.pool = pool or HttpPool()
 
-    def get_peers(self, port=433, downloaded=0, event='started'):
+    async def announce(self, port=6881, uploaded=0, downloaded=0, left=0, event='started'):
+        """
+        :returns: Peers of the tracker's response
+        :raises ConnectionError: if the tracker can't be reached or refuses the announce
+        """
 
         params = {
             'info_hash': self.torrent.get_info_hash(),
             'peer_id': self.torrent.peer_id(),
             'port': port,
             'compact': 1,
-            'event': event,
-            'uploaded': 0,
+            'uploaded': uploaded,
             'downloaded': downloaded,
-            'left': self.torrent.get_info().file_length() - downloaded
+            'left': left
         }
+        if event:
+            params['event'] = event
+
+        separator = '&' if '?' in self.url else '?'
+        status, body = await self.pool.get(self.url + separator + urlencode(params))
+        if status != 200:
+            raise ConnectionError(f'tracker answered {status}')
+
+        peers = Peers(body)
+        if peers.get_failure() is not None:
+            raise ConnectionError(f'tracker failure: {peers.get_failure()}')
+
+        return peers
+
+    def close(self):
+        if self.owns_pool:
+            self.pool.close()
+
+    def __str__(self):
+        return f"<Tracker(url={self.url})>"
 
-        url = self.torrent.get_announce()
-        res = requests.get(url, params=params)
-        res.raise_for_status()
-        return Peers(res.content)
+    def __repr__(self):
+        return self.__str__()
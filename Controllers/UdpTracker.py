@@ -0,0 +1,205 @@
+import asyncio
+import random
+import struct
+import time
+from urllib.parse import urlsplit
+from Models.Peers import Peers
+
+
+"""
+following bep 15
+http://bittorrent.org/beps/bep_0015.html
+"""
+
+PROTOCOL_ID = 0x41727101980
+CONNECT, ANNOUNCE, SCRAPE, ERROR = range(4)
+EVENTS = {'': 0, 'completed': 1, 'started': 2, 'stopped': 3}
+
+
+class _TrackerSocket(asyncio.DatagramProtocol):
+    """
+    one udp socket per tracker address, shared by every torrent
+    announcing there. it matches responses to their requests by
+    transaction id and holds the connection id the tracker handed out
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.opened = asyncio.Event()
+        self.waiting = {}
+        self.connection_id = None
+        self.connected_at = 0.0
+        self.connecting = None
+        self.users = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.opened.set()
+
+    def datagram_received(self, data, addr):
+        if len(data) < 8:
+            return
+
+        action, transaction = struct.unpack_from('!II', data)
+        future = self.waiting.get(transaction)
+        if future is None or future.done():
+            return
+
+        if action == ERROR:
+            # whatever the tracker didn't like, start over with a new connection id
+            self.connection_id = None
+            future.set_exception(ConnectionError(f"tracker failure: {data[8:].decode('utf-8', 'replace')}"))
+        else:
+            future.set_result((action, data[8:]))
+
+    def error_received(self, exc):
+        # icmp unreachable and the like, nobody is listening there
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError(exc))
+
+    def connection_lost(self, exc):
+        self.error_received(exc or ConnectionError('socket closed'))
+
+    async def request(self, connection_id, action, payload, timeout):
+        """
+        send a single request and wait for its answer
+        :returns: (action, response body after the transaction id)
+        :raises asyncio.TimeoutError: if no answer came in time
+        """
+
+        transaction = random.getrandbits(32)
+        while transaction in self.waiting:
+            transaction = random.getrandbits(32)
+
+        future = asyncio.get_event_loop().create_future()
+        self.waiting[transaction] = future
+        try:
+            self.transport.sendto(struct.pack('!QII', connection_id, action, transaction) + payload)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            del self.waiting[transaction]
+
+
+_sockets = {}
+
+
+class UdpTracker:
+    """
+    announces over the udp tracker protocol, a connect round trip
+    whose connection id is reused for CONNECTION_TTL seconds and then
+    one datagram each way per announce. requests that go unanswered
+    are sent again after TIMEOUT * 2 ** n seconds, up to RETRIES times
+    """
+
+    TIMEOUT = 15
+    # bep 15 allows up to 8, by then every other tracker in the tier has long been tried
+    RETRIES = 2
+    CONNECTION_TTL = 60
+
+    def __init__(self, url, torrent, pool=None):
+        """
+        initialize a new UdpTracker
+        :param url: udp:// announce url
+        :param torrent: torrent file instance
+        :param pool: unused, the socket is shared per tracker address instead
+        """
+        parts = urlsplit(url)
+        self.url = url
+        self.address = (parts.hostname, parts.port or 80)
+        self.torrent = torrent
+        self.socket = None
+        self.key = random.getrandbits(32)
+
+    async def _socket(self):
+        if self.socket is not None:
+            return self.socket
+
+        loop = asyncio.get_event_loop()
+        key = (loop, self.address)
+        socket = _sockets.get(key)
+        if socket is None or (socket.transport is not None and socket.transport.is_closing()):
+            socket = _sockets[key] = _TrackerSocket()
+            try:
+                await loop.create_datagram_endpoint(lambda: socket, remote_addr=self.address)
+            finally:
+                # let the others waiting on it see how it went
+                socket.opened.set()
+        else:
+            await socket.opened.wait()
+
+        if socket.transport is None:
+            if _sockets.get(key) is socket:
+                del _sockets[key]
+            raise ConnectionError(f'could not open a socket to {self.address}')
+
+        socket.users += 1
+        self.socket = socket
+        return socket
+
+    @staticmethod
+    async def _connect(socket, timeout):
+        action, body = await socket.request(PROTOCOL_ID, CONNECT, b'', timeout)
+        if action != CONNECT or len(body) < 8:
+            raise ConnectionError('invalid connect response')
+        socket.connection_id = struct.unpack_from('!Q', body)[0]
+        socket.connected_at = time.monotonic()
+
+    async def _connection_id(self, socket, timeout):
+        if socket.connection_id is None or time.monotonic() - socket.connected_at > self.CONNECTION_TTL:
+            # torrents announcing at the same time wait for the same connect
+            if socket.connecting is None or socket.connecting.done():
+                socket.connecting = asyncio.ensure_future(self._connect(socket, timeout))
+            await asyncio.shield(socket.connecting)
+        return socket.connection_id
+
+    async def announce(self, port=6881, uploaded=0, downloaded=0, left=0, event='started'):
+        """
+        :returns: Peers of the tracker's response
+        :raises ConnectionError: if the tracker can't be reached or refuses the announce
+        """
+
+        try:
+            socket = await self._socket()
+        except OSError as e:
+            raise ConnectionError(e)
+
+        peer_id = self.torrent.peer_id()
+        payload = struct.pack(
+            '!20s20sQQQIIIiH',
+            self.torrent.get_info_hash(),
+            peer_id.encode() if isinstance(peer_id, str) else peer_id,
+            downloaded, left, uploaded, EVENTS.get(event, 0),
+            0, self.key, -1, port
+        )
+
+        for attempt in range(self.RETRIES + 1):
+            timeout = self.TIMEOUT * 2 ** attempt
+            try:
+                connection_id = await self._connection_id(socket, timeout)
+                action, body = await socket.request(connection_id, ANNOUNCE, payload, timeout)
+            except asyncio.TimeoutError:
+                continue
+
+            if action != ANNOUNCE or len(body) < 12:
+                raise ConnectionError('invalid announce response')
+
+            interval = struct.unpack_from('!I', body)[0]
+            return Peers.from_compact(body[12:], interval)
+
+        raise ConnectionError(f'no answer after {self.RETRIES + 1} tries')
+
+    def close(self):
+        if self.socket is None:
+            return
+
+        self.socket.users -= 1
+        if self.socket.users == 0 and self.socket.transport is not None:
+            self.socket.transport.close()
+        self.socket = None
+
+    def __str__(self):
+        return f"<UdpTracker(url={self.url})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,89 @@
+import asyncio
+from collections import OrderedDict
+from Utils import pack_length, pack_id, pack_protocol_int
+
+
+class UploadQueue:
+    """
+    block requests a peer made of us, served in order by a
+    background task so that cancel messages can still drop
+    the ones that haven't been sent yet. a request that fails
+    is dropped, a connection that fails is closed
+    """
+
+    MAX_QUEUED = 512
+
+    def __init__(self, protocol, file_reader, limiter=None):
+        """
+        :param protocol: PeerProtocol of the connection
+        :param file_reader: anything with FileReader.send's signature
+        :param limiter: RateLimiter shared by every connection, or None
+        """
+        self.protocol = protocol
+        self.file_reader = file_reader
+        self.limiter = limiter
+        self.requests = OrderedDict()
+        self.wake = asyncio.Event()
+        self.task = None
+        self.uploaded = 0
+
+    def start(self):
+        self.task = asyncio.ensure_future(self._serve())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.requests.clear()
+        if self.limiter is not None:
+            self.limiter.upload.remove_peer(self)
+
+    def add(self, index, begin, length):
+        if len(self.requests) >= self.MAX_QUEUED:
+            return print('too many queued requests')
+
+        self.requests[(index, begin, length)] = True
+        self.wake.set()
+
+    def cancel(self, index, begin, length):
+        """ drop a request that hasn't been served yet """
+        self.requests.pop((index, begin, length), None)
+
+    def clear(self):
+        self.requests.clear()
+
+    async def _serve(self):
+        while True:
+            if not self.requests:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+
+            (index, begin, length), _ = self.requests.popitem(last=False)
+            header = (pack_length(9 + length) + pack_id(7)
+                      + pack_protocol_int(index) + pack_protocol_int(begin))
+            try:
+                if self.limiter is not None:
+                    await self.limiter.upload.acquire(self, length)
+
+                if not await self.file_reader.send(self.protocol, index, begin, length, header):
+                    print('not serving a block we lack', index, begin, length)
+                    continue
+
+                self.uploaded += length
+                await self.protocol.drain()
+            except ConnectionError:
+                self.protocol.close()
+                return
+            except Exception as e:
+                # only this request is lost, the next ones may well work
+                print('failed to serve block', index, begin, length, e)
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __str__(self):
+        return f"<UploadQueue(queued={len(self.requests)})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -1,6 +1,21 @@
+from .HttpPool import HttpPool
 from .Tracker import Tracker
+from .UdpTracker import UdpTracker
+from .Announcer import Announcer
+from .PeerProtocol import PeerProtocol
 from .ClientConnection import ClientConnection
+from .ConnectionManager import ConnectionManager
 from .SeedConnection import SeedConnection
 from .FileWriter import FileWriter
-from .FileReader import FileReader, FileDivider
+from .HashVerifier import HashVerifier
+from .Storage import Storage
+from .FileReader import FileReader
+from .Choker import Choker
+from .RateLimiter import RateLimiter
+from .ResumeData import ResumeData
+from .Recheck import Recheck
+from .Download import Download
+from .Seed import Seed
+from .Session import Session
+from .MetricsServer import MetricsServer
 from .cli import Cli
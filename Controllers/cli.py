@@ -5,15 +5,27 @@ from Models import *
 
 class Cli:
 
-    def __init__(self, request_queue):
+    DOWNLOAD_COMMANDS = ('free', 'pieces', 'peers', 'hashing')
+
+    def __init__(self, torrent, request_queue=None, file_reader=None, choker=None, limiter=None, connections=None):
+        self.torrent = torrent
         self.request_queue = request_queue
+        self.file_reader = file_reader
+        self.choker = choker
+        self.limiter = limiter
+        self.connections = connections
 
     async def start(self):
         while True:
-            inp = (await asyncio.get_event_loop()
-                   .run_in_executor(None, sys.stdin.readline)).strip()
+            line = await asyncio.get_event_loop().run_in_executor(None, sys.stdin.readline)
+            if line == '':
+                # stdin closed
+                return
+            inp = line.strip()
 
-            if inp == "free":
+            if self.request_queue is None and inp in self.DOWNLOAD_COMMANDS:
+                print('Command', inp, 'is only available while downloading')
+            elif inp == "free":
                 await self.free_pieces()
             elif inp == "pieces":
                 await self.print_pieces()
@@ -23,37 +35,47 @@ class Cli:
                 await self.print_trackers()
             elif inp == 'peers':
                 await self.print_peers()
+            elif inp == 'hashing':
+                await self.print_hashing()
+            elif inp == 'cache':
+                await self.print_cache()
+            elif inp == 'choker':
+                await self.print_choker()
+            elif inp == 'stats':
+                await self.print_stats()
+            elif inp.split(' ')[0] == 'limit':
+                await self.set_limit(inp.split())
             else:
                 print('Got invalid command:', inp)
-                print('Please enter one of the following: metadata, trackers, peers, pieces, free')
+                print('Please enter one of the following: metadata, trackers, peers, pieces, hashing, cache, choker, stats, limit, free')
 
     async def free_pieces(self):
         self.request_queue.cancel_all()
 
     async def print_pieces(self):
-        piece_hashes = self.request_queue.torrent.get_info().pieces()
+        info = self.torrent.get_info()
         for key, value in self.request_queue.pieces.items():
             if value != RequestState.available:
                 print('Piece', key, '(Current State:', value.value.capitalize() + ')')
-                print('\tHash:', piece_hashes[key])
+                print('\tHash:', info.piece_hash(key))
 
     async def print_metadata(self):
         print('Torrent Metadata:')
 
         torrent_file = {
-            'announce': self.request_queue.torrent.get_announce(),
-            'announce_list': self.request_queue.torrent.get_announce_list(),
-            'creation date': self.request_queue.torrent.get_creation_date(),
-            'comment': self.request_queue.torrent.get_comment(),
-            'created by': self.request_queue.torrent.get_created_by(),
-            'encoding': self.request_queue.torrent.get_encoding()
+            'announce': self.torrent.get_announce(),
+            'announce_list': self.torrent.get_announce_list(),
+            'creation date': self.torrent.get_creation_date(),
+            'comment': self.torrent.get_comment(),
+            'created by': self.torrent.get_created_by(),
+            'encoding': self.torrent.get_encoding()
             }
 
         for key, value in torrent_file.items():
             if (value is not None):
                 print('\t' + key + ' = ' + str(value))
 
-        torrent_info = self.request_queue.torrent.get_info()
+        torrent_info = self.torrent.get_info()
         torrent_info_dict = {
             'piece length': torrent_info.piece_length(),
             'pieces': str(torrent_info.piece_count()) + ' total\n\t\t(Use command \'pieces\' to view individual piece hashes.)',
@@ -69,8 +91,8 @@ class Cli:
                 print('\t\t' + key + ' = ' + str(value))
 
     async def print_trackers(self):
-        announce = self.request_queue.torrent.get_announce()
-        announce_list = self.request_queue.torrent.get_announce_list()
+        announce = self.torrent.get_announce()
+        announce_list = self.torrent.get_announce_list()
         print('Trackers:')
         if (announce_list is not None):
             for i in range(0, len(announce_list)):
@@ -85,3 +107,86 @@ class Cli:
             print('Current Peers:')
             for peer in self.request_queue.peers:
                 print('\t', peer.host + ':' + str(peer.port))
+
+        if self.connections is not None:
+            print('Connections:')
+            for key, value in self.connections.stats().items():
+                print('\t' + key + ' = ' + str(value))
+
+    async def print_hashing(self):
+        print('Hash Verification:')
+        for key, value in self.request_queue.verifier.stats().items():
+            if isinstance(value, float):
+                value = f'{value:.2f}'
+            print('\t' + key + ' = ' + str(value))
+
+    async def print_cache(self):
+        if self.file_reader is None or self.file_reader.cache is None:
+            return print('Read cache is disabled.')
+
+        print('Read Cache:')
+        for key, value in self.file_reader.stats().items():
+            if isinstance(value, float):
+                value = f'{value:.2f}'
+            print('\t' + key + ' = ' + str(value))
+
+    async def print_choker(self):
+        if self.choker is None:
+            return print('Choker is disabled, every peer is unchoked.')
+
+        print('Choker:', self.choker.slots, 'upload slots, round', self.choker.round)
+        for peer, rate, choked, interested, optimistic in self.choker.stats():
+            state = 'choked' if choked else 'unchoked'
+            if optimistic:
+                state += ', optimistic'
+            if interested:
+                state += ', interested'
+            print('\t', f'{peer.host}:{peer.port}', f'{rate / 1024:.1f} KiB/s', '(' + state + ')')
+
+    async def print_stats(self):
+        """ every metric the endpoint would serve, latencies summarized """
+        print('Latencies:')
+        for name, histogram in sorted(metrics.histograms.items()):
+            if not histogram.count:
+                print('\t' + name, '= nothing observed')
+                continue
+            print('\t' + name, '=', histogram.count, 'observed,',
+                  f'mean {histogram.mean() * 1000:.2f} ms,',
+                  f'p50 <= {histogram.quantile(0.5) * 1000:g} ms,',
+                  f'p99 <= {histogram.quantile(0.99) * 1000:g} ms')
+
+        print('Metrics:')
+        for name, samples in sorted(metrics.collect().items()):
+            if name in metrics.histograms:
+                continue
+            for _, labels, value in samples:
+                if isinstance(value, float):
+                    value = f'{value:.4g}'
+                label = ','.join(str(label) for _, label in labels)
+                print('\t' + name + (f'[{label}]' if label else ''), '=', value)
+
+    async def set_limit(self, args):
+        """ limit [up|down] [peer] <KiB/s>, 0 lifts the limit, no arguments prints the limits """
+        if self.limiter is None:
+            return print('Rate limiting is disabled.')
+
+        directions = {'up': self.limiter.upload, 'down': self.limiter.download}
+        if len(args) == 1:
+            for name, bandwidth in directions.items():
+                stats = bandwidth.stats()
+                print('Limit', name + ':',
+                      f"{stats['rate'] / 1024:.0f} KiB/s total,",
+                      f"{stats['peer rate'] / 1024:.0f} KiB/s per peer",
+                      f"({stats['waiting']} waiting, {stats['transferred'] / (1024 * 1024):.1f} MiB transferred)")
+            return
+
+        bandwidth = directions.get(args[1])
+        per_peer = len(args) == 4 and args[2] == 'peer'
+        if bandwidth is None or len(args) != (4 if per_peer else 3) or not args[-1].isdigit():
+            return print('Usage: limit [up|down] [peer] <KiB/s>, 0 for unlimited')
+
+        rate = int(args[-1]) * 1024
+        if per_peer:
+            bandwidth.set_peer_rate(rate)
+        else:
+            bandwidth.set_rate(rate)
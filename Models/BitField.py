@@ -1,36 +1,102 @@
-from Utils import blist_to_bits
+from itertools import compress
+
+
+def _expand(byte):
+    return bytes((byte >> (7 - bit)) & 1 for bit in range(8))
+
+
+# every byte value spelled out as eight 0/1 bytes, most significant bit first
+_EXPAND = tuple(_expand(byte) for byte in range(256))
 
 
 class BitField:
+    """
+    piece bitfield kept in wire format, one bit per piece with
+    the high bit of the first byte being piece 0. set operations
+    go through python ints so they run in c over the whole field,
+    the int is kept until the field changes
+    """
 
     def __init__(self, data):
-        self.bits_str = blist_to_bits(data)
-        self.dict = self.blist_dictionary(data)
+        self.bits = bytearray(data)
+        self.value = None
+
+    @classmethod
+    def empty(cls, piece_count):
+        """ :returns: bitfield with no pieces set """
+        return cls(bytes((piece_count + 7) // 8))
+
+    @classmethod
+    def full(cls, piece_count):
+        """ :returns: bitfield with every piece set """
+        size = (piece_count + 7) // 8
+        return cls.from_int(((1 << piece_count) - 1) << (size * 8 - piece_count), size)
+
+    @classmethod
+    def from_int(cls, value, size):
+        return cls(value.to_bytes(size, 'big'))
+
+    def to_int(self):
+        if self.value is None:
+            self.value = int.from_bytes(self.bits, 'big')
+        return self.value
+
+    def _aligned_int(self, other):
+        """ other as an int lined up with this field, in case the sizes differ """
+        shift = 8 * (len(self.bits) - len(other.bits))
+        value = other.to_int()
+        return value << shift if shift >= 0 else value >> -shift
 
     def has_piece(self, index):
         """ check whether bit field has an index """
-        return self.dict.get(index, 0) == 1
+        byte = index >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (0x80 >> (index & 7)))
+
+    def set_piece(self, index):
+        """ mark a piece as present """
+        self.bits[index >> 3] |= 0x80 >> (index & 7)
+        self.value = None
+
+    def clear_piece(self, index):
+        """ mark a piece as missing """
+        self.bits[index >> 3] &= ~(0x80 >> (index & 7)) & 0xFF
+        self.value = None
 
     def length(self):
         """ get bitfield length """
-        return len(self.dict)
+        return len(self.bits) * 8
+
+    def count(self):
+        """ :returns: number of pieces set """
+        return bin(self.to_int()).count('1')
 
-    @staticmethod
-    def blist_dictionary(blist):
-        result = {}
-        for index, value in enumerate(blist_to_bits(blist)):
-            result[index] = int(value)
+    def intersection(self, other):
+        """ :returns: bitfield of pieces set in both """
+        return BitField.from_int(self.to_int() & self._aligned_int(other), len(self.bits))
 
-        return result
+    def difference(self, other):
+        """ :returns: bitfield of pieces set here but not in other """
+        return BitField.from_int(self.to_int() & ~self._aligned_int(other), len(self.bits))
+
+    def intersects(self, other):
+        """ check whether any piece is set in both """
+        return self.to_int() & self._aligned_int(other) != 0
+
+    def pieces(self):
+        """ :returns: list of set pieces in order """
+        expanded = b''.join(map(_EXPAND.__getitem__, self.bits))
+        return list(compress(range(len(expanded)), expanded))
+
+    def iter_pieces(self):
+        """ iterate over set pieces in order """
+        return iter(self.pieces())
 
     def get_available_pieces(self):
         """ get set of available pieces """
-        temp = set()
-        for index, value in self.dict.items():
-            if value == 1:
-                temp.add(index)
+        return set(self.pieces())
 
-        return temp
+    def to_bytes(self):
+        return bytes(self.bits)
 
     def __str__(self):
         return f"<BitField()>"
@@ -46,3 +112,15 @@ if __name__ == '__main__':
     assert bitfield.has_piece(0)
     assert bitfield.has_piece(7)
     assert not bitfield.has_piece(8)
+
+    bitfield = BitField(b'\xA0\x01')
+    assert list(bitfield.iter_pieces()) == [0, 2, 15]
+    assert bitfield.count() == 3
+    other = BitField(b'\x20\x01')
+    assert list(bitfield.difference(other).iter_pieces()) == [0]
+    assert list(bitfield.intersection(other).iter_pieces()) == [2, 15]
+    bitfield.clear_piece(15)
+    bitfield.set_piece(9)
+    assert list(bitfield.iter_pieces()) == [0, 2, 9]
+    assert list(BitField.full(10).iter_pieces()) == list(range(10))
+    assert BitField(b'\x80').intersects(BitField(b'\x80\x00'))
@@ -0,0 +1,72 @@
+import os
+from bisect import bisect_right
+
+
+class FileIndex:
+    """
+    maps byte ranges of the payload, which is every file of the
+    torrent back to back, onto the files they fall in. the start
+    offsets are kept sorted so finding the first file of a range
+    is a bisect, o(log files), and the rest follow in order
+    """
+
+    def __init__(self, files):
+        """
+        :param files: list of (path, length) in payload order
+        """
+        self.paths = [path for path, _ in files]
+        self.lengths = [length for _, length in files]
+        self.starts = []
+
+        position = 0
+        for length in self.lengths:
+            self.starts.append(position)
+            position += length
+        self.length = position
+
+    @classmethod
+    def from_torrent(cls, info, base):
+        """
+        :param info: TorrentInfo
+        :param base: the payload file in single file mode, or the directory
+        the torrent's files go in
+        """
+        if info.file_length() is not None:
+            return cls([(base, info.file_length())])
+
+        files = []
+        for parts, length in info.files():
+            for part in parts:
+                if part in ('', '.', '..') or os.sep in part or (os.altsep and os.altsep in part):
+                    raise ValueError(f'invalid path in torrent: {parts}')
+            files.append((os.path.join(base, *parts), length))
+
+        return cls(files)
+
+    def spans(self, position, length):
+        """
+        :returns: list of (file index, offset within the file, length),
+        empty files are skipped and ranges past the end are cut off
+        """
+
+        spans = []
+        index = bisect_right(self.starts, position) - 1
+        end = min(position + length, self.length)
+        while position < end and index < len(self.starts):
+            offset = position - self.starts[index]
+            span = min(self.lengths[index] - offset, end - position)
+            if span > 0:
+                spans.append((index, offset, span))
+                position += span
+            index += 1
+
+        return spans
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __str__(self):
+        return f"<FileIndex(files={len(self.paths)}, length={self.length})>"
+
+    def __repr__(self):
+        return self.__str__()
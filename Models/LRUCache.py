@@ -0,0 +1,81 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ least recently used cache bounded by the total size of its values """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self.data = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """ :returns: cached value or None, counting a hit or miss """
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """ insert a value, evicting the least recently used ones to make room """
+        if len(value) > self.capacity:
+            return
+
+        old = self.data.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+
+        self.data[key] = value
+        self.size += len(value)
+        while self.size > self.capacity:
+            _, evicted = self.data.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def discard(self, key):
+        """ drop a value if it's cached """
+        value = self.data.pop(key, None)
+        if value is not None:
+            self.size -= len(value)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """ :returns: dict of cache counters """
+        return {
+            'capacity MB': self.capacity / (1000 * 1000),
+            'size MB': self.size / (1000 * 1000),
+            'entries': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit rate': self.hit_rate(),
+            'evictions': self.evictions
+        }
+
+    def collect(self, labels=()):
+        """ :returns: metric samples, see Metrics """
+        return [
+            ('bt_cache_bytes', labels, self.size),
+            ('bt_cache_hits', labels, self.hits),
+            ('bt_cache_misses', labels, self.misses),
+            ('bt_cache_evictions', labels, self.evictions),
+        ]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __str__(self):
+        return f"<LRUCache(size={self.size}, capacity={self.capacity})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,169 @@
+from bisect import bisect_left
+
+
+# seconds, from a loopback round trip up to a stalled disk or peer
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    counts observations into fixed buckets. observe() is a bisect
+    and two additions, cheap enough for every block received
+    """
+
+    __slots__ = ('name', 'buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, name, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        # the last count is for observations above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """ :returns: upper bound of the bucket the q-th observation falls in """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return float('inf') if self.counts[-1] else 0.0
+
+    def samples(self):
+        """ :returns: list of (name, labels, value) in the prometheus layout, buckets are cumulative """
+        samples = []
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            samples.append((self.name + '_bucket', (('le', repr(bound)),), seen))
+        samples.append((self.name + '_bucket', (('le', '+Inf'),), self.count))
+        samples.append((self.name + '_sum', (), self.sum))
+        samples.append((self.name + '_count', (), self.count))
+        return samples
+
+    def __str__(self):
+        return f"<Histogram(name={self.name}, count={self.count}, mean={self.mean():.4f})>"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class Metrics:
+    """
+    process wide registry of what's worth watching.
+
+    latencies are recorded into histograms as they happen, everything
+    else, byte counters, queue depths and cache stats, already lives
+    on the objects that do the work and is read by collectors only
+    when the metrics are asked for, so leaving them on costs nothing
+    on the hot paths. a collector is a callable returning samples,
+    (name, labels, value) tuples with labels a tuple of (key, value)
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.descriptions = {}
+        self.collectors = []
+
+    def describe(self, name, type, help):
+        """ :param type: counter, gauge or histogram """
+        self.descriptions[name] = (type, help)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        """ :returns: the Histogram called name, created on first use """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(name, buckets)
+            self.describe(name, 'histogram', help)
+        return histogram
+
+    def add_collector(self, collector):
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def remove_collector(self, collector):
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def collect(self):
+        """ :returns: dict of metric name to list of (name, labels, value) samples """
+        families = {}
+        for histogram in self.histograms.values():
+            families[histogram.name] = histogram.samples()
+        for collector in list(self.collectors):
+            try:
+                samples = collector()
+            except Exception as e:
+                print('metrics collector failed', e)
+                continue
+            for sample in samples:
+                families.setdefault(sample[0], []).append(sample)
+        return families
+
+    def render(self):
+        """ :returns: every metric in the prometheus text exposition format """
+        lines = []
+        for name, samples in sorted(self.collect().items()):
+            type, help = self.descriptions.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type}')
+            for sample_name, labels, value in samples:
+                if labels:
+                    pairs = ','.join(f'{key}="{_escape(label)}"' for key, label in labels)
+                    lines.append(f'{sample_name}{{{pairs}}} {_number(value)}')
+                else:
+                    lines.append(f'{sample_name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def __str__(self):
+        return f"<Metrics(histograms={len(self.histograms)}, collectors={len(self.collectors)})>"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if not isinstance(value, float):
+        return str(int(value))
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+metrics = Metrics()
+
+metrics.describe('bt_downloaded_bytes', 'counter', 'verified payload bytes downloaded')
+metrics.describe('bt_uploaded_bytes', 'counter', 'payload bytes uploaded')
+metrics.describe('bt_left_bytes', 'gauge', 'payload bytes still missing')
+metrics.describe('bt_peers', 'gauge', 'connected peers')
+metrics.describe('bt_peer_downloaded_bytes', 'counter', 'bytes received from a peer')
+metrics.describe('bt_peer_uploaded_bytes', 'counter', 'bytes sent to a peer')
+metrics.describe('bt_peer_download_rate', 'gauge', 'estimated delivery rate of a peer in bytes per second')
+metrics.describe('bt_peer_outstanding_requests', 'gauge', 'block requests in flight to a peer')
+metrics.describe('bt_peer_pipeline_depth', 'gauge', 'request pipeline depth of a peer')
+metrics.describe('bt_peer_min_rtt_seconds', 'gauge', 'minimum request round trip time of a peer')
+metrics.describe('bt_outstanding_requests', 'gauge', 'block requests in flight to every peer')
+metrics.describe('bt_hash_queue_depth', 'gauge', 'pieces waiting to be hashed')
+metrics.describe('bt_hashed_bytes', 'counter', 'bytes hashed')
+metrics.describe('bt_hashed_pieces', 'counter', 'pieces hashed')
+metrics.describe('bt_write_queue_depth', 'gauge', 'verified pieces waiting to be written')
+metrics.describe('bt_cache_bytes', 'gauge', 'bytes held by the read cache')
+metrics.describe('bt_cache_hits', 'counter', 'read cache hits')
+metrics.describe('bt_cache_misses', 'counter', 'read cache misses')
+metrics.describe('bt_cache_evictions', 'counter', 'read cache evictions')
@@ -1,21 +1,37 @@
-import bencode
-from Utils import chunks, parse_host, parse_port
+from Utils import chunks, parse_host, parse_port, bencoding
 
 
 class Peers:
 
     def __init__(self, peer_data):
         self.peer_data = peer_data
-        self.bn = bencode.decode(peer_data)
+        self.bn = bencoding.decode(peer_data)
+
+    @classmethod
+    def from_compact(cls, peers, interval=None):
+        """
+        peers from a response that isn't bencoded, like the udp tracker's
+        :param peers: compact peer list, 6 bytes a peer
+        """
+        result = cls.__new__(cls)
+        result.peer_data = peers
+        result.bn = {'peers': bytes(peers), 'interval': interval}
+        return result
 
     def get_peers(self):
         """
-        parse compact peers
+        parse compact peers, or the dictionary model
         :returns: [(host, port)]
         """
 
+        peers = self.bn.get('peers') or b''
+        if isinstance(peers, list):
+            return [(peer.get('ip'), peer.get('port')) for peer in peers]
+
         result = []
-        for chunk in chunks(self.bn.get('peers'), 6):
+        for chunk in chunks(peers, 6):
+            if len(chunk) < 6:
+                break
 
             host = parse_host(chunk[0:4])
             port = parse_port(chunk[4:6])
@@ -23,6 +39,18 @@ class Peers:
 
         return result
 
+    def get_interval(self):
+        """ :returns: seconds until the next announce, or None if not present """
+        return self.bn.get('interval')
+
+    def get_min_interval(self):
+        """ :returns: seconds announces shouldn't come faster than, or None if not present (optional) """
+        return self.bn.get('min interval')
+
+    def get_failure(self):
+        """ :returns: why the tracker refused the announce, or None """
+        return self.bn.get('failure reason')
+
     def __str__(self):
         return f"<Peers()>"
 
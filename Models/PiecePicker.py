@@ -0,0 +1,165 @@
+import random
+from bisect import bisect_left, bisect_right, insort
+from Models.BitField import BitField
+
+
+class PiecePicker:
+    """
+    keeps the number of connected peers that have each piece
+    and picks the rarest piece a peer can give us.
+
+    pickable pieces live in one bucket per availability count,
+    every bucket is a list with a piece -> index map so updates
+    are o(1) swaps, and the counts that have a bucket are kept
+    sorted so pick() walks them rarest first without sorting.
+    the first few picks are random so we get whole pieces to
+    trade quickly, after that rarest first. a bitfield mask of
+    the pickable pieces lets pick() turn away peers that have
+    nothing we need without scanning
+    """
+
+    RANDOM_FIRST = 4
+    RANDOM_PROBES = 32
+
+    # bitfields covering more than this share of the torrent update
+    # the counts in bulk and rebuild the buckets in one pass
+    BULK_FRACTION = 0.25
+
+    def __init__(self, piece_count):
+        self.piece_count = piece_count
+        self.availability = [0] * piece_count
+        self.buckets = {0: list(range(piece_count))}
+        self.levels = [0] if piece_count else []
+        self.position = list(range(piece_count))
+        self.pickable = BitField.full(piece_count)
+        self.picked = 0
+
+    def _bucket_remove(self, piece):
+        count = self.availability[piece]
+        bucket = self.buckets[count]
+        index = self.position[piece]
+        last = bucket.pop()
+        if last != piece:
+            bucket[index] = last
+            self.position[last] = index
+        if not bucket:
+            del self.buckets[count]
+            del self.levels[bisect_left(self.levels, count)]
+        self.position[piece] = -1
+
+    def _bucket_add(self, piece):
+        count = self.availability[piece]
+        bucket = self.buckets.get(count)
+        if bucket is None:
+            bucket = self.buckets[count] = []
+            insort(self.levels, count)
+        self.position[piece] = len(bucket)
+        bucket.append(piece)
+
+    def is_pickable(self, piece):
+        return self.position[piece] != -1
+
+    def add(self, piece):
+        """ make a piece pickable again, e.g. after a failed download """
+        if self.position[piece] == -1:
+            self._bucket_add(piece)
+            self.pickable.set_piece(piece)
+
+    def remove(self, piece):
+        """ stop offering a piece, it's being downloaded or we have it """
+        if self.position[piece] != -1:
+            self._bucket_remove(piece)
+            self.pickable.clear_piece(piece)
+
+    def increment(self, piece):
+        """ one more peer has this piece """
+        pickable = self.position[piece] != -1
+        if pickable:
+            self._bucket_remove(piece)
+        self.availability[piece] += 1
+        if pickable:
+            self._bucket_add(piece)
+
+    def decrement(self, piece):
+        """ one less peer has this piece """
+        pickable = self.position[piece] != -1
+        if pickable:
+            self._bucket_remove(piece)
+        self.availability[piece] -= 1
+        if pickable:
+            self._bucket_add(piece)
+
+    def _rebuild(self):
+        buckets = {}
+        position = self.position
+        availability = self.availability
+        for piece in self.pickable.pieces():
+            bucket = buckets.get(availability[piece])
+            if bucket is None:
+                bucket = buckets[availability[piece]] = []
+            position[piece] = len(bucket)
+            bucket.append(piece)
+
+        self.buckets = buckets
+        self.levels = sorted(buckets)
+
+    def _update_peer(self, bitfield, delta):
+        pieces = bitfield.pieces()
+        while pieces and pieces[-1] >= self.piece_count:
+            # spare bits at the end of a peer's bitfield
+            pieces.pop()
+        if len(pieces) < self.piece_count * self.BULK_FRACTION:
+            update = self.increment if delta > 0 else self.decrement
+            for piece in pieces:
+                update(piece)
+            return
+
+        availability = self.availability
+        for piece in pieces:
+            availability[piece] += delta
+        self._rebuild()
+
+    def add_peer(self, bitfield):
+        self._update_peer(bitfield, 1)
+
+    def remove_peer(self, bitfield):
+        self._update_peer(bitfield, -1)
+
+    def is_interesting(self, bitfield):
+        """ check whether the peer has any piece we still need """
+        return self.pickable.intersects(bitfield)
+
+    def pick(self, bitfield):
+        """
+        :returns: a pickable piece the bitfield has, rarest first,
+        or None if the peer has nothing we need
+        """
+
+        if not self.pickable.intersects(bitfield):
+            return None
+
+        if self.picked < self.RANDOM_FIRST:
+            for _ in range(self.RANDOM_PROBES):
+                piece = random.randrange(self.piece_count)
+                if self.position[piece] != -1 and bitfield.has_piece(piece):
+                    self.picked += 1
+                    return piece
+
+        # pieces nobody has can't come from this peer either
+        for count in self.levels[bisect_right(self.levels, 0):]:
+            bucket = self.buckets[count]
+            size = len(bucket)
+            start = random.randrange(size)
+            for i in range(size):
+                piece = bucket[(start + i) % size]
+                if bitfield.has_piece(piece):
+                    self.picked += 1
+                    return piece
+
+        return None
+
+    def __str__(self):
+        return f"<PiecePicker(pieces={self.piece_count}, buckets={len(self.buckets)})>"
+
+    def __repr__(self):
+        return self.__str__()
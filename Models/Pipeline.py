@@ -0,0 +1,111 @@
+import math
+from time import monotonic
+from Models.Metrics import metrics
+
+
+_rtt = metrics.histogram('bt_request_rtt_seconds', 'time from a block request to the block')
+
+
+class Pipeline:
+    """
+    keeps track of the block requests in flight to one peer and
+    sizes the request queue to the peer's bandwidth-delay product,
+    estimated from the delivery rate and the minimum round trip time
+    """
+
+    BLOCK_SIZE = 1 << 14
+    START_DEPTH = 10
+    MIN_DEPTH = 4
+    MAX_DEPTH = 256
+
+    # headroom over the estimated bdp, lets the depth grow
+    # until queueing starts to inflate the round trip time
+    GAIN = 2.0
+    RATE_WINDOW = 0.25
+    RTT_WINDOW = 10.0
+
+    # a request unanswered for this long, or for twice the time the
+    # queue ahead of it should take at the current rate, is given up
+    REQUEST_TIMEOUT = 20.0
+
+    def __init__(self):
+        self.outstanding = {}
+        self.depth = self.START_DEPTH
+        self.rate = 0.0
+        self.min_rtt = None
+        self.min_rtt_stamp = 0.0
+        self.window_start = monotonic()
+        self.window_bytes = 0
+
+    def has_room(self):
+        """ check whether another request may be sent """
+        return len(self.outstanding) < self.depth
+
+    def in_flight(self):
+        """ :returns: number of outstanding requests """
+        return len(self.outstanding)
+
+    def sent(self, index, begin, length):
+        """ record a request that went out to the peer """
+        if not self.outstanding:
+            # don't count the idle time before this request as delivery time
+            self.window_start = monotonic()
+            self.window_bytes = 0
+        self.outstanding[(index, begin)] = monotonic()
+
+    def received(self, index, begin, length):
+        """ record a block that came back and update the estimates """
+        now = monotonic()
+        sent = self.outstanding.pop((index, begin), None)
+        if sent is not None:
+            rtt = now - sent
+            _rtt.observe(rtt)
+            if (self.min_rtt is None or rtt <= self.min_rtt
+                    or now - self.min_rtt_stamp > self.RTT_WINDOW):
+                self.min_rtt = rtt
+                self.min_rtt_stamp = now
+
+        self.window_bytes += length
+        elapsed = now - self.window_start
+        if elapsed >= self.RATE_WINDOW:
+            sample = self.window_bytes / elapsed
+            self.rate = sample if self.rate == 0.0 else 0.75 * self.rate + 0.25 * sample
+            self.window_start = now
+            self.window_bytes = 0
+            self._update_depth()
+
+    def cancel(self, index, begin):
+        """ forget about a request that will not be answered """
+        self.outstanding.pop((index, begin), None)
+
+    def expire(self):
+        """
+        drop the requests the peer is taking too long to answer
+        :returns: list of (index, begin) pairs that were dropped
+        """
+        timeout = self.REQUEST_TIMEOUT
+        if self.rate > 0.0:
+            timeout = max(timeout, 2 * len(self.outstanding) * self.BLOCK_SIZE / self.rate)
+
+        deadline = monotonic() - timeout
+        expired = [key for key, sent in self.outstanding.items() if sent < deadline]
+        for key in expired:
+            del self.outstanding[key]
+        return expired
+
+    def clear(self):
+        self.outstanding.clear()
+
+    def _update_depth(self):
+        if self.min_rtt is None:
+            return
+
+        bdp = self.rate * self.min_rtt
+        depth = math.ceil(self.GAIN * bdp / self.BLOCK_SIZE)
+        self.depth = max(self.MIN_DEPTH, min(self.MAX_DEPTH, depth))
+
+    def __str__(self):
+        return f"<Pipeline(depth={self.depth}, in_flight={len(self.outstanding)})>"
+
+    def __repr__(self):
+        return self.__str__()
@@ -1,30 +1,45 @@
 from enum import Enum
-import random
 import asyncio
 import math
 from hashlib import sha1
 from time import time
 from Models.ProgressBar import print_progress_bar
+from Models.PiecePicker import PiecePicker
 
 
 class RequestState(Enum):
     required = 'required'
     available = 'available'
     downloading = 'downloading'
+    verifying = 'verifying'
     race = 'race'
 
 
 class RequestQueue:
     """
     the task of this class is to keep track of
-    required pieces for a torrent file
+    required pieces for a torrent file.
+
+    peers are handed blocks, not pieces. a partial piece is shared
+    by every peer that has it, and blocks a peer won't deliver go
+    back to the pool on their own instead of resetting the piece.
+
+    once every remaining piece is being downloaded, or fewer than
+    ENDGAME_BLOCKS blocks are left, peers that run out of work
+    request blocks other peers are already downloading. the first
+    copy of a block wins and the other requests for it get cancelled
     """
 
-    def __init__(self, torrent, file_writer):
+    ENDGAME = True
+    ENDGAME_BLOCKS = 64
+
+    def __init__(self, torrent, file_writer, verifier):
         """ initialize a new queue """
         self.torrent = torrent
         self.pieces = {}
+        self.handlers = {}
         self.file_writer = file_writer
+        self.verifier = verifier
         self.peers = []
 
         self.last_percent = None
@@ -33,14 +48,9 @@ class RequestQueue:
         for i in range(torrent.get_info().piece_count()):
             self.pieces[i] = RequestState.required
 
-    def _get_required_pieces(self):
-        """ get set of remaining pieces """
-        temp = set()
-        for key, value in self.pieces.items():
-            if value == RequestState.required or value == RequestState.race:
-                temp.add(key)
-
-        return temp
+        self.picker = PiecePicker(len(self.pieces))
+        self.endgame = False
+        self.downloaded = 0
 
     def register_peer(self, peer):
         if peer not in self.peers:
@@ -49,37 +59,202 @@ class RequestQueue:
     def remove_peer(self, peer):
         if peer in self.peers:
             self.peers.remove(peer)
+            if peer.bitfield is not None:
+                self.remove_bitfield(peer.bitfield)
+
+    def add_bitfield(self, bitfield):
+        """ count the pieces of a peer's bitfield as available """
+        self.picker.add_peer(bitfield)
 
-    def get_request(self, bitfield):
+    def remove_bitfield(self, bitfield):
+        self.picker.remove_peer(bitfield)
+
+    def add_have(self, index):
+        """ a peer announced a new piece """
+        if 0 <= index < len(self.pieces):
+            self.picker.increment(index)
+
+    def get_block(self, bitfield, current=None, outstanding=()):
         """
-        cross match a required index with peer's bitfield
+        hand out the next block for a peer to request. blocks of the
+        piece the peer is on come first, then blocks nobody requested
+        yet in other partial pieces, and only then a new piece, so
+        peers share pieces instead of each opening their own
+        :param current: PieceHandler the peer got its last block from
+        :param outstanding: (piece, offset) pairs the peer already requested
+        :returns: (PieceHandler, (piece index, offset, length)) or None
         """
 
-        required = self._get_required_pieces()
-        available = bitfield.get_available_pieces()
-        intersect = required.intersection(available)
+        if current is not None and self.handlers.get(current.piece) is current:
+            piece_data = current.next_piece()
+            if piece_data is not None:
+                return current, piece_data
+
+        for piece_handler in self.handlers.values():
+            if piece_handler.has_required() and bitfield.has_piece(piece_handler.piece):
+                return piece_handler, piece_handler.next_piece()
+
+        piece_handler = self._new_piece(bitfield)
+        if piece_handler is not None:
+            return piece_handler, piece_handler.next_piece()
+
+        return self._race_block(bitfield, outstanding)
 
-        if len(intersect) == 0:
+    def _new_piece(self, bitfield):
+        """ start the rarest required piece the peer's bitfield has """
+
+        value = self.picker.pick(bitfield)
+        if value is None:
             return None
 
-        value = random.choice(list(intersect))
+        return self._start_piece(value)
+
+    def _start_piece(self, value):
+        self.picker.remove(value)
         piece_length = self.torrent.get_info().piece_length()
-        file_size = self.torrent.get_info().file_length()
+        file_size = self.torrent.get_info().total_length()
         piece_length = min(file_size - (value * piece_length), piece_length)
 
-        if self.pieces[value] != RequestState.race:
-            self.pieces[value] = RequestState.downloading
-        return PieceHandler(value, piece_length)
+        self.pieces[value] = RequestState.downloading
+        piece_handler = PieceHandler(value, piece_length)
+        self.handlers[value] = piece_handler
+        return piece_handler
+
+    def restore(self, pieces, partial=None):
+        """
+        take over what's already on disk, from resume data or a recheck
+        :param pieces: BitField of verified pieces
+        :param partial: dict of piece -> BitField of blocks written to the file
+        :returns: list of PieceHandlers rebuilt for the partial pieces
+        """
+
+        for piece in pieces.pieces():
+            if self.pieces.get(piece) == RequestState.required:
+                self.pieces[piece] = RequestState.available
+                self.picker.remove(piece)
+                self.file_writer.memory[piece] = True
+
+        restored = []
+        for piece, blocks in (partial or {}).items():
+            if self.pieces.get(piece) != RequestState.required:
+                continue
+
+            piece_handler = self._start_piece(piece)
+            for block in blocks.pieces():
+                if block >= piece_handler.block_count:
+                    break
+                offset = block * PieceHandler.BLOCK_SIZE
+                data = self.file_writer.load_block(piece, offset, piece_handler.next_length(offset))
+                if data is not None:
+                    piece_handler.restore_block(offset, data)
+
+            if piece_handler.is_complete():
+                # nothing left to request that would get it verified, start over
+                del self.handlers[piece]
+                self.pieces[piece] = RequestState.required
+                self.picker.add(piece)
+                continue
+
+            restored.append(piece_handler)
+
+        return restored
+
+    def in_endgame(self):
+        """ check whether the remaining blocks are few enough to race for """
+
+        if not self.ENDGAME or not self.handlers:
+            return False
+
+        if self.endgame:
+            return True
+
+        pickable = self.picker.pickable.count()
+        if pickable == 0:
+            return True
+
+        blocks = sum(handler.remaining for handler in self.handlers.values())
+        blocks += pickable * math.ceil(
+            self.torrent.get_info().piece_length() / PieceHandler.BLOCK_SIZE
+        )
+        return blocks <= self.ENDGAME_BLOCKS
+
+    def _race_block(self, bitfield, outstanding):
+        """ hand out a block someone else is downloading, in endgame only """
+
+        if not self.in_endgame():
+            return None
+
+        for piece_handler in self.handlers.values():
+            if not bitfield.has_piece(piece_handler.piece):
+                continue
+
+            piece_data = piece_handler.next_duplicate(outstanding)
+            if piece_data is not None:
+                self.endgame = True
+                self.pieces[piece_handler.piece] = RequestState.race
+                return piece_handler, piece_data
+
+        return None
+
+    async def block_received(self, sender, index, begin, block):
+        """
+        store a block a peer delivered, cancel the copies other peers
+        were asked for in endgame and verify the piece once it's complete
+        """
+
+        piece_handler = self.handlers.get(index)
+        if piece_handler is None:
+            # a late copy, the piece is already done
+            return
+
+        if not piece_handler.received(index, begin, block):
+            return
+        self.downloaded += len(block)
+
+        if self.endgame:
+            await self.cancel_duplicates(sender, index, begin, len(block))
+
+        if piece_handler.is_complete():
+            await self.confirm_download(piece_handler)
+
+    async def cancel_duplicates(self, sender, index, begin, length):
+        """ a raced block arrived, cancel it at every other peer that requested it """
+
+        for peer in self.peers:
+            if peer is not sender and (index, begin) in peer.pipeline.outstanding:
+                await peer.queue_cancel(index, begin, length)
+
+    def return_blocks(self, requests, owner=None):
+        """
+        a peer won't deliver these blocks, make them requestable again.
+        in endgame a block another peer still has requested stays with it
+        :param requests: (piece, offset) pairs
+        :param owner: the peer they were requested from
+        """
+
+        for index, begin in requests:
+            piece_handler = self.handlers.get(index)
+            if piece_handler is None:
+                continue
+            if self.endgame and any(
+                peer is not owner and (index, begin) in peer.pipeline.outstanding
+                for peer in self.peers
+            ):
+                continue
+            piece_handler.reset_block(begin)
 
     def cancel_piece(self, index):
-        """ for when a peer fails to deliver a piece """
+        """ drop a partial piece and everything downloaded for it """
 
-        if self.pieces.get(index) == RequestState.downloading:
+        if self.pieces.get(index) in (RequestState.downloading, RequestState.race):
             self.pieces[index] = RequestState.required
+            self.handlers.pop(index, None)
+            self.picker.add(index)
 
     def cancel_all(self):
-        for key in self.pieces.keys():
-            self.cancel_piece(key)
+        """ for when peers stop delivering, every requested block is up for grabs again """
+        for piece_handler in self.handlers.values():
+            piece_handler.reset_downloading()
 
     async def confirm_download(self, piece_handler):
         """ confirm downloaded piece """
@@ -89,12 +264,26 @@ class RequestQueue:
 
         state = self.pieces.get(piece_handler.piece)
         if state == RequestState.downloading or state == RequestState.race:
-            if self._verify_piece(piece_handler):
-                self.pieces[piece_handler.piece] = RequestState.available
-                self.file_writer.add_piece(piece_handler)
-                await self.write_available(piece_handler)
-            else:
-                self.pieces[piece_handler.piece] = RequestState.required
+            self.pieces[piece_handler.piece] = RequestState.verifying
+            self.handlers.pop(piece_handler.piece, None)
+            expected_hash = self.torrent.get_info().piece_hash(piece_handler.piece)
+            await self.verifier.verify(
+                piece_handler, expected_hash, self._piece_verified
+            )
+
+    async def _piece_verified(self, piece_handler, valid):
+        """ called by the verifier once a piece has been hashed """
+
+        if self.pieces.get(piece_handler.piece) != RequestState.verifying:
+            return
+
+        if valid:
+            self.pieces[piece_handler.piece] = RequestState.available
+            self.file_writer.add_piece(piece_handler)
+            await self.write_available(piece_handler)
+        else:
+            self.pieces[piece_handler.piece] = RequestState.required
+            self.picker.add(piece_handler.piece)
 
         if self.is_finished():
             await self.finalize_download()
@@ -105,17 +294,35 @@ class RequestQueue:
                 continue
             await peer.queue_available(piece_handler)
 
-    def _verify_piece(self, piece_handler):
-        piece_hash = piece_handler.create_hash()
-        expected_hash = self.torrent.get_info().pieces()[piece_handler.piece]
-        return piece_hash == expected_hash
-
     async def finalize_download(self):
         await self.single_progress()
         await self.file_writer.finish_writing()
-        for peer in self.peers:
+        for peer in list(self.peers):
             await peer.gracefully_shutdown()
 
+    def left(self):
+        """ :returns: number of bytes not verified yet """
+        info = self.torrent.get_info()
+        piece_length = info.piece_length()
+        total = info.total_length()
+        left = 0
+        for piece, state in self.pieces.items():
+            if state != RequestState.available:
+                left += min(piece_length, total - piece * piece_length)
+        return left
+
+    def collect(self, labels=()):
+        """ :returns: metric samples of the download and each of its peers, see Metrics """
+        samples = [
+            ('bt_downloaded_bytes', labels, self.downloaded),
+            ('bt_left_bytes', labels, self.left()),
+            ('bt_peers', labels, len(self.peers)),
+            ('bt_outstanding_requests', labels, sum(peer.pipeline.in_flight() for peer in self.peers)),
+        ]
+        for peer in self.peers:
+            samples += peer.collect(labels)
+        return samples
+
     def is_finished(self):
         """ check whether all the pieces have been downloaded """
         for key, value in self.pieces.items():
@@ -140,7 +347,7 @@ class RequestQueue:
 
         tot_len = len(self.pieces)
         progress = float(finished) / float(tot_len)
-        file_len = self.torrent.get_info().file_length() or 0
+        file_len = self.torrent.get_info().total_length()
         mb = float(file_len * progress) / (1000 * 1000)
         if progress * 100 <= 100:
             print_progress_bar(progress * 100, mb, len(self.peers))
@@ -159,76 +366,122 @@ class RequestQueue:
 
 
 class PieceHandler:
+    """
+    assembles one piece in a preallocated buffer, blocks are
+    written in place at their 16 KiB aligned offsets and their
+    state is kept in a compact per-block array
+    """
+
+    BLOCK_SIZE = 1 << 14
 
-    MAX_SIZE = 16000
-    MAX_IN_FLIGHT = 10
+    BLOCK_REQUIRED = 0
+    BLOCK_DOWNLOADING = 1
+    BLOCK_AVAILABLE = 2
 
     def __init__(self, piece, length):
         self.piece = piece
         self.length = length
-        self.data = {}
-        self.status = {}
-        self._populate_data()
+        self.buffer = bytearray(length)
+        self.view = memoryview(self.buffer)
+        self.block_count = math.ceil(float(length) / float(self.BLOCK_SIZE))
+        self.status = bytearray(self.block_count)
+        self.remaining = self.block_count
         self.req_count = 0
 
-    def _populate_data(self):
-        """ populate expected indices """
-        block_count = math.ceil(float(self.length) / float(self.MAX_SIZE))
-        for block_index in range(block_count):
-            self.data[block_index * self.MAX_SIZE] = None
-            self.status[block_index * self.MAX_SIZE] = RequestState.required
-
     def is_complete(self):
-        for value in self.status.values():
-            if value != RequestState.available:
-                return False
+        return self.remaining == 0
 
-        return True
+    def has_required(self):
+        """ check whether a block is left that nobody requested """
+        return self.status.find(self.BLOCK_REQUIRED) != -1
 
     def received(self, index, begin, block):
+        """
+        store a block that was requested and hasn't arrived yet
+        :returns: True if the block was stored, falsy for duplicates, unrequested and bad blocks
+        """
         if not index == self.piece:
             return print('invalid piece', self.piece, index)
 
-        if begin not in self.data:
+        block_index, misaligned = divmod(begin, self.BLOCK_SIZE)
+        if misaligned or block_index >= self.block_count:
             return print('invalid block', begin)
 
-        if self.status[begin] != RequestState.downloading:
-            return print('invalid request state', self.status[begin])
+        if self.status[block_index] != self.BLOCK_DOWNLOADING:
+            # another peer's copy came first, or nobody asked for it (anymore)
+            return False
+
+        if len(block) != self.next_length(begin):
+            return print('invalid block length', begin, len(block))
 
-        self.data[begin] = block
-        self.status[begin] = RequestState.available
         self.req_count -= 1
+        self._store(block_index, begin, block)
+        return True
+
+    def restore_block(self, begin, block):
+        """ take over a block that is already on disk, before anything is requested """
+        block_index = begin // self.BLOCK_SIZE
+        if self.status[block_index] == self.BLOCK_REQUIRED and len(block) == self.next_length(begin):
+            self._store(block_index, begin, block)
+
+    def _store(self, block_index, begin, block):
+        self.view[begin:begin + len(block)] = block
+        self.status[block_index] = self.BLOCK_AVAILABLE
+        self.remaining -= 1
 
     def next_length(self, index):
-        return min(self.MAX_SIZE, self.length - index)
+        return min(self.BLOCK_SIZE, self.length - index)
 
     def next_piece(self):
         """
-        get next block within this piece
+        get next block within this piece nobody requested yet
         :returns: (piece index, offset within piece, length of block)
         """
-        if self.req_count > self.MAX_IN_FLIGHT:
+        block_index = self.status.find(self.BLOCK_REQUIRED)
+        if block_index == -1:
             return None
 
-        for offset, value in self.status.items():
-            if value == RequestState.required:
-                self.req_count += 1
-                self.status[offset] = RequestState.downloading
+        self.req_count += 1
+        self.status[block_index] = self.BLOCK_DOWNLOADING
+        offset = block_index * self.BLOCK_SIZE
+        return self.piece, offset, self.next_length(offset)
+
+    def next_duplicate(self, outstanding=()):
+        """
+        get a block another peer is already downloading, for endgame
+        :param outstanding: (piece, offset) pairs the caller already requested
+        :returns: (piece index, offset within piece, length of block)
+        """
+        block_index = self.status.find(self.BLOCK_DOWNLOADING)
+        while block_index != -1:
+            offset = block_index * self.BLOCK_SIZE
+            if (self.piece, offset) not in outstanding:
                 return self.piece, offset, self.next_length(offset)
+            block_index = self.status.find(self.BLOCK_DOWNLOADING, block_index + 1)
+
         return None
 
-    def get_data(self):
-        total = b''
-        for key in sorted(self.data.keys()):
-            total += self.data.get(key)
+    def reset_block(self, begin):
+        """ a requested block won't arrive, hand it out again """
+        block_index = begin // self.BLOCK_SIZE
+        if block_index < self.block_count and self.status[block_index] == self.BLOCK_DOWNLOADING:
+            self.status[block_index] = self.BLOCK_REQUIRED
+            self.req_count -= 1
 
-        return total
+    def reset_downloading(self):
+        """ hand out every requested block again """
+        self.status = self.status.replace(bytes((self.BLOCK_DOWNLOADING,)), bytes((self.BLOCK_REQUIRED,)))
+        self.req_count = 0
+
+    def get_data(self):
+        """ :returns: memoryview over the assembled piece """
+        return self.view
 
     def create_hash(self):
-        return sha1(self.get_data()).digest()
+        return sha1(self.view).digest()
 
     def __str__(self):
         return f"<PieceHandler(piece={self.piece})>"
 
     def __repr__(self):
-        return self.__str__()
\ No newline at end of file
+        return self.__str__()
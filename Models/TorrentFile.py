@@ -1,16 +1,23 @@
-from Utils import chunks
 from hashlib import sha1
-import bencode
+from types import MappingProxyType
+from Utils import bencoding
 import random
 import string
 
 
 class TorrentInfo:
+    """
+    read-only view of the info dictionary, built once per torrent.
+    the piece hashes stay one read-only buffer and are sliced out
+    when asked for
+    """
+
+    __slots__ = ('info_bn', 'hashes', '_total_length')
 
     def __init__(self, info_bn):
-        self.info_bn = info_bn
-        pieces = self.info_bn.get('pieces')
-        self.piece_arr = list(chunks(pieces, 20))
+        self.info_bn = MappingProxyType(info_bn)
+        self.hashes = memoryview(info_bn.get('pieces') or b'').toreadonly()
+        self._total_length = None
 
     def file_name(self):
         """ :returns: file name (single file mode) or directory name (multi-file mode) """
@@ -21,8 +28,12 @@ class TorrentInfo:
         return self.info_bn.get('piece length')
 
     def pieces(self):
-        """ :returns: list of 20 character sha1 hash """
-        return self.piece_arr
+        """ :returns: list of 20 byte sha1 hashes, builds the list, piece_hash is cheaper """
+        return [self.piece_hash(index) for index in range(self.piece_count())]
+
+    def piece_hash(self, index):
+        """ :returns: 20 byte sha1 hash of a piece """
+        return bytes(self.hashes[index * 20:index * 20 + 20])
 
     def private(self):
         """ :returns: integer 1 or 0; 0 if not present (optional) """
@@ -42,9 +53,28 @@ class TorrentInfo:
         """ :returns: list of paths """
         return self.info_bn.get('path', None)
 
+    def files(self):
+        """
+        :returns: list of (path components, length) in payload order, a
+        single entry named after the torrent in single file mode
+        """
+        files = self.info_bn.get('files')
+        if files is None:
+            return [([self.file_name()], self.file_length())]
+        return [(file.get('path'), file.get('length')) for file in files]
+
+    def total_length(self):
+        """ :returns: number of bytes in the whole payload, in either mode """
+        if self._total_length is None:
+            length = self.file_length()
+            if length is None:
+                length = sum(length for _, length in self.files())
+            self._total_length = length
+        return self._total_length
+
     def piece_count(self):
         """ :returns: number of pieces """
-        return len(self.pieces())
+        return len(self.hashes) // 20
 
     def md5sum(self):
         """ :returns: file's md5 hex digest, or None if not present (optional) """
@@ -60,8 +90,15 @@ class TorrentFile:
 
     def __init__(self, path):
         self.path = path
-        self.data = open(path, 'rb').read()
-        self.bn = bencode.decode(self.data)
+        with open(path, 'rb') as file:
+            self.data = file.read()
+
+        # hashed from the original bytes, re-encoding could reorder or normalize them
+        self.bn, span = bencoding.decode(self.data, span='info')
+        if span is None:
+            raise bencoding.BencodeError(f'{path} has no info dictionary')
+        self.info_hash = sha1(memoryview(self.data)[span[0]:span[1]]).digest()
+        self.info = TorrentInfo(self.bn['info'])
 
     def get_announce(self):
         """ :returns: url of tracker """
@@ -104,12 +141,11 @@ class TorrentFile:
 
     def get_info(self):
         """ :returns: TorrentInfo instance """
-        return TorrentInfo(self.bn.get('info'))
+        return self.info
 
     def get_info_hash(self):
-        """ :returns: create a hash from info """
-        data = bencode.encode(self.bn.get('info'))
-        return sha1(data).digest()
+        """ :returns: sha1 digest of the info dictionary """
+        return self.info_hash
 
     @classmethod
     def peer_id(cls):
@@ -1,3 +1,8 @@
 from .TorrentFile import TorrentFile
 from .BitField import BitField
 from .RequestQueue import RequestQueue, RequestState
+from .Pipeline import Pipeline
+from .LRUCache import LRUCache
+from .PiecePicker import PiecePicker
+from .FileIndex import FileIndex
+from .Metrics import Metrics, Histogram, metrics
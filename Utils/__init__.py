@@ -40,32 +40,17 @@ def byte_to_bit(b):
 
 
 def blist_to_bits(blist):
-    result = ''
-    for i in chunks(blist.hex(), 2):
-        result += byte_to_bit(i)
+    if not blist:
+        return ''
+    return bin(int.from_bytes(blist, 'big'))[2:].zfill(len(blist) * 8)
 
-    return result
 
-
-def create_bits(data, piece_count):
-    b = ''
+def create_bitfield(data, piece_count):
+    bits = bytearray((piece_count + 7) // 8)
     for i in range(piece_count):
-        b += '1' if data.get(i, False) else '0'
-
-    pieces = list(chunks(b, 8))
-    result = []
-    for piece in pieces:
-        result.append(piece[::-1].zfill(8)[::-1])
-
-    return ''.join(result)
+        if data.get(i, False):
+            bits[i >> 3] |= 0x80 >> (i & 7)
 
-
-def hex_from_bits(bits):
-    return bytes.fromhex(hex(int(bits, 2))[2:])
-
-
-def create_bitfield(data, piece_count):
-    bits = create_bits(data, piece_count)
-    return hex_from_bits(bits)
+    return bytes(bits)
 
 
@@ -0,0 +1,162 @@
+"""
+bencoding, as described in
+https://wiki.theory.org/index.php/BitTorrentSpecification#Bencoding
+
+decoding is a single pass over the original bytes with no
+intermediate copies, it can also locate the raw bytes of a top level
+value, the info dictionary for the info hash. strings come back as
+str when they're valid utf-8 and as bytes otherwise, except for the
+values of the binary keys which always stay bytes. BINARY_KEYS are
+the ones of metainfo and tracker responses, other formats pass their own
+"""
+
+BINARY_KEYS = frozenset(('pieces', 'peers', 'peers6'))
+
+
+class BencodeError(ValueError):
+    pass
+
+
+def _string(data, i, binary):
+    colon = data.index(b':', i)
+    length = int(data[i:colon])
+    start = colon + 1
+    end = start + length
+    if length < 0 or end > len(data):
+        raise BencodeError(f'string at {i} runs past the end')
+
+    raw = data[start:end]
+    if binary:
+        return raw, end
+
+    try:
+        return raw.decode(), end
+    except UnicodeDecodeError:
+        return raw, end
+
+
+def _value(data, i, keys, binary=False):
+    """ :returns: (value, index past it) """
+
+    c = data[i]
+    if c == 0x69:  # i
+        end = data.index(b'e', i)
+        return int(data[i + 1:end]), end + 1
+
+    if c == 0x6c:  # l
+        i += 1
+        items = []
+        while data[i] != 0x65:
+            item, i = _value(data, i, keys)
+            items.append(item)
+        return items, i + 1
+
+    if c == 0x64:  # d
+        i += 1
+        result = {}
+        while data[i] != 0x65:
+            key, i = _string(data, i, False)
+            result[key], i = _value(data, i, keys, key in keys)
+        return result, i + 1
+
+    if 0x30 <= c <= 0x39:
+        return _string(data, i, binary)
+
+    raise BencodeError(f'unexpected byte {c:#x} at {i}')
+
+
+def decode(data, span=None, binary=BINARY_KEYS):
+    """
+    :param data: bytes of a bencoded value
+    :param span: key of the top level dictionary whose raw bytes should be located
+    :param binary: dictionary keys whose string values are never decoded to str
+    :returns: the value, or (value, (start, end)) of the span key's bytes when span is given
+    :raises BencodeError: if data isn't bencoded
+    """
+
+    data = bytes(data)
+    try:
+        if span is None:
+            value, end = _value(data, 0, binary)
+            located = None
+        elif data[0] != 0x64:
+            raise BencodeError('not a dictionary')
+        else:
+            value = {}
+            located = None
+            i = 1
+            while data[i] != 0x65:
+                key, i = _string(data, i, False)
+                start = i
+                value[key], i = _value(data, i, binary, key in binary)
+                if key == span:
+                    located = (start, i)
+            end = i + 1
+    except (IndexError, ValueError) as e:
+        if isinstance(e, BencodeError):
+            raise
+        raise BencodeError(f'malformed data: {e}')
+
+    if end != len(data):
+        raise BencodeError(f'{len(data) - end} bytes of trailing data')
+
+    if span is None:
+        return value
+    return value, located
+
+
+def _encode(value, out):
+    if isinstance(value, str):
+        value = value.encode()
+
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(str(len(value)).encode())
+        out.append(b':')
+        out.append(value)
+    elif isinstance(value, bool) or not isinstance(value, (int, list, tuple, dict)):
+        raise TypeError(f"can't bencode {type(value).__name__}")
+    elif isinstance(value, int):
+        out.append(b'i%de' % value)
+    elif isinstance(value, (list, tuple)):
+        out.append(b'l')
+        for item in value:
+            _encode(item, out)
+        out.append(b'e')
+    else:
+        out.append(b'd')
+        items = sorted(
+            (key.encode() if isinstance(key, str) else bytes(key), item)
+            for key, item in value.items()
+        )
+        for key, item in items:
+            _encode(key, out)
+            _encode(item, out)
+        out.append(b'e')
+
+
+def encode(value):
+    """ :returns: bytes of the bencoded value, dictionary keys are sorted """
+    out = []
+    _encode(value, out)
+    return b''.join(out)
+
+
+if __name__ == '__main__':
+
+    metainfo = {'announce': 'http://tracker/announce', 'info': {'name': 'x', 'pieces': b'\xff' * 20}}
+    data = encode(metainfo)
+    value, (start, end) = decode(data, span='info')
+    assert value == metainfo and data[start:end] == encode(metainfo['info'])
+
+    # text that only looks binary to BINARY_KEYS stays text without them
+    resume = {'pieces': 'ff00', 'partial': [[3, 'c0']]}
+    assert decode(encode(resume)) == {'pieces': b'ff00', 'partial': [[3, 'c0']]}
+    assert decode(encode(resume), binary=()) == resume
+    assert decode(b'i-3e') == -3 and decode(b'le') == [] and decode(b'3:\xff\x00a') == b'\xff\x00a'
+    for bad in (b'', b'i1', b'5:ab', b'de1', b'x'):
+        try:
+            decode(bad)
+        except BencodeError:
+            pass
+        else:
+            raise AssertionError(bad)
@@ -1,80 +1,79 @@
 #!/usr/bin/python3
 
-from Models import TorrentFile, RequestQueue
+from Models import TorrentFile, metrics
 from Controllers import *
-from Utils import create_bitfield
 import asyncio
 import argparse
+import os
 import socket
 import ipaddress
 
 
-async def download_client(peer, torrent, request_queue):
-
-    conn = ClientConnection(peer[0], peer[1], torrent, request_queue)
-
-    try:
-        conn.am_interested = True
-        await conn.connect()
-    except Exception as e:
-        await conn.gracefully_shutdown()
-
-
-def start_download(path):
+def start_download(path, port=6881, upload_slots=Choker.SLOTS, limiter=None,
+                   max_peers=ConnectionManager.MAX_PEERS, metrics_port=None):
 
     loop = asyncio.get_event_loop()
     torrent = TorrentFile(path)
-    peer_data = Tracker(torrent).get_peers()
-
-    peers = peer_data.get_peers()
-    file_writer = FileWriter(torrent, loop)
-    request_queue = RequestQueue(torrent, file_writer)
+    download = Download(torrent, port=port, upload_slots=upload_slots, limiter=limiter, max_peers=max_peers)
 
     print('File', torrent.get_info().file_name())
-    print(f"Peers ({len(peers)})")
-
-    loop.create_task(request_queue.print_progress())
-    cli = Cli(request_queue)
-    loop.create_task(cli.start())
 
-    for peer in peers:
-        print(f"Peer {peer[0]}:{peer[1]}")
+    metrics.add_collector(download.collect)
+    if metrics_port:
+        loop.run_until_complete(MetricsServer(metrics_port).start())
 
-    for peer in peers:
-        loop.create_task(download_client(peer, torrent, request_queue))
+    loop.create_task(download.request_queue.print_progress())
+    cli = Cli(
+        torrent, download.request_queue, download.file_writer.reader,
+        download.choker, limiter, download.connections
+    )
+    loop.create_task(cli.start())
 
-    loop.run_until_complete(file_writer.worker())
+    loop.run_until_complete(download.run())
     print('Done!!')
 
 
-async def start_seeding(host, port, torrent_path, payload_path):
+async def start_seeding(host, port, torrent_path, payload_path,
+                        cache_size=FileReader.CACHE_SIZE, upload_slots=Choker.SLOTS, limiter=None,
+                        metrics_port=None, recheck=False):
 
-    torrent = TorrentFile(path=torrent_path)
-    Tracker(torrent).get_peers(
-        port=port, downloaded=torrent.get_info().file_length(),
-        event='completed'
-    )
-    data = FileDivider.divide_file(
-        payload_path, torrent.get_info().piece_length(),
-        torrent.get_info().piece_count()
+    session = Session(host, port, cache_size, upload_slots, limiter)
+    await session.start()
+    if metrics_port:
+        await MetricsServer(metrics_port).start()
+
+    print('Checking', payload_path)
+    seed = await session.add_seed(torrent_path, payload_path, Recheck.print_progress, recheck)
+    asyncio.get_event_loop().create_task(
+        Cli(seed.torrent, file_reader=seed.file_reader, choker=session.choker, limiter=limiter).start()
     )
 
-    bitfield = create_bitfield(data, torrent.get_info().piece_count())
+    print(f'Listening on {host}:{port}')
+    try:
+        await session.serve_forever()
+    finally:
+        await session.close()
 
-    async def seed_client(reader, writer):
 
-        conn = SeedConnection(torrent, bitfield)
-        host, port = writer.get_extra_info('peername')
-        print(f'New Connection from {host}:{port}')
+async def start_session(host, port, directory, cache_size=FileReader.CACHE_SIZE,
+                        upload_slots=Choker.SLOTS, limiter=None, max_peers=ConnectionManager.MAX_PEERS,
+                        metrics_port=None):
+    """ download or seed every .torrent in directory, the payloads live next to them """
 
-        try:
-            await conn.start(reader, writer)
-        except Exception as e:
-            await conn.gracefully_shutdown()
+    session = Session(host, port, cache_size, upload_slots, limiter, max_peers)
+    await session.start()
+    if metrics_port:
+        await MetricsServer(metrics_port).start()
 
-    print(f'Listening on {host}:{port}')
-    server = await asyncio.start_server(seed_client, host, port)
-    await server.serve_forever()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.torrent'):
+            await session.add_download(os.path.join(directory, name), directory)
+
+    print(f'Listening on {host}:{port} for {len(session.torrents)} torrents')
+    try:
+        await session.serve_forever()
+    finally:
+        await session.close()
 
 
 if __name__ == '__main__':
@@ -82,17 +81,59 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Setting up the BitTorrent Client's Argument Parser")
     parser.add_argument('-p', "--port", type=int, help="This is the host's port number.")
     parser.add_argument('-t', type=str, help="This is the path of the torrent file.")
-    parser.add_argument('-a', type=str, choices=['download', 'seed'], help="This is the action being done.")
-    parser.add_argument('-f', type=str, help="This is the path to the payload.")
+    parser.add_argument('-a', type=str, choices=['download', 'seed', 'session'], help="This is the action being done.")
+    parser.add_argument('-d', type=str, help="This is the directory of the torrents a session hosts.")
+    parser.add_argument('-f', type=str, help="This is the path to the payload, the directory holding the torrent's files for multi-file torrents.")
+    parser.add_argument('-c', "--cache", type=int, default=FileReader.CACHE_SIZE // (1024 * 1024),
+                        help="This is the size of the read cache in MiB, 0 disables it.")
+    parser.add_argument('-u', "--upload-slots", type=int, default=Choker.SLOTS,
+                        help="This is the number of peers uploaded to at once, plus one optimistic unchoke.")
+    parser.add_argument("--max-peers", type=int, default=ConnectionManager.MAX_PEERS,
+                        help="This is the number of peers downloaded from at once.")
+    parser.add_argument("--metrics", type=int,
+                        help="This is the loopback port metrics are served on in the Prometheus text format.")
+    parser.add_argument("--recheck", action='store_true',
+                        help="This hashes the payload before seeding even if its resume data is up to date.")
+    parser.add_argument("--up", type=int, default=0, help="This is the upload limit in KiB/s, 0 is unlimited.")
+    parser.add_argument("--down", type=int, default=0, help="This is the download limit in KiB/s, 0 is unlimited.")
+    parser.add_argument("--peer-up", type=int, default=0, help="This is the upload limit per peer in KiB/s.")
+    parser.add_argument("--peer-down", type=int, default=0, help="This is the download limit per peer in KiB/s.")
     args = parser.parse_args()
 
+    limiter = RateLimiter(
+        upload=args.up * 1024, download=args.down * 1024,
+        peer_upload=args.peer_up * 1024, peer_download=args.peer_down * 1024
+    )
+
     if args.a == "download":
 
         if args.t is None:
             print("missing path to the torrent file")
             exit()
 
-        start_download(path=args.t)
+        start_download(
+            path=args.t, port=args.port or 6881, upload_slots=args.upload_slots,
+            limiter=limiter, max_peers=args.max_peers, metrics_port=args.metrics
+        )
+
+    elif args.a == "session":
+
+        if not args.port or not args.d:
+            print('missing -p or -d')
+            exit()
+
+        asyncio.get_event_loop().run_until_complete(
+            start_session(
+                host=ipaddress.IPv4Address(socket.INADDR_ANY).compressed,
+                port=args.port,
+                directory=args.d,
+                cache_size=args.cache * 1024 * 1024,
+                upload_slots=args.upload_slots,
+                limiter=limiter,
+                max_peers=args.max_peers,
+                metrics_port=args.metrics
+            )
+        )
 
     else:
 
@@ -105,6 +146,11 @@ if __name__ == '__main__':
                 host=ipaddress.IPv4Address(socket.INADDR_ANY).compressed,
                 port=args.port,
                 torrent_path=args.t,
-                payload_path=args.f
+                payload_path=args.f,
+                cache_size=args.cache * 1024 * 1024,
+                upload_slots=args.upload_slots,
+                limiter=limiter,
+                metrics_port=args.metrics,
+                recheck=args.recheck
             )
         )